@@ -0,0 +1,470 @@
+"""
+Offline backtest of the webhook strategies on historical signals and bars.
+
+Signals are replayed through the same ig_decide kernel the handler uses,
+with each instrument's rule from instrument_rules.json: reverse on an
+opposite signal for Brent and wheat, explicit close for the DAX, the same
+stop and limit levels from the quote, and the same rejections. A signal is
+filled at the open of the first bar at or after it, buying at the offer
+and selling at the bid.
+
+Stops and limits are found without a per-bar loop. The bars between two
+signals are one segment, and within each segment the running low and high
+of the bid and offer are computed once. The first bar that reaches a level
+is then a binary search on those running extremes. That works for any
+number of parameter sets at once, so run() takes stop, limit and adjust as
+arrays and backtests all of them together. sweep.py builds on this.
+
+When a bar reaches both the stop and the limit, the stop is assumed to be
+hit first. A level the bar gaps through is filled at the bar's open.
+
+    python backtest.py --generate 30
+    python backtest.py --signals alerts.csv --bars DAX=dax.csv --param DAX.stop=150 --param DAX.limit=50
+    python backtest.py --signals alerts.csv --store prices --start 2025-01-01
+
+Signals: CSV with time, ticker, side columns, or JSON lines with those keys.
+Bars: CSV with time, open, high, low, close and optional spread columns
+(mid prices), or bid_open ... ask_close for separate bid and offer prices.
+Or --store: an ig_store directory, read memory-mapped from the first signal
+on, so only the bars the backtest walks through are paged in.
+Times are epoch seconds or ISO 8601, in UTC.
+"""
+import argparse
+import random
+import json
+import copy
+import csv
+import os
+
+import numpy as np
+
+import ig_decide
+import ig_rules
+import ig_store
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Indexes into ig_decide.ACTIONS.
+OPEN, CLOSE, REVERSE, REJECT = range(len(ig_decide.ACTIONS))
+BUY, SELL, FLAT = ig_decide.BUY, ig_decide.SELL, ig_decide.FLAT
+
+# Exit reasons.
+EXITS = ("stop", "limit", "signal", "end")
+STOP, LIMIT, SIGNAL, END = range(4)
+
+# Spreads and starting prices for --generate, as the fake gateway quotes them.
+GENERATED = {
+    "Oil - Brent Crude": ("UKOIL", 6512.3, 2.8, 4.0),
+    "Germany 30": ("DAX", 12001.2, 1.2, 6.0),
+    "Chicago Wheat": ("WHEATUSD", 495.1, 0.8, 0.6)}
+
+
+class Bars:
+    """Bid and offer OHLC bars for one instrument, times in epoch seconds."""
+
+    __slots__ = ('time', 'bid_open', 'bid_high', 'bid_low', 'bid_close',
+                 'ask_open', 'ask_high', 'ask_low', 'ask_close')
+
+    def __init__(self, time, bid_open, bid_high, bid_low, bid_close, ask_open, ask_high, ask_low, ask_close):
+        self.time = time
+        self.bid_open = bid_open
+        self.bid_high = bid_high
+        self.bid_low = bid_low
+        self.bid_close = bid_close
+        self.ask_open = ask_open
+        self.ask_high = ask_high
+        self.ask_low = ask_low
+        self.ask_close = ask_close
+
+    @classmethod
+    def from_mid(cls, time, o, h, l, c, spread):
+        half = np.asarray(spread, dtype=np.float64) / 2
+        return cls(time, o - half, h - half, l - half, c - half, o + half, h + half, l + half, c + half)
+
+    def __len__(self):
+        return len(self.time)
+
+    def between(self, start=None, end=None):
+        """The bars with start <= time < end, either bound optional."""
+
+        lo = 0 if start is None else int(np.searchsorted(self.time, start, side='left'))
+        hi = len(self) if end is None else int(np.searchsorted(self.time, end, side='left'))
+        return Bars(*(getattr(self, f)[lo:hi] for f in self.__slots__))
+
+
+def epoch(values):
+    """Epoch seconds from epoch numbers or ISO 8601 strings."""
+
+    try:
+        return np.asarray(values, dtype=np.float64).astype(np.int64)
+    except ValueError:
+        return np.array([v.rstrip("Z") for v in values], dtype='datetime64[s]').astype(np.int64)
+
+
+def load_bars(path):
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise ValueError(path + ": no bars")
+    cols = {k: [r[k] for r in rows] for k in rows[0]}
+    time = epoch(cols['time'])
+    num = lambda k: np.asarray(cols[k], dtype=np.float64)
+    if 'bid_open' in cols:
+        return Bars(time, *(num(side + "_" + f) for side in ("bid", "ask") for f in ("open", "high", "low", "close")))
+    spread = num('spread') if 'spread' in cols else 0.0
+    return Bars.from_mid(time, num('open'), num('high'), num('low'), num('close'), spread)
+
+
+def load_signals(path):
+    """[(time, ticker, side)] in time order."""
+
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    times = epoch([r['time'] for r in rows])
+    out = [(int(t), r['ticker'], r['side']) for t, r in zip(times, rows)]
+    out.sort(key=lambda s: s[0])
+    return out
+
+
+def variant(rule, stop=None, limit=None, adjust=None):
+    """A copy of rule with stop, limit and adjust replaced, scalars or arrays."""
+
+    rule = copy.copy(rule)
+    if stop is not None:
+        rule.stop = stop
+    if limit is not None:
+        rule.limit = limit
+    if adjust is not None:
+        rule.adjust = adjust
+    return rule
+
+
+class Segments:
+    """
+    Bars split at signal bars, with running extremes restarted at each split:
+    the lowest bid and offer and the highest bid and offer so far in the
+    segment. Computed once per signal list, whatever the parameters.
+    """
+
+    def __init__(self, bars, starts):
+        self.bars = bars
+        n = len(bars)
+        self.bounds = np.unique(np.concatenate(([0], np.asarray(starts, dtype=np.int64), [n])))
+        self.bid_low = np.empty(n)
+        self.bid_high = np.empty(n)
+        self.ask_low = np.empty(n)
+        self.ask_high = np.empty(n)
+        for a, b in zip(self.bounds[:-1], self.bounds[1:]):
+            np.minimum.accumulate(bars.bid_low[a:b], out=self.bid_low[a:b])
+            np.maximum.accumulate(bars.bid_high[a:b], out=self.bid_high[a:b])
+            np.minimum.accumulate(bars.ask_low[a:b], out=self.ask_low[a:b])
+            np.maximum.accumulate(bars.ask_high[a:b], out=self.ask_high[a:b])
+
+    @classmethod
+    def from_arrays(cls, bars, bounds, bid_low, bid_high, ask_low, ask_high):
+        """Segments already computed, e.g. memory-mapped from another process."""
+
+        self = cls.__new__(cls)
+        self.bars = bars
+        self.bounds = bounds
+        self.bid_low, self.bid_high, self.ask_low, self.ask_high = bid_low, bid_high, ask_low, ask_high
+        return self
+
+    def first(self, a, b, running, levels, falling):
+        """
+        Index of the first bar in [a, b) whose running extreme reaches each
+        level, b where none does. falling: running is a running minimum.
+        """
+
+        if a >= b:
+            return np.full(levels.shape, b)
+        if falling:
+            return a + np.searchsorted(-running[a:b], -levels, side='left')
+        return a + np.searchsorted(running[a:b], levels, side='left')
+
+
+def run(rule, bars, signals, stop=None, limit=None, adjust=None, min_size=1, log=False, segments=None):
+    """
+    Backtest rule on bars for signals [(time, side)] with every parameter
+    set at once. stop, limit and adjust are scalars or arrays of one length;
+    None keeps the rule's. Returns a dict of per-parameter-set arrays, plus
+    'trades' for the first set when log is true.
+    """
+
+    shape = np.broadcast(*(np.asarray(v if v is not None else 0.0, dtype=np.float64)
+                           for v in (stop, limit, adjust))).shape or (1,)
+    k = int(np.prod(shape))
+    flat = lambda v: None if v is None else np.broadcast_to(np.asarray(v, dtype=np.float64), shape).reshape(k)
+    stop, limit, adjust = flat(stop), flat(limit), flat(adjust)
+    if limit is None and rule.limit is None:
+        limit = np.full(k, np.nan)
+    params = variant(rule, stop if stop is not None else np.full(k, float(rule.stop)),
+                     limit if limit is not None else np.full(k, float(rule.limit)),
+                     adjust if adjust is not None else np.full(k, float(rule.adjust)))
+
+    n = len(bars)
+    times = np.array([t for t, _ in signals], dtype=np.int64)
+    at = np.searchsorted(bars.time, times, side='left')
+    codes = ig_decide.encode_sides([s for _, s in signals])
+    if segments is None:
+        segments = Segments(bars, at[at < n])
+
+    direction = np.full(k, FLAT, dtype=np.int8)
+    size = np.zeros(k)
+    entry = np.full(k, np.nan)
+    entered = np.zeros(k, dtype=np.int64)
+    stops = np.full(k, np.nan)
+    limits = np.full(k, np.nan)
+
+    pnl = np.zeros(k)
+    peak = np.zeros(k)
+    drawdown = np.zeros(k)
+    trades = np.zeros(k, dtype=np.int64)
+    wins = np.zeros(k, dtype=np.int64)
+    won = np.zeros(k)
+    lost = np.zeros(k)
+    exits = np.zeros((len(EXITS), k), dtype=np.int64)
+    rejected = np.zeros(k, dtype=np.int64)
+    log_trades = [] if log else None
+
+    def close(mask, price, reason, bar):
+        if not mask.any():
+            return
+        long = direction == BUY
+        result = np.where(long, price - entry, entry - price) * size
+        result = np.where(mask, result, 0.0)
+        pnl[:] += result
+        np.maximum(peak, pnl, out=peak)
+        np.maximum(drawdown, peak - pnl, out=drawdown)
+        trades[:] += mask
+        wins[:] += mask & (result > 0)
+        won[:] += np.where(result > 0, result, 0.0)
+        lost[:] -= np.where(result < 0, result, 0.0)
+        exits[reason] += mask
+        if log_trades is not None and mask[0]:
+            b = int(bar[0]) if np.ndim(bar) else int(bar)
+            log_trades.append({
+                'entry_time': int(bars.time[entered[0]]), 'exit_time': int(bars.time[min(b, n - 1)]),
+                'direction': ig_decide.SIDES[direction[0]], 'size': float(size[0]),
+                'entry': float(entry[0]), 'exit': float(price[0]), 'reason': EXITS[reason],
+                'pnl': float(result[0])})
+        direction[mask] = FLAT
+        stops[mask] = np.nan
+        limits[mask] = np.nan
+
+    def levels_hit(a, b):
+        """Close positions whose stop or limit is reached in bars [a, b)."""
+
+        long, short = direction == BUY, direction == SELL
+        if not (long.any() or short.any()) or a >= b:
+            return
+        s = segments
+        hit_stop = np.where(long, s.first(a, b, s.bid_low, np.where(long, stops, np.nan), True),
+                            s.first(a, b, s.ask_high, np.where(short, stops, np.nan), False))
+        hit_limit = np.where(long, s.first(a, b, s.bid_high, np.where(long, limits, np.nan), False),
+                             s.first(a, b, s.ask_low, np.where(short, limits, np.nan), True))
+        hold = direction != FLAT
+        by_stop = hold & (hit_stop < b) & (hit_stop <= hit_limit)
+        by_limit = hold & (hit_limit < b) & ~by_stop
+
+        i = np.minimum(np.where(by_stop, hit_stop, hit_limit), n - 1)
+        bid_open, ask_open = bars.bid_open[i], bars.ask_open[i]
+        # Filled at the level, or at the open when the bar gapped through it.
+        stop_fill = np.where(long, np.minimum(stops, bid_open), np.maximum(stops, ask_open))
+        limit_fill = np.where(long, np.maximum(limits, bid_open), np.minimum(limits, ask_open))
+        close(by_stop, stop_fill, STOP, i)
+        close(by_limit, limit_fill, LIMIT, i)
+
+    prev = 0
+    for b, code in zip(at, codes):
+        if b >= n:
+            break
+        levels_hit(prev, b)
+        prev = b
+
+        bid, offer = bars.bid_open[b], bars.ask_open[b]
+        plan = ig_decide.decide_batch(params, np.full(k, code, dtype=np.int8), direction, bid, offer, min_size, size)
+        action = plan['action']
+        rejected[:] += action == REJECT
+
+        closing = (action == CLOSE) | (action == REVERSE)
+        close(closing, np.where(direction == BUY, bid, offer) * np.ones(k), SIGNAL, b)
+
+        opening = (action == OPEN) | (action == REVERSE)
+        if opening.any():
+            direction[opening] = plan['direction'][opening]
+            size[opening] = plan['size'][opening]
+            entry[opening] = np.where(plan['direction'] == BUY, offer, bid)[opening]
+            entered[opening] = b
+            stops[opening] = plan['stop'][opening]
+            limits[opening] = plan['limit'][opening]
+
+    levels_hit(prev, n)
+    if n:
+        close(direction != FLAT, np.where(direction == BUY, bars.bid_close[-1], bars.ask_close[-1]) * np.ones(k), END, n - 1)
+
+    out = {
+        'pnl': pnl, 'max_drawdown': drawdown, 'trades': trades, 'wins': wins,
+        'gross_profit': won, 'gross_loss': lost, 'rejected': rejected}
+    out.update(('exits_' + name, exits[i]) for i, name in enumerate(EXITS))
+    if log:
+        out['log'] = log_trades
+    return out
+
+
+def summary(result, i=0):
+    """Trade statistics of parameter set i."""
+
+    trades, wins = int(result['trades'][i]), int(result['wins'][i])
+    won, lost = float(result['gross_profit'][i]), float(result['gross_loss'][i])
+    return {
+        'pnl': float(result['pnl'][i]),
+        'max_drawdown': float(result['max_drawdown'][i]),
+        'trades': trades,
+        'win_rate': wins / trades if trades else None,
+        'avg_win': won / wins if wins else None,
+        'avg_loss': lost / (trades - wins) if trades > wins else None,
+        'profit_factor': won / lost if lost else None,
+        'rejected_signals': int(result['rejected'][i]),
+        'exits': {name: int(result['exits_' + name][i]) for name in EXITS}}
+
+
+def generate(rules, days, seed=1, every=240):
+    """Random-walk minute bars and random signals, about one per every minutes, per instrument."""
+
+    rng = np.random.default_rng(seed)
+    pick = random.Random(seed)
+    start = 1767225600  # 2026-01-01
+    bars, signals = {}, []
+    for name, (ticker, price, spread, vol) in GENERATED.items():
+        n = days * 24 * 60
+        time = start + 60 * np.arange(n, dtype=np.int64)
+        close = price + np.cumsum(rng.normal(0, vol, n))
+        o = np.concatenate(([price], close[:-1]))
+        wick = np.abs(rng.normal(0, vol / 2, (2, n)))
+        bars[name] = Bars.from_mid(time, o, np.maximum(o, close) + wick[0], np.minimum(o, close) - wick[1], close, spread)
+
+        sides = sorted(rules.get(ticker).strategy.sides)
+        for t in sorted(pick.sample(range(n), max(1, n // every))):
+            signals.append((int(time[t]) - 30, ticker, pick.choice(sides).lower()))
+    signals.sort(key=lambda s: s[0])
+    return bars, signals
+
+
+def by_instrument(rules, signals):
+    """{instrument name: [(time, side)]}, signals for unknown tickers dropped."""
+
+    out = {}
+    for t, ticker, side in signals:
+        rule = rules.get(ticker)
+        if rule:
+            out.setdefault(rule.name, []).append((t, side))
+    return out
+
+
+def overrides(rules, values):
+    """{instrument name: {param: value}} from TICKER.param=value strings."""
+
+    out = {}
+    for v in values or ():
+        key, value = v.split("=", 1)
+        ticker, param = key.rsplit(".", 1)
+        rule = rules.get(ticker) or next((r for r in rules.instruments() if r.name == ticker), None)
+        if rule is None or param not in ("stop", "limit", "adjust"):
+            raise ValueError("bad --param " + v)
+        out.setdefault(rule.name, {})[param] = float(value)
+    return out
+
+
+def arguments(parser):
+    """Input options, shared with sweep.py."""
+
+    parser.add_argument("--signals", help="signals CSV or JSON lines")
+    parser.add_argument("--bars", action="append", metavar="TICKER=PATH", help="bars CSV per instrument, repeatable")
+    parser.add_argument("--store", help="read bars from this ig_store directory instead of --bars")
+    parser.add_argument("--resolution", default="MINUTE", help="ig_store resolution")
+    parser.add_argument("--generate", type=int, metavar="DAYS", help="use random minute bars and signals instead")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--start", help="only signals and bars from this time")
+    parser.add_argument("--end", help="only signals and bars before this time")
+    parser.add_argument("--min-size", type=float, default=1, help="IG minimum deal size assumed")
+    parser.add_argument("--rules", default=os.path.join(ROOT, "instrument_rules.json"))
+
+
+def inputs(parser, args):
+    """(rules, {instrument name: Bars}, [(time, ticker, side)]) from the input options."""
+
+    rules = ig_rules.RuleBook(args.rules)
+    start = int(epoch([args.start])[0]) if args.start else None
+    end = int(epoch([args.end])[0]) if args.end else None
+    inside = lambda t: (start is None or t >= start) and (end is None or t < end)
+
+    if args.generate:
+        bars, signals = generate(rules, args.generate, args.seed)
+        signals = [s for s in signals if inside(s[0])]
+        bars = {name: b.between(start, end) for name, b in bars.items()}
+    elif args.signals and args.store:
+        signals = [s for s in load_signals(args.signals) if inside(s[0])]
+        store = ig_store.Store(args.store)
+        bars = {}
+        for name, instrument_signals in by_instrument(rules, signals).items():
+            columns = store.series(name, args.resolution).read(instrument_signals[0][0], end)
+            if len(columns['time']):
+                bars[name] = Bars(*(columns[f] for f in Bars.__slots__))
+    elif args.signals and args.bars:
+        signals = [s for s in load_signals(args.signals) if inside(s[0])]
+        bars = {}
+        for spec in args.bars:
+            ticker, path = spec.split("=", 1)
+            bars[rules.get(ticker).name] = load_bars(path).between(start, end)
+    else:
+        parser.error("give --signals and --bars or --store, or --generate")
+    return rules, bars, signals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arguments(parser)
+    parser.add_argument("--param", action="append", metavar="TICKER.PARAM=VALUE", help="stop, limit or adjust override")
+    parser.add_argument("--trades", help="write every trade to this CSV")
+    parser.add_argument("--json", help="write the statistics to this file")
+    args = parser.parse_args()
+
+    rules, bars, signals = inputs(parser, args)
+    params = overrides(rules, args.param)
+
+    results, log = {}, []
+    for name, instrument_signals in sorted(by_instrument(rules, signals).items()):
+        if name not in bars:
+            print("No bars for %s, %d signals skipped" % (name, len(instrument_signals)))
+            continue
+        rule = next(r for r in rules.instruments() if r.name == name)
+        r = run(rule, bars[name], instrument_signals, min_size=args.min_size, log=True, **params.get(name, {}))
+        results[name] = summary(r)
+        log.extend(dict(t, instrument=name) for t in r['log'])
+
+    print("{:<20} {:>7} {:>7} {:>11} {:>11} {:>8} {:>9}  exits stop/limit/signal/end".format(
+        "instrument", "trades", "win %", "pnl", "max dd", "PF", "rejected"))
+    for name, s in results.items():
+        print("{:<20} {:>7} {:>7} {:>11.1f} {:>11.1f} {:>8} {:>9}  {}".format(
+            name, s['trades'], "%.1f" % (100 * s['win_rate']) if s['win_rate'] is not None else "-",
+            s['pnl'], s['max_drawdown'], "%.2f" % s['profit_factor'] if s['profit_factor'] else "-",
+            s['rejected_signals'], "/".join(str(v) for v in s['exits'].values())))
+
+    if args.trades:
+        with open(args.trades, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=["instrument", "entry_time", "exit_time", "direction", "size",
+                                              "entry", "exit", "reason", "pnl"])
+            w.writeheader()
+            w.writerows(sorted(log, key=lambda t: t['entry_time']))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
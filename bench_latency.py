@@ -0,0 +1,248 @@
+"""
+Signal-to-fill latency benchmark.
+
+Drives final_deployment_current.lambda_handler against the local IG stand-in
+(fake_ig) for a fixed set of scenarios and reports p50/p95/p99 latency and the
+number of IG calls per scenario. Percentiles come from ig_histogram, the same
+histograms the handler keeps in production, and are saved with the results.
+
+    cold  a fresh interpreter per run: handler import plus one invocation
+    warm  repeated invocations in one process after a warm-up call
+
+Results are written as JSON so runs on different commits can be compared:
+
+    python bench_latency.py --runs 20
+    python bench_latency.py --compare bench_results/latency-abc1234.json
+
+The handler sleeps 1s between its two /session logins; --no-sleep skips that
+sleep to benchmark everything else quickly. --latency zero turns off the
+simulated network latency.
+"""
+from contextlib import redirect_stdout
+from time import perf_counter
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+from ig_histogram import Histogram
+import fake_ig
+
+
+TOKEN = "bench-token"
+
+# Simulated IG latency in ms, roughly what the demo gateway shows from eu-west.
+LATENCY = {
+    'realistic': {
+        fake_ig.SESSION: ("lognormal", 140, 0.3),
+        fake_ig.POSITIONS_OTC: ("lognormal", 60, 0.3),
+        fake_ig.CONFIRMS: ("lognormal", 35, 0.3),
+        '*': ("lognormal", 30, 0.3)},
+    'zero': {}}
+
+
+def seed_position(ticker_epic, direction, size):
+    return lambda fake: fake.add_position(ticker_epic, direction, size)
+
+
+def close_market(epic):
+    return lambda fake: fake.set_status(epic, "CLOSED")
+
+
+# name: (ticker, side, setup, expected status code)
+SCENARIOS = {
+    'open': ("UKOIL", "buy", None, 200),
+    'dax_close': ("DAX", "close_buy", seed_position("IX.D.DAX.IFMM.IP", "BUY", 1), 200),
+    'wheat_reversal': ("WHEATUSD", "buy", seed_position("CC.D.W.UNC.IP", "SELL", 15), 200),
+    'oil_reversal': ("UKOIL", "sell", seed_position("CC.D.LCO.UNC.IP", "BUY", 1), 200),
+    'market_offline': ("DAX", "buy", close_market("IX.D.DAX.IFMM.IP"), 400)}
+
+
+def event(ticker, side):
+    return {'body': json.dumps({"ticker": ticker, "side": side, "token": TOKEN})}
+
+
+def environment(url):
+    env = dict(os.environ)
+    env.update({
+        'WEBHOOK_TOKEN': TOKEN,
+        'IG_API_KEY_DEMO': "bench", 'IG_USERNAME_DEMO': "bench", 'IG_PASSWORD_DEMO': "bench",
+        'IG_URL': url})
+    return env
+
+
+def summarise(samples):
+    h = Histogram()
+    for seconds in samples:
+        h.record(seconds * 1000)
+    return dict(h.summary(), histogram=h.to_dict())
+
+
+class Bench:
+
+    def __init__(self, latency, seed=1):
+        self.latency = latency
+        self.seed = seed
+        self.server = fake_ig.serve(self.fresh())
+
+    def fresh(self):
+        return fake_ig.FakeIG(latency=self.latency, seed=self.seed)
+
+    def prepare(self, scenario):
+        """Reset the gateway to the scenario's starting state."""
+
+        fake = self.fresh()
+        # IG sessions outlive the account state reset, as they do on IG.
+        fake.sessions = self.server.fake.sessions
+        setup = SCENARIOS[scenario][2]
+        if setup:
+            setup(fake)
+        fake.reset_calls()
+        self.server.fake = fake
+        return fake
+
+    def warm(self, handler, scenario, runs):
+        ticker, side, _, expected = SCENARIOS[scenario]
+        # Market hours seen in another scenario don't apply to this one.
+        handler.ig_cache.HOURS.clear()
+        self.prepare(scenario)
+        handler.lambda_handler(event(ticker, side), None)
+
+        samples, calls, errors, logs = [], [], 0, []
+        for _ in range(runs):
+            fake = self.prepare(scenario)
+            start = perf_counter()
+            r = handler.lambda_handler(event(ticker, side), None)
+            samples.append(perf_counter() - start)
+            calls.append(len(fake.calls))
+            errors += r['statusCode'] != expected
+            logs.append(fake.calls)
+        return samples, calls, errors, logs
+
+    def cold(self, scenario, runs, no_sleep):
+        ticker, side, _, expected = SCENARIOS[scenario]
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", ticker, side]
+        if no_sleep:
+            cmd.append("--no-sleep")
+
+        samples, imports, calls, errors, logs = [], [], [], 0, []
+        for _ in range(runs):
+            fake = self.prepare(scenario)
+            out = subprocess.run(cmd, env=environment(self.server.url), capture_output=True, text=True, check=True)
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            samples.append(result['import'] + result['handler'])
+            imports.append(result['import'])
+            calls.append(len(fake.calls))
+            errors += result['status'] != expected
+            logs.append(fake.calls)
+        return samples, calls, errors, logs, imports
+
+
+def endpoint_breakdown(logs):
+    """Mean calls and server-side ms per endpoint over a set of call logs."""
+
+    totals = {}
+    for log in logs:
+        for method, endpoint, status, duration in log:
+            count, ms = totals.get(endpoint, (0, 0.0))
+            totals[endpoint] = (count + 1, ms + duration * 1000)
+    return {e: {'calls': c / len(logs), 'server_ms': ms / c} for e, (c, ms) in totals.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def compare(results, baseline):
+    print("\nChange vs", baseline.get('commit'))
+    for scenario, modes in results['scenarios'].items():
+        for mode, stats in modes.items():
+            base = baseline['scenarios'].get(scenario, {}).get(mode)
+            if not base:
+                continue
+            print("  {:<16} {:<5} p50 {:+7.1f}%  p95 {:+7.1f}%  calls {:+.1f}".format(
+                scenario, mode,
+                (stats['p50_ms'] / base['p50_ms'] - 1) * 100,
+                (stats['p95_ms'] / base['p95_ms'] - 1) * 100,
+                stats['calls'] - base['calls']))
+
+
+def worker(ticker, side, no_sleep):
+    """Cold run: time the handler import and a single invocation."""
+
+    start = perf_counter()
+    with open(os.devnull, "w") as null, redirect_stdout(null):
+        import final_deployment_current as handler
+        imported = perf_counter()
+        if no_sleep:
+            handler.sleep = lambda s: None
+        r = handler.lambda_handler(event(ticker, side), None)
+        done = perf_counter()
+    print(json.dumps({'import': imported - start, 'handler': done - imported, 'status': r['statusCode']}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--cold-runs", type=int, default=None, help="defaults to --runs")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="repeatable, default all")
+    parser.add_argument("--latency", choices=sorted(LATENCY), default="realistic")
+    parser.add_argument("--no-sleep", action="store_true")
+    parser.add_argument("--no-cold", action="store_true")
+    parser.add_argument("--out", default=None, help="results file, default bench_results/latency-<commit>.json")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--worker", nargs=2, metavar=("TICKER", "SIDE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args.worker[0], args.worker[1], args.no_sleep)
+
+    bench = Bench(LATENCY[args.latency])
+    os.environ.update(environment(bench.server.url))
+    import final_deployment_current as handler
+    if args.no_sleep:
+        handler.sleep = lambda s: None
+
+    results = {
+        'commit': git_commit(),
+        'latency': args.latency,
+        'no_sleep': args.no_sleep,
+        'scenarios': {}}
+
+    for scenario in args.scenario or list(SCENARIOS):
+        modes = results['scenarios'][scenario] = {}
+
+        # Handler logging is dropped so it doesn't skew the timings.
+        with open(os.devnull, "w") as null, redirect_stdout(null):
+            samples, calls, errors, logs = bench.warm(handler, scenario, args.runs)
+        modes['warm'] = dict(summarise(samples), calls=sum(calls) / len(calls), errors=errors,
+                             endpoints=endpoint_breakdown(logs))
+
+        if not args.no_cold:
+            samples, calls, errors, logs, imports = bench.cold(scenario, args.cold_runs or args.runs, args.no_sleep)
+            modes['cold'] = dict(summarise(samples), calls=sum(calls) / len(calls), errors=errors,
+                                 import_ms=sum(imports) / len(imports) * 1000,
+                                 endpoints=endpoint_breakdown(logs))
+
+        for mode, stats in modes.items():
+            print("{:<16} {:<5} p50 {:8.1f} ms  p95 {:8.1f} ms  p99 {:8.1f} ms  calls {:4.1f}  errors {}".format(
+                scenario, mode, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['calls'], stats['errors']))
+
+    out = args.out or os.path.join("bench_results", "latency-" + results['commit'] + ".json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("\nResults written to", out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
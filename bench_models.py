@@ -0,0 +1,95 @@
+"""
+Benchmark of ig_models against the nested dicts they replace.
+
+For a /positions list, a /markets/{epic} document and a deal confirmation
+it reports:
+
+    build   decoding the response, then building the models
+    access  reading the fields the handler uses, from dicts vs attributes
+    memory  bytes kept alive by the decoded dicts vs by the models
+
+    python bench_models.py --positions 200
+"""
+import tracemalloc
+import argparse
+import timeit
+import json
+
+from ig_models import DealConfirm, MarketDetails, Position
+import fake_ig
+
+
+def payloads(n):
+    fake = fake_ig.FakeIG()
+    catalogue = [m for m in fake_ig.default_markets() if m['expiry'] != "DFB"]
+    positions = json.dumps({"positions": [
+        fake.position(catalogue[i % len(catalogue)], "DEAL%d" % i, "BUY", 1, 100.0, 90.0, 120.0)
+        for i in range(n)]}).encode()
+    details = json.dumps(fake.details(catalogue[4])).encode()
+    fake.confirm(catalogue[4], "DEAL1", "OPEN", "SUCCESS", "BUY", 1, 100.0)
+    confirm = json.dumps(next(iter(fake.confirms.values()))).encode()
+    return positions, details, confirm
+
+
+def retained(build):
+    """Bytes still allocated by what build() returns."""
+
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def measure(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--positions", type=int, default=200)
+    parser.add_argument("--number", type=int, default=1000)
+    args = parser.parse_args()
+
+    positions, details, confirm = payloads(args.positions)
+
+    def position_dicts():
+        return json.loads(positions)['positions']
+
+    def position_models():
+        return [Position.from_doc(p) for p in json.loads(positions)['positions']]
+
+    dicts, models = position_dicts(), position_models()
+    d, m = json.loads(details), MarketDetails.from_doc(json.loads(details))
+    c, cm = json.loads(confirm), DealConfirm.from_doc(json.loads(confirm))
+
+    cases = (
+        ("positions x%d" % args.positions,
+         position_dicts, position_models,
+         lambda: [(p['position']['direction'], p['position']['dealSize'], p['market']['epic'], p['market']['instrumentName'])
+                  for p in dicts],
+         lambda: [(p.direction, p.size, p.epic, p.instrument_name) for p in models]),
+        ("market details",
+         lambda: json.loads(details), lambda: MarketDetails.from_doc(json.loads(details)),
+         lambda: (d['instrument']['lotSize'], d['dealingRules']['minDealSize']['value'],
+                  d['snapshot']['bid'], d['snapshot']['offer'], [x['name'] for x in d['instrument']['currencies']]),
+         lambda: (m.lot_size, m.rules.min_deal_size, m.bid, m.offer, m.currencies)),
+        ("deal confirm",
+         lambda: json.loads(confirm), lambda: DealConfirm.from_doc(json.loads(confirm)),
+         lambda: (c['dealStatus'], c['reason'], c['dealId']),
+         lambda: (cm.status, cm.reason, cm.deal_id)))
+
+    print("{:<18} {:>12} {:>12} {:>12} {:>12} {:>11} {:>11}".format(
+        "document", "dict build", "model build", "dict access", "model acc.", "dict KiB", "model KiB"))
+    for label, build_dict, build_model, access_dict, access_model in cases:
+        number = max(1, args.number // 10) if label.startswith("positions") else args.number
+        print("{:<18} {:>10.1f}us {:>10.1f}us {:>10.2f}us {:>10.2f}us {:>11.1f} {:>11.1f}".format(
+            label, measure(build_dict, number), measure(build_model, number),
+            measure(access_dict, number), measure(access_model, number),
+            retained(build_dict) / 1024, retained(build_model) / 1024))
+    print("\nDealConfirm keeps its document for error replies, so it saves no memory.")
+
+
+if __name__ == "__main__":
+    main()
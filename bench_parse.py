@@ -0,0 +1,137 @@
+"""
+Benchmark of /markets and /positions response parsing.
+
+Compares the handler's old approach, json.loads() of the whole response and
+a loop over it, with ig_parse, which decodes array elements one at a time
+and stops early. Reports time per call and peak memory allocated.
+
+Payloads are either built from the fake_ig catalogue at a realistic size, or
+taken from recorded cassettes:
+
+    python bench_parse.py --markets 50 --positions 20
+    python bench_parse.py --cassette trace.jsonl.gz [--cassette ...]
+"""
+from urllib.parse import unquote
+import tracemalloc
+import argparse
+import timeit
+import json
+import os
+
+from ig_cassette import Cassette
+import ig_parse
+import ig_rules
+import fake_ig
+
+
+RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instrument_rules.json")
+
+
+def old_first(content, name, iclass):
+    for market in json.loads(content)['markets']:
+        if market['expiry'] != "DFB" and market['instrumentName'][:len(name)] == name and market['instrumentType'] == iclass:
+            return market
+    return None
+
+
+def old_positions(content, name):
+    found = []
+    existing = json.loads(content)
+    if len(existing['positions']) > 0:
+        for pos in existing['positions']:
+            if name in pos['market']['instrumentName'][:len(name)]:
+                found.append(pos)
+    return found
+
+
+def new_first(content, name, iclass):
+    return ig_parse.first(content, 'markets', lambda m: (
+        m['expiry'] != "DFB" and m['instrumentName'][:len(name)] == name and m['instrumentType'] == iclass))
+
+
+def synthetic(rules, markets, positions):
+    """(label, kind, content, name, iclass) payloads built from the fake_ig catalogue."""
+
+    fake = fake_ig.FakeIG()
+    catalogue = fake_ig.default_markets()
+    payloads = []
+
+    for rule in rules:
+        found = [m for m in catalogue if unquote(rule.search).lower() in m['search']]
+        # Pad with more option lines after the tradeable one, as a broad IG search returns.
+        for i in range(markets - len(found)):
+            m = dict(found[1], epic="%s.PAD%d" % (found[1]['epic'], i))
+            m['instrumentName'] = "%s %d PUT" % (rule.name, 1000 + i)
+            found.append(m)
+        doc = {"markets": [fake.summary(m) for m in found]}
+        payloads.append(("markets " + rule.name, "markets", json.dumps(doc).encode(), rule.name, rule.iclass))
+
+    # Positions in other instruments, then a book holding the traded one.
+    held = next(m for m in catalogue if m['expiry'] == "-")
+    others = [m for m in catalogue if m['expiry'] == "-" and m is not held]
+    book = [fake.position(others[i % len(others)], "DEAL%d" % i, "BUY", 1, 100.0, None, None) for i in range(positions)]
+    for label, docs in (("positions none held", book), ("positions one held", book + [
+            fake.position(held, "DEALX", "SELL", 1, 100.0, None, None)])):
+        payloads.append((label, "positions", json.dumps({"positions": docs}).encode(), held['instrumentName'], None))
+
+    return payloads
+
+
+def recorded(paths, rules):
+    """Payloads from the /markets and /positions responses in cassettes."""
+
+    payloads = []
+    for path in paths:
+        cassette = Cassette.load(path)
+        for i in cassette.interactions:
+            body = (i.get("body") or "").encode()
+            route = i["path"].split("?")[0]
+            if route.endswith("/markets") and body:
+                rule = next((r for r in rules if r.search.lower() in i["path"].lower()), rules[0])
+                payloads.append(("markets " + rule.name, "markets", body, rule.name, rule.iclass))
+            elif route.endswith("/positions") and body:
+                for rule in rules:
+                    payloads.append(("positions " + rule.name, "positions", body, rule.name, None))
+    return payloads
+
+
+def peak(fn):
+    tracemalloc.start()
+    fn()
+    _, top = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return top
+
+
+def measure(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--markets", type=int, default=50, help="markets per synthetic search response")
+    parser.add_argument("--positions", type=int, default=20, help="positions in other instruments")
+    parser.add_argument("--cassette", action="append", help="take payloads from this cassette, repeatable")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    rules = ig_rules.RuleBook(RULES).instruments()
+    payloads = recorded(args.cassette, rules) if args.cassette else synthetic(rules, args.markets, args.positions)
+
+    print("{:<34} {:>8} {:>10} {:>10} {:>7} {:>10} {:>10}".format(
+        "payload", "bytes", "full us", "stream us", "speed", "full KiB", "stream KiB"))
+    for label, kind, content, name, iclass in payloads:
+        if kind == "markets":
+            old, new = (lambda: old_first(content, name, iclass)), (lambda: new_first(content, name, iclass))
+        else:
+            old, new = (lambda: old_positions(content, name)), (lambda: ig_parse.positions(content, name))
+        if old() != new():
+            raise SystemExit("%s: streaming result differs from full parse" % label)
+
+        t_old, t_new = measure(old, args.number), measure(new, args.number)
+        print("{:<34} {:>8} {:>10.1f} {:>10.1f} {:>6.1f}x {:>10.1f} {:>10.1f}".format(
+            label[:34], len(content), t_old, t_new, t_old / t_new, peak(old) / 1024, peak(new) / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Cold-start profile of the handler.
+
+Breaks a Lambda-style cold start into its parts, each measured in a fresh
+interpreter so nothing is already imported or cached:
+
+    interpreter  python startup with no imports (the floor)
+    imports      cumulative import time per top-level import of the handler
+    module init  time spent in the handler's own module body
+    first use    building the session, which imports its transport (see
+                 ig_transport), then DNS lookup, TCP connect and TLS handshake
+                 to the IG host
+
+Results are written as JSON so a change can be checked before and after:
+
+    python cold_start.py --out before.json
+    python cold_start.py --compare before.json
+
+The connection is made to IG_URL's host (default demo-api.ig.com); pass
+--no-network where there is no route to it.
+"""
+from statistics import median
+from urllib.parse import urlsplit
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODULE = "final_deployment_current"
+DEFAULT_URL = "https://demo-api.ig.com/gateway/deal"
+
+# Run in a fresh interpreter by first_use(); prints one JSON line.
+FIRST_USE = r"""
+from time import perf_counter
+import json, socket, ssl, sys
+
+result = {}
+start = perf_counter()
+import %(module)s as handler
+result['import_ms'] = (perf_counter() - start) * 1000
+
+start = perf_counter()
+handler.new_session()
+result['session_ms'] = (perf_counter() - start) * 1000
+
+host, port = %(host)r, %(port)r
+if host:
+    try:
+        start = perf_counter()
+        address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4]
+        result['dns_ms'] = (perf_counter() - start) * 1000
+
+        start = perf_counter()
+        sock = socket.create_connection(address[:2], timeout=10)
+        result['tcp_ms'] = (perf_counter() - start) * 1000
+
+        start = perf_counter()
+        context = ssl.create_default_context()
+        result['tls_context_ms'] = (perf_counter() - start) * 1000
+
+        start = perf_counter()
+        context.wrap_socket(sock, server_hostname=host).close()
+        result['tls_handshake_ms'] = (perf_counter() - start) * 1000
+    except (OSError, ssl.SSLError) as e:
+        result['network_error'] = "%%s: %%s" %% (type(e).__name__, e)
+
+print(json.dumps(result))
+"""
+
+
+def python(code, *flags):
+    """Run code in a fresh interpreter that can import from the current directory and the repo."""
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (ROOT, env.get('PYTHONPATH')) if p)
+    return subprocess.run([sys.executable, *flags, "-c", code], env=env, capture_output=True, text=True)
+
+
+def interpreter(runs):
+    """Median wall time of an empty interpreter, in ms."""
+
+    from time import perf_counter
+
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        python("pass")
+        samples.append((perf_counter() - start) * 1000)
+    return median(samples)
+
+
+def parse_importtime(stderr):
+    """[(depth, module, self_us, cumulative_us)] from python -X importtime output."""
+
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|", 2)
+        stripped = name.lstrip()
+        rows.append(((len(name) - len(stripped) - 1) // 2, stripped, int(self_us), int(cumulative)))
+    return rows
+
+
+def imports(module, runs, top):
+    """Median handler import time, module body time and the heaviest top-level imports."""
+
+    totals, bodies, children = [], [], {}
+    for _ in range(runs):
+        out = python("import " + module, "-X", "importtime")
+        if out.returncode:
+            raise SystemExit("import %s failed:\n%s" % (module, out.stderr))
+        rows = parse_importtime(out.stderr)
+
+        # Children are printed before their parent, so the handler's direct
+        # imports are the depth-1 rows just above its own depth-0 row.
+        end = max(i for i, r in enumerate(rows) if r[0] == 0 and r[1] == module)
+        begin = max([i for i, r in enumerate(rows[:end]) if r[0] == 0] or [-1]) + 1
+        totals.append(rows[end][3] / 1000)
+        bodies.append(rows[end][2] / 1000)
+        for depth, name, _, cumulative in rows[begin:end]:
+            if depth == 1:
+                children.setdefault(name, []).append(cumulative / 1000)
+
+    heaviest = sorted(((name, median(ms)) for name, ms in children.items()), key=lambda x: -x[1])
+    return {
+        'import_ms': median(totals),
+        'module_init_ms': median(bodies),
+        'top_imports': [{'module': name, 'ms': ms} for name, ms in heaviest[:top]]}
+
+
+def first_use(module, url, runs):
+    """Median of each first-use step, from fresh interpreters."""
+
+    parts = urlsplit(url) if url else None
+    host = parts.hostname if parts else None
+    port = parts.port or (443 if parts.scheme == "https" else 80) if parts else None
+    code = FIRST_USE % {'module': module, 'host': host, 'port': port}
+
+    samples, error = {}, None
+    for _ in range(runs):
+        out = python(code)
+        if out.returncode:
+            raise SystemExit("first use of %s failed:\n%s" % (module, out.stderr))
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        error = result.pop('network_error', error)
+        for k, v in result.items():
+            samples.setdefault(k, []).append(v)
+
+    result = {k: median(v) for k, v in samples.items()}
+    result['host'] = host
+    if error:
+        result['network_error'] = error
+    return result
+
+
+def compare(report, baseline):
+    print("\nChange vs", baseline.get('label'))
+    for section in ('imports', 'first_use'):
+        for k, v in report[section].items():
+            base = baseline.get(section, {}).get(k)
+            if k.endswith("_ms") and isinstance(base, (int, float)):
+                print("  {:<32} {:8.1f} -> {:8.1f} ms  ({:+.1f})".format(section + "." + k, base, v, v - base))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default=MODULE)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=10, help="top-level imports to list")
+    parser.add_argument("--url", default=os.environ.get('IG_URL', DEFAULT_URL))
+    parser.add_argument("--no-network", action="store_true", help="skip DNS, TCP and TLS timing")
+    parser.add_argument("--label", default=None, help="name for this run in comparisons")
+    parser.add_argument("--out", default=None, help="write the report to this file")
+    parser.add_argument("--compare", default=None, help="earlier report to compare against")
+    args = parser.parse_args()
+
+    report = {
+        'label': args.label or args.module,
+        'interpreter_ms': interpreter(args.runs),
+        'imports': imports(args.module, args.runs, args.top),
+        'first_use': first_use(args.module, None if args.no_network else args.url, args.runs)}
+
+    i, f = report['imports'], report['first_use']
+    print("interpreter startup   {:8.1f} ms".format(report['interpreter_ms']))
+    print("handler import        {:8.1f} ms  (module body {:.1f} ms)".format(i['import_ms'], i['module_init_ms']))
+    for m in i['top_imports']:
+        print("    {:<44} {:8.1f} ms".format(m['module'], m['ms']))
+    print("first use")
+    for k in ('session_ms', 'dns_ms', 'tcp_ms', 'tls_context_ms', 'tls_handshake_ms'):
+        if k in f:
+            print("    {:<44} {:8.1f} ms".format(k[:-3], f[k]))
+    if 'network_error' in f:
+        print("    connection to %s failed: %s" % (f['host'], f['network_error']))
+
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump(report, fh, indent=2)
+        print("\nReport written to", args.out)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(report, json.load(fh))
+
+
+if __name__ == "__main__":
+    main()
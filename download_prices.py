@@ -0,0 +1,245 @@
+"""
+Download IG bid/offer price history into an ig_store.
+
+The epics are the ones the handler trades: each instrument is resolved from
+instrument_rules.json with the handler's own /markets search, after logging
+in with the handler's credentials (IG_API_KEY_DEMO etc., or _LIVE with
+--live). TradingView's bars come from a different feed, so backtests of
+what the handler would have done want these.
+
+Each instrument resumes from the last bar in the store, or --since for the
+first download, up to the last complete bar. The range is cut into windows
+of --window bars, fetched --workers at a time with GET /prices/{epic}
+(version 3, one page per window), and appended to the store in order as they
+arrive. A failed window stops that instrument there, so the store never has
+a gap and the next run picks up where it ended.
+
+IG charges the weekly historical data allowance per point returned, and
+every response says how much is left. No more windows are in flight than
+the remaining allowance covers, counting each as full. When it runs out the
+download stops and says when it resets. Requests also go through the
+non-trading rate limit (ig_scheduler), shared with nothing else in this
+process, so leave headroom with --per-minute if the handler uses the same
+account.
+
+    python download_prices.py prices --since 2026-01-01
+    python download_prices.py prices --fake --since 2026-10-01
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime, timezone
+from threading import local
+from time import time
+import argparse
+import os
+
+import numpy as np
+
+import final_deployment_current as handler
+import ig_scheduler
+import ig_store
+import ig_transport
+
+
+# Seconds per bar of each /prices resolution.
+RESOLUTIONS = {
+    "SECOND": 1, "MINUTE": 60, "MINUTE_2": 120, "MINUTE_3": 180, "MINUTE_5": 300, "MINUTE_10": 600,
+    "MINUTE_15": 900, "MINUTE_30": 1800, "HOUR": 3600, "HOUR_2": 7200, "HOUR_3": 10800, "HOUR_4": 14400,
+    "DAY": 86400}
+
+# Bars per request.
+WINDOW = 1000
+
+EXCEEDED = "error.public-api.exceeded-account-historical-data-allowance"
+
+FAKE_CREDENTIALS = {'IG_API_KEY_DEMO': "prices", 'IG_USERNAME_DEMO': "prices", 'IG_PASSWORD_DEMO': "prices"}
+
+
+class DownloadError(Exception):
+    pass
+
+
+class AllowanceExceeded(DownloadError):
+    pass
+
+
+def stamp(t):
+    """IG's from/to format, UTC."""
+
+    return datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def columns(prices):
+    """ig_store columns from a /prices response's prices list."""
+
+    out = {'time': np.array([
+        int(datetime.fromisoformat(p['snapshotTimeUTC']).replace(tzinfo=timezone.utc).timestamp()) for p in prices],
+        dtype=np.int64)}
+    for side, key in (("bid", 'bid'), ("ask", 'ask')):
+        for field in ("open", "high", "low", "close"):
+            out[side + "_" + field] = np.array(
+                [np.nan if p[field + 'Price'][key] is None else p[field + 'Price'][key] for p in prices], dtype=np.float64)
+    out['volume'] = np.array([np.nan if p.get('lastTradedVolume') is None else p['lastTradedVolume'] for p in prices],
+                             dtype=np.float64)
+    return out
+
+
+class Downloader:
+
+    def __init__(self, url, headers, store, resolution="MINUTE", workers=4, window=WINDOW, per_minute=None):
+        self.url = url
+        self.headers = dict(headers, Version="3")
+        self.store = store
+        self.resolution = resolution
+        self.step = RESOLUTIONS[resolution]
+        self.workers = workers
+        self.window = window
+        self.allowance = None
+        self.expiry = None
+        self.trading, self.non_trading = ig_scheduler.buckets()
+        if per_minute:
+            self.non_trading = ig_scheduler.TokenBucket(per_minute / 60, per_minute)
+        self.sessions = local()
+
+    def session(self):
+        """This thread's transport, rate limited with the others."""
+
+        s = getattr(self.sessions, 's', None)
+        if s is None:
+            s = self.sessions.s = ig_scheduler.Limited(
+                ig_transport.new(os.environ.get('IG_TRANSPORT')), self.trading, self.non_trading)
+        return s
+
+    def fetch(self, epic, start, end):
+        """Columns of the bars with start <= time < end."""
+
+        query = "resolution=%s&from=%s&to=%s&pageSize=0" % (self.resolution, stamp(start), stamp(end - 1))
+        response = self.session().send(ig_transport.Request(
+            'GET', "%s/prices/%s?%s" % (self.url, epic, query), headers=self.headers))
+        if response.status_code != 200:
+            try:
+                error = response.json().get('errorCode')
+            except ValueError:
+                error = None
+            if error == EXCEEDED:
+                raise AllowanceExceeded(error)
+            raise DownloadError("%s %s to %s: %d %s" % (epic, stamp(start), stamp(end), response.status_code, error))
+        doc = response.json()
+        allowance = doc.get('metadata', {}).get('allowance') or {}
+        return columns(doc['prices']), allowance
+
+    def instrument(self, name, epic, since, until=None):
+        """
+        Download name's bars from after the last stored one (since when there
+        are none) to until, default now. Returns (bars appended, reason stopped or None).
+        """
+
+        series = self.store.series(name, self.resolution)
+        last = series.last()
+        start = last + self.step if last is not None else since - since % self.step
+        end = (until or time()) // self.step * self.step
+        span = self.window * self.step
+        windows = deque((a, min(a + span, end)) for a in range(int(start), int(end), span))
+
+        appended, stopped = 0, None
+        pending = deque()
+        committed = 0
+        with ThreadPoolExecutor(self.workers) as pool:
+            while True:
+                # Keep workers busy while the allowance still covers every window in flight,
+                # but only one at a time until a response has said what the allowance is.
+                while windows and len(pending) < self.workers:
+                    if self.allowance is None and pending:
+                        break
+                    a, b = windows[0]
+                    points = (b - a) // self.step
+                    if self.allowance is not None and committed + points > self.allowance:
+                        left = self.allowance - committed
+                        if pending or left <= 0:
+                            break
+                        # Whatever the rest of the allowance covers.
+                        b, points = a + left * self.step, left
+                        windows[0] = (b, windows[0][1])
+                    else:
+                        windows.popleft()
+                    committed += points
+                    pending.append((points, pool.submit(self.fetch, epic, a, b)))
+                if not pending:
+                    if windows:
+                        stopped = "allowance"
+                    break
+
+                points, future = pending.popleft()
+                committed -= points
+                try:
+                    data, allowance = future.result()
+                except (DownloadError, ig_transport.TransportError) as e:
+                    stopped = "allowance" if isinstance(e, AllowanceExceeded) else str(e)
+                    for _, f in pending:
+                        f.cancel()
+                    break
+                if 'remainingAllowance' in allowance:
+                    self.allowance = allowance['remainingAllowance']
+                    self.expiry = allowance.get('allowanceExpiry')
+                appended += series.append(data)
+        return appended, stopped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("store", help="ig_store directory")
+    parser.add_argument("--instrument", action="append", metavar="TICKER", help="only these, repeatable")
+    parser.add_argument("--resolution", choices=list(RESOLUTIONS), default="MINUTE")
+    parser.add_argument("--since", default=None, help="start of a first download, ISO 8601 UTC, default a week ago")
+    parser.add_argument("--until", help="end, ISO 8601 UTC, default now")
+    parser.add_argument("--workers", type=int, default=4, help="requests in flight")
+    parser.add_argument("--window", type=int, default=WINDOW, help="bars per request")
+    parser.add_argument("--per-minute", type=float, help="non-trading requests per minute, default IG's limit")
+    parser.add_argument("--live", action="store_true", help="live account credentials and gateway")
+    parser.add_argument("--fake", action="store_true", help="download from a local fake_ig gateway")
+    args = parser.parse_args()
+
+    if args.fake:
+        import fake_ig
+        gateway = fake_ig.serve(fake_ig.FakeIG())
+        os.environ.update(FAKE_CREDENTIALS, IG_URL=gateway.url)
+    handler.LIVE = args.live
+
+    parse = lambda v: datetime.fromisoformat(v.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+    since = parse(args.since) if args.since else time() - 7 * 86400
+    until = parse(args.until) if args.until else None
+
+    creds = handler.credentials()
+    if creds is None:
+        parser.error("IG credentials not set, see final_deployment_current.credentials()")
+    url = handler.ig_url()
+    s = handler.new_session()
+    headers, _, _ = handler.authenticate(s, url, *creds)
+
+    rules = handler.RULES.instruments()
+    if args.instrument:
+        wanted = {handler.RULES.get(t).name for t in args.instrument}
+        rules = [r for r in rules if r.name in wanted]
+
+    downloader = Downloader(url, headers, ig_store.Store(args.store), args.resolution, args.workers, args.window,
+                            args.per_minute)
+    for rule in rules:
+        epic, _ = handler.resolve(s, url, headers, rule)
+        if epic is None:
+            print("%s: no market found" % rule.name)
+            continue
+        appended, stopped = downloader.instrument(rule.name, epic, since, until)
+        last = downloader.store.series(rule.name, args.resolution).last()
+        print("%s (%s): %d bars appended, up to %s" % (rule.name, epic, appended, ig_store.date(last)))
+        if stopped == "allowance":
+            print("Historical data allowance used up (%s points left, resets in %.1f h); run again then to resume." % (
+                downloader.allowance, (downloader.expiry or 0) / 3600))
+            break
+        if stopped:
+            print("Stopped:", stopped)
+    if downloader.allowance is not None:
+        print("Allowance left:", downloader.allowance)
+
+
+if __name__ == "__main__":
+    main()
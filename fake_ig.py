@@ -0,0 +1,620 @@
+"""
+Local stand-in for the IG REST trading gateway.
+
+Implements the endpoints the handler uses with in-memory state:
+
+    POST /session
+    GET  /accounts/preferences, PUT /accounts/preferences
+    GET  /positions
+    POST /positions/otc (open, or close with the _method: DELETE header)
+    GET  /markets?searchTerm=, GET /markets/{epic}
+    GET  /confirms/{dealReference}
+    GET  /prices/{epic}?resolution=&from=&to=&pageSize=&pageNumber= (version 3)
+
+FakeIG.handle() can be called in-process, or serve() runs it on localhost so
+any HTTP client can be pointed at it, e.g. set IG_URL for the handler to
+serve(fake).url.
+
+Per-endpoint latency, 5xx injection and deal rejections are configurable:
+
+    fake = FakeIG(
+        latency={'/session': ("lognormal", 80, 0.4), '*': ("uniform", 5, 20)},
+        errors={'/positions/otc': 0.05},
+        seed=1)
+    fake.set_status("IX.D.DAX.IFMM.IP", "CLOSED")   # confirms REJECTED MARKET_OFFLINE
+    fake.reject_next("INSUFFICIENT_FUNDS")           # next deal only
+    fake.fail_next('/session', 503, count=2)         # next two session calls
+    fake.allowance = 500                             # historical data points left
+
+Price history is generated per bar from the epic and time alone, so any two
+requests for the same bar agree, and counts against the allowance per point
+returned, as IG's does.
+
+Latency specs are in milliseconds: ("fixed", ms), ("uniform", lo, hi),
+("normal", mean, sd) or ("lognormal", median, sigma).
+
+Usage: python fake_ig.py [port]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from datetime import datetime, timezone
+from threading import Lock, Thread
+from time import sleep, perf_counter
+import random
+import json
+import gzip
+import math
+import sys
+import uuid
+import zlib
+
+
+# Endpoint labels, matching the IG API reference. Used as keys for latency
+# and error settings and in the call log.
+SESSION = '/session'
+PREFERENCES = '/accounts/preferences'
+POSITIONS = '/positions'
+POSITIONS_OTC = '/positions/otc'
+MARKETS = '/markets'
+MARKET = '/markets/{epic}'
+CONFIRMS = '/confirms/{dealReference}'
+PRICES = '/prices/{epic}'
+
+# marketStatus: confirmation rejection reason when dealing.
+CLOSED_REASONS = {
+    "CLOSED": "MARKET_OFFLINE",
+    "OFFLINE": "MARKET_OFFLINE",
+    "SUSPENDED": "MARKET_OFFLINE",
+    "EDITS_ONLY": "MARKET_CLOSED_WITH_EDITS"}
+
+# IG-style daily trading hours, UK time, for FakeIG(hours=True).
+TRADING_HOURS = {
+    "Oil - Brent Crude": (("01:00", "23:00"),),
+    "Germany 30": (("07:00", "21:00"),),
+    "Chicago Wheat": (("01:00", "13:45"), ("14:30", "19:20"))}
+
+# Responses larger than this are gzipped when the client accepts it.
+GZIP_MIN = 1024
+
+# /prices resolutions, in seconds.
+RESOLUTIONS = {
+    "SECOND": 1, "MINUTE": 60, "MINUTE_2": 120, "MINUTE_3": 180, "MINUTE_5": 300, "MINUTE_10": 600,
+    "MINUTE_15": 900, "MINUTE_30": 1800, "HOUR": 3600, "HOUR_2": 7200, "HOUR_3": 10800, "HOUR_4": 14400,
+    "DAY": 86400}
+
+# IG's weekly historical data allowance, in price points.
+ALLOWANCE = 10000
+ALLOWANCE_PERIOD = 7 * 86400
+
+
+def market(epic, name, itype, expiry, bid, offer, min_size=1, currencies=("GBP",), lot_size=1, search=()):
+    """Build a catalogue entry."""
+
+    return {
+        'epic': epic,
+        'instrumentName': name,
+        'instrumentType': itype,
+        'expiry': expiry,
+        'bid': bid,
+        'offer': offer,
+        'marketStatus': "TRADEABLE",
+        'openingHours': None,
+        'minDealSize': min_size,
+        'currencies': list(currencies),
+        'lotSize': lot_size,
+        'search': tuple(search)}
+
+
+def default_markets():
+    """Brent, Germany 30 and Chicago Wheat, each with the DFB, futures and option lines IG also returns."""
+
+    markets = []
+    for term, name, itype, epic, bid, offer, min_size, currencies, lot in (
+            ("brent", "Oil - Brent Crude", "COMMODITIES", "CC.D.LCO.UNC.IP", 6512.3, 6515.1, 1, ("GBP", "USD"), 1),
+            ("dax", "Germany 30 Cash", "INDICES", "IX.D.DAX.IFMM.IP", 12001.2, 12002.4, 0.5, ("EUR", "GBP"), 1),
+            ("chicago wheat", "Chicago Wheat", "COMMODITIES", "CC.D.W.UNC.IP", 495.1, 495.9, 1, ("GBP", "USD"), 1)):
+        search = (term,) + tuple(term.split())
+        stem = epic.rsplit('.', 2)[0]
+
+        # The DFB and option lines come first so the handler has to skip them.
+        markets.append(market(stem + ".DAILY.IP", name, itype, "DFB", bid, offer, 0.5, currencies, lot, search))
+        months = ("DEC-26", "MAR-27", "JUN-27", "SEP-27")
+        for i, month in enumerate(months):
+            markets.append(market(
+                stem + ".OPT" + str(i) + ".IP", name + " " + str(int(bid)) + " CALL", "OPT_" + itype, month,
+                12.0 + i, 14.0 + i, 1, currencies, lot, search))
+        markets.append(market(epic, name, itype, "-", bid, offer, min_size, currencies, lot, search))
+        for i, month in enumerate(months):
+            markets.append(market(
+                stem + ".FUT" + str(i) + ".IP", name + " Futures " + month, itype, month,
+                bid + 10 * (i + 1), offer + 10 * (i + 1), 1, currencies, lot, search))
+
+    return markets
+
+
+class FakeIG:
+    """In-memory IG gateway state."""
+
+    def __init__(self, markets=None, latency=None, errors=None, seed=None,
+                 api_key=None, username=None, password=None, trailing_stops=True, gzip=True, hours=False):
+        self.markets = {m['epic']: dict(m) for m in (markets or default_markets())}
+        if hours:
+            for m in self.markets.values():
+                for name, times in TRADING_HOURS.items():
+                    if m['instrumentName'].startswith(name):
+                        self.set_hours(m['epic'], times)
+        self.latency = dict(latency or {})
+        self.errors = dict(errors or {})
+        self.credentials = (api_key, username, password)
+        self.trailing_stops = trailing_stops
+        self.gzip = gzip
+        self.random = random.Random(seed)
+        self.lock = Lock()
+
+        self.sessions = set()
+        self.positions = {}
+        self.confirms = {}
+        self.failures = {}
+        self.rejections = []
+        self.calls = []
+        self.deals = 0
+        self.allowance = ALLOWANCE
+
+    # Configuration.
+
+    def set_quote(self, epic, bid, offer):
+        self.markets[epic]['bid'], self.markets[epic]['offer'] = bid, offer
+
+    def set_status(self, epic, status):
+        """Set marketStatus, e.g. "TRADEABLE", "CLOSED" or "EDITS_ONLY"."""
+
+        self.markets[epic]['marketStatus'] = status
+
+    def set_hours(self, epic, times):
+        """Set openingHours from [(open, close)] "HH:MM" pairs, or None."""
+
+        self.markets[epic]['openingHours'] = {"marketTimes": [
+            {"openTime": o, "closeTime": c} for o, c in times]} if times else None
+
+    def reject_next(self, reason, count=1):
+        """Reject the next count deals with reason."""
+
+        self.rejections.extend([reason] * count)
+
+    def fail_next(self, endpoint, status=503, count=1):
+        """Answer the next count calls to endpoint with status."""
+
+        self.failures.setdefault(endpoint, []).extend([status] * count)
+
+    def expire_sessions(self):
+        """Invalidate every CST/X-SECURITY-TOKEN pair issued so far."""
+
+        self.sessions.clear()
+
+    def add_position(self, epic, direction, size, level=None):
+        """Seed an open position. Returns its dealId."""
+
+        m = self.markets[epic]
+        with self.lock:
+            deal_id = self.next_deal_id()
+            self.positions[deal_id] = self.position(m, deal_id, direction, size, level or (m['offer'] if direction == "BUY" else m['bid']), None, None)
+        return deal_id
+
+    def reset_calls(self):
+        self.calls = []
+
+    def call_count(self, endpoint=None):
+        return sum(1 for c in self.calls if endpoint is None or c[1] == endpoint)
+
+    # Request handling.
+
+    def handle(self, method, path, headers, body=b''):
+        """
+        Serve one request. headers is a case-insensitive mapping or a dict.
+        Returns (status, response headers, body bytes).
+        """
+
+        start = perf_counter()
+        url = urlsplit(path)
+        route = url.path
+        if route.startswith("/gateway/deal"):
+            route = route[len("/gateway/deal"):]
+        headers = {k.lower(): v for k, v in headers.items()}
+        endpoint = self.endpoint(route)
+
+        self.delay(endpoint)
+        status, out_headers, doc = self.dispatch(method, route, parse_qs(url.query), headers, body, endpoint)
+
+        payload = json.dumps(doc).encode() if doc is not None else b''
+        out_headers['Content-Type'] = "application/json; charset=UTF-8"
+        if self.gzip and len(payload) >= GZIP_MIN and 'gzip' in headers.get('accept-encoding', ''):
+            payload = gzip.compress(payload, 5)
+            out_headers['Content-Encoding'] = "gzip"
+
+        self.calls.append((method, endpoint, status, perf_counter() - start))
+        return status, out_headers, payload
+
+    @staticmethod
+    def endpoint(route):
+        if route.startswith("/confirms/"):
+            return CONFIRMS
+        if route.startswith("/markets/"):
+            return MARKET
+        if route.startswith("/prices/"):
+            return PRICES
+        return route
+
+    def delay(self, endpoint):
+        spec = self.latency.get(endpoint, self.latency.get('*'))
+        if not spec:
+            return
+        kind, a = spec[0], spec[1]
+        b = spec[2] if len(spec) > 2 else None
+        if kind == "fixed":
+            ms = a
+        elif kind == "uniform":
+            ms = self.random.uniform(a, b)
+        elif kind == "normal":
+            ms = self.random.gauss(a, b)
+        elif kind == "lognormal":
+            ms = self.random.lognormvariate(0, b) * a
+        else:
+            raise ValueError("Unknown latency distribution " + repr(kind))
+        if ms > 0:
+            sleep(ms / 1000)
+
+    def dispatch(self, method, route, query, headers, body, endpoint):
+
+        # Injected failures first.
+        queued = self.failures.get(endpoint)
+        if queued:
+            return queued.pop(0), {}, {"errorCode": "error.service.unavailable"}
+        if self.random.random() < self.errors.get(endpoint, self.errors.get('*', 0)):
+            return self.random.choice((502, 503, 504)), {}, {"errorCode": "error.service.unavailable"}
+
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {}, {"errorCode": "validation.invalid.json"}
+
+        if endpoint == SESSION and method == 'POST':
+            return self.login(headers, data)
+
+        if (headers.get('cst'), headers.get('x-security-token')) not in self.sessions:
+            return 401, {}, {"errorCode": "error.security.client-token-invalid"}
+
+        if endpoint == PREFERENCES:
+            if method == 'PUT':
+                self.trailing_stops = bool(data.get('trailingStopsEnabled'))
+                return 200, {}, {"status": "SUCCESS"}
+            return 200, {}, {"trailingStopsEnabled": self.trailing_stops}
+
+        if endpoint == POSITIONS and method == 'GET':
+            with self.lock:
+                held = [(dict(p['position']), p['market']['epic']) for p in self.positions.values()]
+            return 200, {}, {"positions": [
+                {"position": position, "market": self.summary(self.markets[epic])} for position, epic in held]}
+
+        if endpoint == POSITIONS_OTC and method == 'POST':
+            with self.lock:
+                if headers.get('_method', '').upper() == 'DELETE':
+                    return self.close(data)
+                return self.open(data)
+
+        if endpoint == MARKETS and method == 'GET':
+            term = unquote(query.get('searchTerm', [''])[0]).lower()
+            found = [self.summary(m) for m in self.markets.values() if term in m['search']]
+            return 200, {}, {"markets": found}
+
+        if endpoint == MARKET and method == 'GET':
+            m = self.markets.get(route[len("/markets/"):])
+            if m is None:
+                return 404, {}, {"errorCode": "error.service.marketdata.instrument.epic.unavailable"}
+            return 200, {}, self.details(m)
+
+        if endpoint == CONFIRMS and method == 'GET':
+            conf = self.confirms.get(route[len("/confirms/"):])
+            if conf is None:
+                return 404, {}, {"errorCode": "error.confirms.deal-not-found"}
+            return 200, {}, conf
+
+        if endpoint == PRICES and method == 'GET':
+            m = self.markets.get(route[len("/prices/"):])
+            if m is None:
+                return 404, {}, {"errorCode": "error.service.marketdata.instrument.epic.unavailable"}
+            with self.lock:
+                return self.prices(m, {k: v[0] for k, v in query.items()})
+
+        return 404, {}, {"errorCode": "error.request.invalid.path"}
+
+    def login(self, headers, data):
+        key, username, password = self.credentials
+        if (key and headers.get('x-ig-api-key') != key or
+                username and data.get('identifier') != username or
+                password and data.get('password') != password):
+            return 401, {}, {"errorCode": "error.security.invalid-details"}
+
+        cst, xst = uuid.uuid4().hex, uuid.uuid4().hex
+        self.sessions.add((cst, xst))
+        return 200, {'CST': cst, 'X-SECURITY-TOKEN': xst}, {
+            "accountType": "CFD",
+            "currentAccountId": "ABC123",
+            "lightstreamerEndpoint": "https://demo-apd.marketdatasystems.com",
+            "trailingStopsEnabled": self.trailing_stops,
+            "dealingEnabled": True}
+
+    # Dealing.
+
+    def next_deal_id(self):
+        self.deals += 1
+        return "DIAAAA" + str(self.deals).zfill(9)
+
+    def confirm(self, m, deal_id, status, reason, direction, size, level=None, stop=None, limit=None, affected=()):
+        ref = uuid.uuid4().hex[:15].upper()
+        self.confirms[ref] = {
+            "date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3],
+            "status": status,
+            "reason": reason,
+            "dealStatus": "ACCEPTED" if reason == "SUCCESS" else "REJECTED",
+            "epic": m['epic'] if m else None,
+            "expiry": m['expiry'] if m else None,
+            "dealReference": ref,
+            "dealId": deal_id,
+            "level": level,
+            "size": size,
+            "direction": direction,
+            "stopLevel": stop,
+            "limitLevel": limit,
+            "trailingStop": False,
+            "guaranteedStop": False,
+            "affectedDeals": [{"dealId": d, "status": status} for d in affected]}
+        return 200, {}, {"dealReference": ref}
+
+    def rejection(self, m):
+        if self.rejections:
+            return self.rejections.pop(0)
+        return CLOSED_REASONS.get(m['marketStatus'])
+
+    def open(self, data):
+        for field in ("epic", "direction", "size", "orderType", "currencyCode"):
+            if data.get(field) is None:
+                return 400, {}, {"errorCode": "validation.null-not-allowed.request." + field}
+
+        m = self.markets.get(data['epic'])
+        if m is None:
+            return 404, {}, {"errorCode": "error.service.marketdata.instrument.epic.unavailable"}
+
+        direction, size = data['direction'], data['size']
+        reason = self.rejection(m)
+        if direction not in ("BUY", "SELL"):
+            reason = "UNKNOWN"
+        elif size < m['minDealSize']:
+            reason = "MINIMUM_ORDER_SIZE_ERROR"
+        if reason:
+            return self.confirm(m, None, None, reason, direction, size)
+
+        level = m['offer'] if direction == "BUY" else m['bid']
+        deal_id = self.next_deal_id()
+        self.positions[deal_id] = self.position(m, deal_id, direction, size, level, data.get('stopLevel'), data.get('limitLevel'), data['currencyCode'])
+        return self.confirm(m, deal_id, "OPEN", "SUCCESS", direction, size, level, data.get('stopLevel'), data.get('limitLevel'), (deal_id,))
+
+    def close(self, data):
+        pos = self.positions.get(data.get('dealId'))
+        if pos is None:
+            return self.confirm(None, data.get('dealId'), None, "POSITION_NOT_AVAILABLE_TO_CLOSE", data.get('direction'), data.get('size'))
+
+        m = self.markets[pos['market']['epic']]
+        held = pos['position']
+        reason = self.rejection(m)
+        if data.get('direction') == held['direction']:
+            reason = "UNKNOWN"
+        if reason:
+            return self.confirm(m, held['dealId'], None, reason, data.get('direction'), data.get('size'))
+
+        size = min(data.get('size') or held['dealSize'], held['dealSize'])
+        if size < held['dealSize']:
+            held['dealSize'] = held['size'] = held['dealSize'] - size
+            status = "PARTIALLY_CLOSED"
+        else:
+            del self.positions[held['dealId']]
+            status = "CLOSED"
+
+        level = m['bid'] if held['direction'] == "BUY" else m['offer']
+        return self.confirm(m, held['dealId'], status, "SUCCESS", data['direction'], size, level, affected=(held['dealId'],))
+
+    # Documents.
+
+    @staticmethod
+    def summary(m):
+        return {
+            "delayTime": 0,
+            "epic": m['epic'],
+            "netChange": 0.0,
+            "lotSize": m['lotSize'],
+            "expiry": m['expiry'],
+            "instrumentType": m['instrumentType'],
+            "instrumentName": m['instrumentName'],
+            "high": m['offer'] + 40,
+            "low": m['bid'] - 40,
+            "percentageChange": 0.0,
+            "updateTime": "12:00:00",
+            "updateTimeUTC": "12:00:00",
+            "bid": m['bid'],
+            "offer": m['offer'],
+            "otcTradeable": True,
+            "streamingPricesAvailable": True,
+            "marketStatus": m['marketStatus'],
+            "scalingFactor": 1}
+
+    def position(self, m, deal_id, direction, size, level, stop, limit, currency="GBP"):
+        return {
+            "position": {
+                "contractSize": m['lotSize'],
+                "createdDate": datetime.now(timezone.utc).strftime("%Y/%m/%d %H:%M:%S:000"),
+                "createdDateUTC": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+                "dealId": deal_id,
+                "dealReference": uuid.uuid4().hex[:15].upper(),
+                "size": size,
+                "dealSize": size,
+                "direction": direction,
+                "limitLevel": limit,
+                "level": level,
+                "currency": currency,
+                "controlledRisk": False,
+                "stopLevel": stop,
+                "trailingStep": None,
+                "trailingStopDistance": None,
+                "limitedRiskPremium": None},
+            "market": self.summary(m)}
+
+    # Price history.
+
+    def prices(self, m, query):
+        step = RESOLUTIONS.get(query.get('resolution', "MINUTE"))
+        try:
+            start = datetime.fromisoformat(query['from']).replace(tzinfo=timezone.utc).timestamp()
+            end = datetime.fromisoformat(query['to']).replace(tzinfo=timezone.utc).timestamp()
+            size = int(query.get('pageSize', 20))
+            page = int(query.get('pageNumber', 1))
+        except (KeyError, ValueError):
+            return 400, {}, {"errorCode": "error.malformed.date"}
+        if step is None:
+            return 400, {}, {"errorCode": "error.public-api.invalid.resolution"}
+
+        times = [t for t in range(int(math.ceil(start / step)) * step, int(end) + 1, step)
+                 if datetime.fromtimestamp(t, timezone.utc).weekday() != 5]
+        pages = max(1, math.ceil(len(times) / size)) if size else 1
+        if size:
+            times = times[(page - 1) * size:page * size]
+        if len(times) > self.allowance:
+            return 403, {}, {"errorCode": "error.public-api.exceeded-account-historical-data-allowance"}
+        self.allowance -= len(times)
+
+        return 200, {}, {
+            "prices": [self.bar(m, t, step) for t in times],
+            "instrumentType": m['instrumentType'],
+            "metadata": {
+                "allowance": {
+                    "remainingAllowance": self.allowance,
+                    "totalAllowance": ALLOWANCE,
+                    "allowanceExpiry": ALLOWANCE_PERIOD},
+                "size": len(times),
+                "pageData": {"pageSize": size, "pageNumber": page, "totalPages": pages}}}
+
+    @staticmethod
+    def bar(m, t, step):
+        """One bar, the same for the same epic and time whatever was asked for."""
+
+        rng = random.Random(zlib.crc32(("%s %d %d" % (m['epic'], t, step)).encode()))
+        mid = (m['bid'] + m['offer']) / 2 * (1 + 0.01 * math.sin(t / 20000) + 0.002 * math.sin(t / 1300))
+        half = (m['offer'] - m['bid']) / 2
+        o, c = mid + rng.gauss(0, half), mid + rng.gauss(0, half)
+        h, l = max(o, c) + abs(rng.gauss(0, half)), min(o, c) - abs(rng.gauss(0, half))
+        price = lambda v: {"bid": round(v - half, 2), "ask": round(v + half, 2), "lastTraded": None}
+        when = datetime.fromtimestamp(t, timezone.utc)
+        return {
+            "snapshotTime": when.strftime("%Y/%m/%d %H:%M:%S"),
+            "snapshotTimeUTC": when.strftime("%Y-%m-%dT%H:%M:%S"),
+            "openPrice": price(o),
+            "closePrice": price(c),
+            "highPrice": price(h),
+            "lowPrice": price(l),
+            "lastTradedVolume": rng.randint(0, 200)}
+
+    def details(self, m):
+        return {
+            "instrument": {
+                "epic": m['epic'],
+                "expiry": m['expiry'],
+                "name": m['instrumentName'],
+                "forceOpenAllowed": True,
+                "stopsLimitsAllowed": True,
+                "lotSize": m['lotSize'],
+                "unit": "AMOUNT",
+                "type": m['instrumentType'],
+                "controlledRiskAllowed": True,
+                "streamingPricesAvailable": True,
+                "marketId": m['epic'].split('.')[2],
+                "currencies": [
+                    {"code": c, "name": c, "symbol": c, "baseExchangeRate": 1.0, "exchangeRate": 1.0, "isDefault": i == 0}
+                    for i, c in enumerate(m['currencies'])],
+                "marginDepositBands": [{"min": 0, "max": None, "margin": 5, "currency": m['currencies'][0]}],
+                "openingHours": m.get('openingHours'),
+                "expiryDetails": None,
+                "rolloverDetails": None,
+                "chartCode": m['epic'].split('.')[2],
+                "valueOfOnePip": "1.00",
+                "onePipMeans": "1 point",
+                "contractSize": str(m['lotSize'])},
+            "dealingRules": {
+                "minStepDistance": {"unit": "POINTS", "value": 1.0},
+                "minDealSize": {"unit": "POINTS", "value": m['minDealSize']},
+                "minControlledRiskStopDistance": {"unit": "POINTS", "value": 10.0},
+                "minNormalStopOrLimitDistance": {"unit": "POINTS", "value": 8.0},
+                "maxStopOrLimitDistance": {"unit": "PERCENTAGE", "value": 75.0},
+                "marketOrderPreference": "AVAILABLE_DEFAULT_ON",
+                "trailingStopsPreference": "AVAILABLE"},
+            "snapshot": {
+                "marketStatus": m['marketStatus'],
+                "netChange": 0.0,
+                "percentageChange": 0.0,
+                "updateTime": "12:00:00",
+                "delayTime": 0,
+                "bid": m['bid'],
+                "offer": m['offer'],
+                "high": m['offer'] + 40,
+                "low": m['bid'] - 40,
+                "binaryOdds": None,
+                "decimalPlacesFactor": 1,
+                "scalingFactor": 1,
+                "controlledRiskExtraSpread": 1}}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # Headers and body go out as separate writes; with Nagle on, keep-alive
+    # clients stall on delayed ACKs for ~40ms per call.
+    disable_nagle_algorithm = True
+
+    def serve(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, headers, payload = self.server.fake.handle(self.command, self.path, self.headers, body)
+
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(fake, host="127.0.0.1", port=0):
+    """
+    Serve fake on a background thread. Returns the server; server.url is the
+    gateway base URL and server.shutdown() stops it.
+    """
+
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    server.url = "http://%s:%d/gateway/deal" % server.server_address[:2]
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    server = serve(FakeIG(), port=int(sys.argv[1]) if len(sys.argv) > 1 else 8089)
+    print("Fake IG gateway at", server.url)
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
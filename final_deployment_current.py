@@ -1,637 +1,459 @@
-import botocore.vendored.requests.packages.urllib3 as urllib3
-from botocore.vendored import requests
-from datetime import datetime
-from time import sleep
-import sys
+from time import perf_counter, sleep, time
+import ig_cache
+import ig_cassette
+import ig_decide
+import ig_hours
+import ig_metrics
+import ig_models
+import ig_orders
+import ig_parse
+import ig_rules
+import ig_transport
+import ig_validate
 import json
 import os
 
 
-def lambda_handler(event, context):
+# Per-instrument trade rules, see ig_rules. Reloaded when the file changes.
+RULES = ig_rules.RuleBook(os.environ.get(
+    'INSTRUMENT_RULES',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instrument_rules.json")))
 
-    # Set True for live trading, false for demo acount.
-    LIVE = False
+# Confirmation rejection reasons that mean the market is closed.
+MARKET_CLOSED = ("MARKET_OFFLINE", "MARKET_CLOSED_WITH_EDITS")
 
-    # 1
-    # ticker_code: (instrument name, search term, instrument class, size multi)
-    TICKER_MAP = {
-        "UKOIL": ("Oil - Brent Crude", "brent", "COMMODITIES", 1),
-        "CFDs on Brent Crude Oil": ("Oil - Brent Crude", "brent", "COMMODITIES", 1),
-        "DE30EUR": ("Germany 30", "dax", "INDICES", 1),
-        "DAX": ("Germany 30", "dax", "INDICES", 1),
-        "WHTUSD": ("Chicago Wheat", "chicago%20wheat", "COMMODITIES", 15),
-        "WHEATUSD": ("Chicago Wheat", "chicago%20wheat", "COMMODITIES", 15)}
+# Set True for live trading, false for demo acount.
+LIVE = False
 
-    # 2
-    # Load webhook token. Incoming signals must match token to be actioned.
-    if os.environ['WEBHOOK_TOKEN']:
-        WEBHOOK_TOKEN = os.environ['WEBHOOK_TOKEN']
-    else:
-        print("Error: Tradingview webhook token missing")
-        return {
-            'statusCode': 400,
-            'body': json.dumps("Tradingview webhook token missing")}
+LIVE_URL = "https://api.ig.com/gateway/deal"
+DEMO_URL = "https://demo-api.ig.com/gateway/deal"
 
-    # 3
+# Signal validator, built on first use, see validator().
+VALIDATOR = None
+
+# Transport shared by every invocation while the container is warm.
+transport = None
+
+# ms of connection set-up prewarm() did ahead of the next invocation,
+# reported once by that invocation as prewarm_ms.
+prewarmed = None
+
+
+def reply(status, body):
+    return {
+        'statusCode': status,
+        'body': json.dumps(body)}
+
+
+class Trade:
+    """
+    Carries out an ig_decide Plan for one signal and turns IG deal
+    confirmations into handler responses.
+    """
+
+    def __init__(self, s, url, headers, epic, expiry, currencies):
+        self.s = s
+        self.url = url
+        self.headers = headers
+        self.close_headers = dict(headers, **ig_orders.CLOSE_METHOD)
+        self.epic = epic
+        self.expiry = expiry
+        self.currencies = currencies
+
+    def execute(self, rule, plan, position):
+        if plan.action == ig_decide.REJECT:
+            print(plan.reason)
+            return reply(400, plan.reason)
+
+        if plan.action == ig_decide.CLOSE or plan.action == ig_decide.REVERSE:
+            failed = self.close(rule, plan, position)
+            if failed:
+                return failed
+            if plan.action == ig_decide.CLOSE:
+                return self.success(rule.name + " position closed successfully.")
+
+        return self.open(rule, plan)
+
+    def confirm(self, r):
+        """Return the deal confirmation for an order response, or None if the order failed."""
+
+        if r.status_code != 200:
+            return None
+        ref = r.json()
+        c = self.s.send(ig_transport.Request('GET', self.url + "/confirms/" + ref['dealReference'], headers=self.headers))
+        return ig_models.DealConfirm.from_doc(c.json())
+
+    def open(self, rule, plan):
+        """Open a new position with linked sl and tp."""
+
+        order = rule.order_template.render(self.epic, self.expiry, plan.direction, plan.size, plan.stop, plan.limit, self.currencies[0])
+
+        # Attempt to open a new position.
+        r = self.s.send(ig_transport.Request('POST', self.url + "/positions/otc", headers=self.headers, data=order))
+        conf = self.confirm(r)
+
+        if conf is None:
+            print(order.decode())
+            print("Order placement failure.")
+            print(r.text)
+            return reply(r.status_code, "Order placement failure.")
+
+        if conf.status == "ACCEPTED":
+            return self.success(rule.name + " " + plan.direction + " position opened successfully.")
+
+        return self.rejected(rule, conf)
+
+    def close(self, rule, plan, position):
+        """Close position. Returns None on success, otherwise the error response."""
+
+        body = rule.close_template.render(position.deal_id, self.expiry, plan.close_direction, plan.close_size)
+
+        # Closures are sent with the DELETE method header.
+        r = self.s.send(ig_transport.Request("POST", self.url + "/positions/otc", headers=self.close_headers, data=body))
+        conf = self.confirm(r)
+
+        if conf is None:
+            print("Position closure failure.")
+            return reply(r.status_code, "Order placement failure.")
+
+        if conf.status == "ACCEPTED":
+            return None
+
+        return self.rejected(rule, conf)
+
+    def rejected(self, rule, conf):
+        if conf.status == "REJECTED" and conf.reason in MARKET_CLOSED:
+            # Later signals are answered without logging in until it next opens.
+            calendar = ig_cache.HOURS.get(rule.name) or ig_hours.Calendar()
+            calendar.observe("CLOSED", time())
+            ig_cache.HOURS.set(rule.name, calendar)
+            print("Market offline.")
+            return reply(400, "Market offline.")
+        print(conf.doc)
+        return reply(400, conf.doc)
+
+    def success(self, msg):
+        print(msg)
+        return reply(200, msg)
+
+
+def validator():
+    """Signal validator for the current token and rules, see ig_validate."""
+
+    global VALIDATOR
+    token = os.environ.get('WEBHOOK_TOKEN')
+    if VALIDATOR is None or VALIDATOR.token != (token.encode() if token else None):
+        VALIDATOR = ig_validate.Validator(token, RULES)
+    return VALIDATOR
+
+
+def ig_url():
+    return os.environ.get('IG_URL', LIVE_URL if LIVE else DEMO_URL)
+
+
+def new_session():
+    """The container's IG transport, selected by IG_TRANSPORT, see ig_transport."""
+
+    global transport
+    if transport is None:
+        transport = ig_transport.new(os.environ.get('IG_TRANSPORT'))
+    return transport
+
+
+def prewarm():
+    """
+    Resolve and connect to IG before a signal needs it. Returns the ms spent,
+    or None if the connection was already open or could not be made.
+    """
+
+    global prewarmed
+    start = perf_counter()
     try:
-        # Parse incoming webhook signal.
-        webhook_signal = json.loads(event['body'])
+        session = new_session()
+        if not getattr(session, 'connect', None) or not session.connect(ig_url()):
+            return None
     except Exception as e:
-        print("Event body type",  type(event['body']), "str:", event['body'])
-        sys.exit(0)
-
-    # Action signal only if webhook token matches stored token.
-    if webhook_signal['token'] == WEBHOOK_TOKEN:
-
-        # Action signal only if ticker code is known.
-        if webhook_signal['ticker'].upper() in TICKER_MAP.keys():
-
-            # 4
-            # Load IG auth tokens from environment variables.
-            if LIVE:
-                if(  # Live.
-                    os.environ['IG_API_KEY_LIVE'] and os.environ['IG_USERNAME_LIVE'] and
-                        os.environ['IG_PASSWORD_LIVE']):
-                    IG_API_KEY = os.environ['IG_API_KEY_LIVE']
-                    IG_USERNAME = os.environ['IG_USERNAME_LIVE']
-                    IG_PASSWORD = os.environ['IG_PASSWORD_LIVE']
-                    IG_URL = "https://api.ig.com/gateway/deal"
-                else:
-                    print("Error: IG Markets live authentication tokens missing")
-                    return {
-                        'statusCode': 400,
-                        'body': json.dumps(
-                            "IG Markets live authentication tokens missing")}
-            else:
-                if(  # Demo.
-                    os.environ['IG_API_KEY_DEMO'] and os.environ['IG_USERNAME_DEMO'] and
-                        os.environ['IG_PASSWORD_DEMO']):
-                    IG_API_KEY = os.environ['IG_API_KEY_DEMO']
-                    IG_USERNAME = os.environ['IG_USERNAME_DEMO']
-                    IG_PASSWORD = os.environ['IG_PASSWORD_DEMO']
-                    IG_URL = "https://demo-api.ig.com/gateway/deal"
-                else:
-                    print("Error: IG Markets demo authentication tokens missing")
-                    return {
-                        'statusCode': 400,
-                        'body': json.dumps(
-                            "IG Markets demo authentication tokens missing")}
-
-            # 5
-            # Create a session with IG.
-            retries = urllib3.util.retry.Retry(
-                total=5,
-                backoff_factor=0.25,
-                status_forcelist=[502, 503, 504],
-                method_whitelist=False)
-            s = requests.Session()
-            s.mount('https://', requests.adapters.HTTPAdapter(max_retries=retries))
-
-            headers = {
-                'X-IG-API-KEY': IG_API_KEY,
-                'Version': "2",
-                'Content-Type': 'application/json',
-                'Accept': 'application/json; charset=UTF-8'}
-
-            body = {
-                "identifier": IG_USERNAME,
-                "password": IG_PASSWORD}
-
-            # Initiate and reload the session as sometimes first session fails.
-            response = s.send(requests.Request('POST', IG_URL + "/session", json=body, headers=headers,
-                              params='').prepare())
-            sleep(1)
-            response = s.send(requests.Request('POST', IG_URL + "/session", json=body, headers=headers,
-                              params='').prepare())
-
-            # CST and X-SECURITY-TOKEN must be included in subsequent requests.
-            CST, XST = response.headers['CST'], response.headers['X-SECURITY-TOKEN']
-
-            # Prepare headers for new requests.
-            headers = {
-                'X-IG-API-KEY': IG_API_KEY,
-                # 'Version': "2",
-                'Content-Type': 'application/json',
-                'Accept': 'application/json; charset=UTF-8',
-                'X-SECURITY-TOKEN': XST,
-                'CST': CST}
-
-            # Check if trailing stops are enabled for the account
-            response = s.send(requests.Request('GET', IG_URL + "/accounts/preferences", headers=headers,
-                              params='').prepare())
-
-            if not response.json()["trailingStopsEnabled"]:
-                print("Trailing stops disabled. Attempting to enable.")
-                response = s.send(requests.Request('PUT', IG_URL + "/accounts/preferences",
-                                  json={"trailingStopsEnabled": True},
-                                  headers=headers,
-                                  params='').prepare())
-
-                # Verify it was actually enabled
-                response = s.send(requests.Request('GET', IG_URL + "/accounts/preferences", headers=headers,
-                                  params='').prepare())
-                if response.json()["trailingStopsEnabled"]:
-                    print("Trailing stops enabled")
-                else:
-                    return {
-                        'statusCode': 400,
-                        'body': json.dumps("Unable to enable trailing stops.")}
-            else:
-                print("Trailing stops already enabled.")
-
-            # 6
-            position, name, search, iclass, idetails, epic, expiry, psize, minsize, currencies, unit = None, None, None, None, None, None, None, None, None, None, None
-
-            name = TICKER_MAP[webhook_signal['ticker'].upper()][0]
-            search = TICKER_MAP[webhook_signal['ticker'].upper()][1]
-            iclass = TICKER_MAP[webhook_signal['ticker'].upper()][2]
-            size_multi = TICKER_MAP[webhook_signal['ticker']][3]
-
-            # Check for open positions.
-            existing_positions = s.send(requests.Request('GET', IG_URL + "/positions", headers=headers, params='').prepare()).json()
-            find_instrument = True
-
-            # If open position exists matching ticker code, use that EPIC and expiry.
-            if len(existing_positions['positions']) > 0:
-                for pos in existing_positions['positions']:
-                    if name in pos['market']['instrumentName'][:len(name)]:
-                        print("Open position exists for " + name + ".")
-                        print(json.dumps(pos, indent=2))
-                        epic = pos['market']["epic"]
-                        expiry = pos['market']["expiry"]
-
-                        # Store open position data.
-                        position = pos
-                        find_instrument = False
-
-            # Otherwise identify appropriate instrument.
-            if find_instrument:
-
-                # Find appropriate instrument to match given webhook ticker code.
-                markets = s.send(requests.Request('GET', IG_URL + "/markets?searchTerm=" + search, headers=headers, params='').prepare())
-
-                for market in markets.json()['markets']:
-                    # print(json.dumps(market, indent=2))
-                    if market['expiry'] != "DFB" and market['instrumentName'][:len(name)] == name and market['instrumentType'] == iclass:
-                        epic, expiry = market["epic"], market["expiry"]
-                        break
-
-            # Fetch remaining instrument info.
-            idetails = s.send(requests.Request('GET', IG_URL + "/markets/" + epic, headers=headers, params='').prepare()).json()
-            psize = idetails['instrument']['lotSize']
-            currencies = [c['name'] for c in idetails['instrument']['currencies']]
-            minsize = idetails['dealingRules']['minDealSize']['value'] if idetails['dealingRules']['minDealSize']['value'] >= 1 else 1
-            unit = idetails['dealingRules']['minDealSize']['unit']
+        print("Error: pre-warming the IG connection failed:", e)
+        return None
+
+    ms = (perf_counter() - start) * 1000
+    prewarmed = (prewarmed or 0) + ms
+    return ms
+
+
+def credentials():
+    """(api key, username, password) for live or demo trading, or None if any is missing."""
+
+    env = "LIVE" if LIVE else "DEMO"
+    values = tuple(os.environ.get('IG_%s_%s' % (k, env)) for k in ("API_KEY", "USERNAME", "PASSWORD"))
+    return values if all(values) else None
+
+
+def login(s, url, api_key, username, password):
+    """Log in to IG. Returns the CST and X-SECURITY-TOKEN."""
+
+    headers = {
+        'X-IG-API-KEY': api_key,
+        'Version': "2",
+        'Content-Type': 'application/json',
+        'Accept': 'application/json; charset=UTF-8'}
+
+    body = {
+        "identifier": username,
+        "password": password}
+
+    # Initiate and reload the session as sometimes first session fails.
+    s.send(ig_transport.Request('POST', url + "/session", json=body, headers=headers))
+    sleep(1)
+    response = s.send(ig_transport.Request('POST', url + "/session", json=body, headers=headers))
+
+    # CST and X-SECURITY-TOKEN must be included in subsequent requests.
+    return response.headers['CST'], response.headers['X-SECURITY-TOKEN']
+
+
+def session_headers(api_key, cst, xst):
+    return {
+        'X-IG-API-KEY': api_key,
+        # 'Version': "2",
+        'Content-Type': 'application/json',
+        'Accept': 'application/json; charset=UTF-8',
+        'X-SECURITY-TOKEN': xst,
+        'CST': cst}
+
+
+def authenticate(s, url, api_key, username, password):
+    """
+    Headers for an IG session, the account preferences response, and whether
+    the session was reused. The cached session is used if IG still accepts
+    it; the preferences request doubles as the check. Only a 401 means a new
+    login; any other failure is returned for the caller to report.
+    """
+
+    cached = ig_cache.SESSIONS.get(username)
+    if cached:
+        headers = session_headers(api_key, *cached)
+        response = s.send(ig_transport.Request('GET', url + "/accounts/preferences", headers=headers))
+        if response.status_code != 401:
+            return headers, response, True
+        print("Cached IG session expired.")
+        ig_cache.SESSIONS.clear(username)
+
+    tokens = login(s, url, api_key, username, password)
+    ig_cache.SESSIONS.set(username, tokens)
+    headers = session_headers(api_key, *tokens)
+    response = s.send(ig_transport.Request('GET', url + "/accounts/preferences", headers=headers))
+    return headers, response, False
+
+
+def resolve(s, url, headers, rule, refresh=False):
+    """
+    (epic, expiry) of the market a rule trades, from the cache or a /markets
+    search; (None, None) if none matches. refresh drops the cached one first.
+    """
+
+    key = (rule.name, rule.search, rule.iclass)
+    if refresh:
+        ig_cache.EPICS.clear(key)
+    found = ig_cache.EPICS.get(key)
+    if found:
+        return found
+
+    # Find appropriate instrument to match given webhook ticker code.
+    markets = s.send(ig_transport.Request('GET', url + "/markets?searchTerm=" + rule.search, headers=headers))
+    name = rule.name
+    market = ig_parse.first(markets.content, 'markets', lambda m: (
+        m['expiry'] != "DFB" and m['instrumentName'][:len(name)] == name and m['instrumentType'] == rule.iclass))
+    if market is None:
+        return None, None
+
+    found = market["epic"], market["expiry"]
+    ig_cache.EPICS.set(key, found)
+    return found
+
+
+def is_warm(event):
+    """
+    True for a scheduled warm-up: an EventBridge schedule, or {"warm": true}.
+    Webhook events always carry a body.
+    """
+
+    return isinstance(event, dict) and 'body' not in event and (
+        event.get('source') == "aws.events" or event.get('warm') is True)
+
+
+def warm():
+    """
+    Log in or validate the session, resolve every instrument's EPIC, load any
+    missing trading hours and check the connection. Never trades.
+    """
+
+    creds = credentials()
+    if not creds:
+        print("Error: IG Markets authentication tokens missing")
+        return reply(400, "IG Markets authentication tokens missing")
+
+    IG_API_KEY, IG_USERNAME, IG_PASSWORD = creds
+    IG_URL = ig_url()
+
+    prewarm()
+    s = ig_metrics.wrap(ig_cassette.wrap(new_session()))
+    headers, response, reused = authenticate(s, IG_URL, IG_API_KEY, IG_USERNAME, IG_PASSWORD)
+    if response.status_code != 200:
+        print("Error: IG session unavailable:", response.text)
+        return reply(response.status_code, "IG session unavailable.")
+
+    epics = {rule.name: resolve(s, IG_URL, headers, rule, refresh=True)[0] for rule in RULES.instruments()}
+
+    # Trading hours, once a day.
+    for name, epic in epics.items():
+        if epic and ig_cache.HOURS.get(name) is None:
+            response = s.send(ig_transport.Request('GET', IG_URL + "/markets/" + epic, headers=headers))
+            if response.status_code != 200:
+                print("Error: market details unavailable for %s: %s" % (epic, response.text))
+                continue
+            details = ig_models.MarketDetails.from_doc(response.json())
+            ig_cache.HOURS.set(name, ig_hours.Calendar.from_details(details, time()))
+    print("Warm:", "cached" if reused else "new", "session,", json.dumps(epics))
+    return reply(200, {'session': "cached" if reused else "new", 'epics': epics})
+
+
+@ig_metrics.measured
+@ig_cassette.recorded
+def lambda_handler(event, context):
+    global prewarmed
 
+    # 1
+    # Pick up any edits to the instrument rules.
+    RULES.refresh()
+
+    if is_warm(event):
+        ig_metrics.tag(event="warm")
+        return warm()
+
+    # 2
+    # Check the signal before anything else: token, ticker and side.
+    # Bad or spoofed signals never cost a login.
+    try:
+        webhook_signal, rule, side = validator().check(event)
+    except ig_validate.Rejected as e:
+        print("Error:", e.message)
+        return reply(e.status, e.message)
+    ig_metrics.tag(instrument=rule.name)
+
+    # Nor does a signal for a market known to be closed, see ig_hours.
+    calendar = ig_cache.HOURS.get(rule.name)
+    if calendar and calendar.closed(time()):
+        print("Market offline.")
+        ig_metrics.tag(market="closed")
+        return reply(400, "Market offline.")
+
+    # 3
+    # Load IG auth tokens from environment variables.
+    creds = credentials()
+    if not creds:
+        print("Error: IG Markets %s authentication tokens missing" % ("live" if LIVE else "demo"))
+        return {
+            'statusCode': 400,
+            'body': json.dumps(
+                "IG Markets %s authentication tokens missing" % ("live" if LIVE else "demo"))}
+    IG_API_KEY, IG_USERNAME, IG_PASSWORD = creds
+    IG_URL = ig_url()
+
+    # 4
+    # Create a session with IG.
+    s = ig_metrics.wrap(ig_cassette.wrap(new_session()))
+    if prewarmed:
+        # Connection set-up this signal didn't have to wait for.
+        ig_metrics.metric(prewarm_ms=round(prewarmed, 3))
+        prewarmed = None
+
+    # Reuse the container's session if IG still accepts it, else log in.
+    headers, response, reused = authenticate(s, IG_URL, IG_API_KEY, IG_USERNAME, IG_PASSWORD)
+    ig_metrics.tag(session="cached" if reused else "new")
+    if response.status_code != 200:
+        print("Error: IG session unavailable:", response.text)
+        return reply(response.status_code, "IG session unavailable.")
+
+    # Check if trailing stops are enabled for the account
+    if not response.json()["trailingStopsEnabled"]:
+        print("Trailing stops disabled. Attempting to enable.")
+        response = s.send(ig_transport.Request('PUT', IG_URL + "/accounts/preferences",
+                          json={"trailingStopsEnabled": True},
+                          headers=headers))
+
+        # Verify it was actually enabled
+        response = s.send(ig_transport.Request('GET', IG_URL + "/accounts/preferences", headers=headers))
+        if response.json()["trailingStopsEnabled"]:
+            print("Trailing stops enabled")
         else:
-            print("Error: Webhook ticker code not recognised.")
-            return {
-                'statusCode': 400,
-                'body': json.dumps("Webhook ticker code not recognised.")}
-
-        side = webhook_signal['side'].upper()
-
-        position_size = size_multi * minsize
-
-        # 7
-
-        ###########################
-        # START WHEATUSD HANDLING #
-        ###########################
-        if name == "Chicago Wheat":
-
-            sl_both = 20
-            closed = False
-
-            if position:
-                print("WHEAT has an existing", position['position']['direction'], "of size", position['position']['dealSize'])
-            else:
-                print("No position for wheat.")
-
-            if position:
-
-                # Filter non-sequential signals
-                if position['position']['direction'] == "BUY" and side == "SELL" or position['position']['direction'] == "SELL" and side == "BUY":
-                    close_side = "BUY" if position['position']['direction'] == "SELL" else "SELL"
-                    body = {
-                        "dealId": position['position']['dealId'],
-                        "epic": None,
-                        "expiry": expiry,
-                        "direction": close_side,
-                        # "size": pos['position']['dealSize'],
-                        "size": size_multi,
-                        "level": None,
-                        "orderType": "MARKET",
-                        "timeInForce": None,
-                        "quoteId": None}
-
-                    # Attempt to close the existing position.
-                    headers['_method'] = "DELETE"
-                    r = s.send(requests.Request("POST", IG_URL + "/positions/otc", headers=headers, json=body, params='').prepare())
-                    del headers['_method']
-                    ref = r.json()
-                    if r.status_code == 200:
-
-                        # Check if position was closed.
-                        c = s.send(requests.Request('GET', IG_URL + "/confirms/" + ref['dealReference'], headers=headers, params='').prepare())
-                        conf = c.json()
-                        closed = True if conf['dealStatus'] == "ACCEPTED" else False
-
-                        # Handle error cases.
-                        if conf['dealStatus'] == "REJECTED":
-                            if conf['reason'] == "MARKET_OFFLINE" or conf['reason'] == "MARKET_CLOSED_WITH_EDITS":
-                                print("Market offline.")
-                                return {
-                                    'statusCode': 400,
-                                    'body': json.dumps("Market offline.")}
-                            else:
-                                return {
-                                    'statusCode': 400,
-                                    'body': json.dumps(conf)}
-                    else:
-                        print("Position closure failure.")
-                        return {
-                            'statusCode': r.status_code,
-                            'body': json.dumps("Order placement failure.")}
-
-            if not position or closed:
-                sl = idetails['snapshot']['offer'] - sl_both if side == "BUY" else idetails['snapshot']['bid'] + sl_both
-                tp = None
-
-                # Prepare new position order.
-                order = {
-                    "epic": epic,
-                    "expiry": expiry,
-                    "direction": side,
-                    "size": position_size,
-                    "orderType": "MARKET",
-                    # "timeInForce": None,
-                    "level": None,
-                    "guaranteedStop": False,
-                    "stopLevel": sl,
-                    "stopDistance": None,
-                    # "trailingStop": False,
-                    # "trailingStopIncrement": None,
-                    "forceOpen": True,
-                    "limitLevel": tp,
-                    "limitDistance": None,
-                    "quoteId": None,
-                    "currencyCode": "GBP"
-                }
-
-                # Attempt to open a new position.
-                r = s.send(requests.Request('POST', IG_URL + "/positions/otc", headers=headers, json=order, params='').prepare())
-                ref = r.json()
-                if r.status_code == 200:
-
-                    # Check if new position was opened.
-                    c = s.send(requests.Request('GET', IG_URL + "/confirms/" + ref['dealReference'], headers=headers, params='').prepare())
-                    conf = c.json()
-
-                    # Handle error cases.
-                    if conf['dealStatus'] == "REJECTED":
-                        if conf['reason'] == "MARKET_OFFLINE" or conf['reason'] == "MARKET_CLOSED_WITH_EDITS":
-                            print("Market offline.")
-                            return {
-                                'statusCode': 400,
-                                'body': json.dumps("Market offline.")}
-                        else:
-                            return {
-                                'statusCode': 400,
-                                'body': json.dumps(conf)}
-
-                    # Return 200 on success.
-                    elif conf['dealStatus'] == "ACCEPTED":
-                        success_string = name + " " + side + " position opened successfully."
-                        print(success_string)
-                        return {
-                            'statusCode': 200,
-                            'body': json.dumps(success_string)}
-
-                    # Log other cases.
-                    else:
-                        print(conf)
-                        return {
-                            'statusCode': 400,
-                            'body': json.dumps(conf)}
-                else:
-                    print("Order placement failure.")
-                    return {
-                        'statusCode': r.status_code,
-                        'body': json.dumps("Order placement failure.")}
-            else:
-                msg_string = name + " " + position['position']['direction'] + " position already open, or failed to close existing position."
-                print(msg_string)
-                return {
-                    'statusCode': 400,
-                    'body': json.dumps(msg_string)}
-
-        ######################
-        # START DAX HANDLING #
-        ######################
-        elif name == "Germany 30":
-
-            sl_long, sl_short, adjust = 255, 255, 4
-            tp_both = 40
-
-            # Signal side must be "BUY" "SELL" "CLOSE_BUY" "CLOSE_SELL"
-
-            # Open a new long or short.
-            if side == "BUY" or side == "SELL":
-
-                # sl = idetails['snapshot']['offer'] - sl_long if side == "BUY" else idetails['snapshot']['bid'] + sl_short
-                if side == "BUY":
-                    stop = idetails['snapshot']['bid'] - sl_short + adjust
-                    tp = idetails['snapshot']['offer'] + tp_both
-                elif side == "SELL":
-                    stop = idetails['snapshot']['offer'] + sl_short - adjust
-                    tp = idetails['snapshot']['bid'] - tp_both
-
-                # Prepare new position order.
-                order = {
-                    "epic": epic,
-                    "expiry": expiry,
-                    "direction": side,
-                    "size": position_size,
-                    "orderType": "MARKET",
-                    # "timeInForce": None,
-                    "level": None,
-                    "guaranteedStop": False,
-                    "stopLevel": stop,
-                    "stopDistance": None,
-                    # "trailingStop": False,
-                    # "trailingStopIncrement": None,
-                    "forceOpen": True,
-                    "limitLevel": tp,
-                    "limitDistance": None,
-                    "quoteId": None,
-                    "currencyCode": currencies[0]
-                }
-
-                # Attempt to open a new position.
-                if position is None:
-                    r = s.send(requests.Request('POST', IG_URL + "/positions/otc", headers=headers, json=order, params='').prepare())
-                    ref = r.json()
-                    if r.status_code == 200:
-
-                        # Check if new position was opened.
-                        c = s.send(requests.Request('GET', IG_URL + "/confirms/" + ref['dealReference'], headers=headers, params='').prepare())
-                        conf = c.json()
-
-                        # Handle error cases.
-                        if conf['dealStatus'] == "REJECTED":
-                            if conf['reason'] == "MARKET_OFFLINE" or conf['reason'] == "MARKET_CLOSED_WITH_EDITS":
-                                print("Market offline.")
-                                return {
-                                    'statusCode': 400,
-                                    'body': json.dumps("Market offline.")}
-                            else:
-                                return {
-                                    'statusCode': 400,
-                                    'body': json.dumps(conf)}
-
-                        # Return 200 on success.
-                        elif conf['dealStatus'] == "ACCEPTED":
-                            success_string = name + " position opened successfully."
-                            print(success_string)
-                            return {
-                                'statusCode': 200,
-                                'body': json.dumps(success_string)}
-
-                        # Log other cases.
-                        else:
-                            print(conf)
-                            return {
-                                'statusCode': 400,
-                                'body': json.dumps(conf)}
-
-                elif position:
-                    msg_string = name + " already positioned."
-                    print(msg_string)
-                    return {
-                        'statusCode': 400,
-                        'body': json.dumps(msg_string)}
-
-            # Close the existing long or short.
-            elif side.upper() == "CLOSE_BUY" or side.upper() == "CLOSE_SELL":
-
-                # Prepare closure order.
-                if position:
-                    close_side = "BUY" if side.upper() == "CLOSE_SELL" else "SELL"
-                    body = {
-                        "dealId": position['position']['dealId'],
-                        "epic": None,
-                        "expiry": expiry,
-                        "direction": close_side,
-                        "size": pos['position']['dealSize'],
-                        "level": None,
-                        "orderType": "MARKET",
-                        "timeInForce": None,
-                        "quoteId": None}
-
-                    # Add new method header for position closures
-                    headers['_method'] = "DELETE"
-                    r = s.send(requests.Request("POST", IG_URL + "/positions/otc", headers=headers, json=body, params='').prepare())
-                    del headers['_method']
-                    ref = r.json()
-
-                    if r.status_code == 200:
-
-                        # Check if position was closed.
-                        c = s.send(requests.Request('GET', IG_URL + "/confirms/" + ref['dealReference'], headers=headers, params='').prepare())
-                        conf = c.json()
-
-                        # Handle error cases.
-                        if conf['dealStatus'] == "REJECTED":
-                            if conf['reason'] == "MARKET_OFFLINE" or conf['reason'] == "MARKET_CLOSED_WITH_EDITS":
-                                print("Market offline.")
-                                return {
-                                    'statusCode': 400,
-                                    'body': json.dumps("Market offline.")}
-                            else:
-                                return {
-                                    'statusCode': 400,
-                                    'body': json.dumps(conf)}
-
-                        # Return 200 on success.
-                        elif conf['dealStatus'] == "ACCEPTED":
-                            success_string = name + " position closed successfully."
-                            print(success_string)
-                            return {
-                                'statusCode': 200,
-                                'body': json.dumps(success_string)}
-
-                        # Log other cases.
-                        else:
-                            print(conf)
-                            return {
-                                'statusCode': 400,
-                                'body': json.dumps(conf)}
-
-                else:
-                    print("No existing position.")
-                    return {
-                        'statusCode': 400,
-                        'body': json.dumps("No existing position.")}
-
-            else:
-                print("Webhook signal side error")
-                return {
-                    'statusCode': 400,
-                    'body': json.dumps("Webhook signal side error")}
-
-        ########################
-        # START UKOIL HANDLING #
-        ########################
-        elif name == "Oil - Brent Crude":
-
-            sl_pips, tp_pips, adjust = 150, 25, 2.8
-            sl_trail_step = 15
-            closed = False
-
-            if position:
-                print("UKOIL has an existing", position['position']['direction'], "of size", position['position']['dealSize'])
-            else:
-                print("No position for UKOIL.")
-
-            if position:
-
-                # Filter non-sequential signals
-                if position['position']['direction'] == "BUY" and side == "SELL" or position['position']['direction'] == "SELL" and side == "BUY":
-                    close_side = "BUY" if position['position']['direction'] == "SELL" else "SELL"
-                    body = {
-                        "dealId": position['position']['dealId'],
-                        "epic": None,
-                        "expiry": expiry,
-                        "direction": close_side,
-                        # "size": pos['position']['dealSize'],
-                        "size": size_multi,
-                        "level": None,
-                        "orderType": "MARKET",
-                        "timeInForce": None,
-                        "quoteId": None}
-
-                    # Attempt to close the existing position.
-                    headers['_method'] = "DELETE"
-                    r = s.send(requests.Request("POST", IG_URL + "/positions/otc", headers=headers, json=body, params='').prepare())
-                    del headers['_method']
-                    ref = r.json()
-                    if r.status_code == 200:
-
-                        # Check if position was closed.
-                        c = s.send(requests.Request('GET', IG_URL + "/confirms/" + ref['dealReference'], headers=headers, params='').prepare())
-                        conf = c.json()
-                        closed = True if conf['dealStatus'] == "ACCEPTED" else False
-
-                        # Handle error cases.
-                        if conf['dealStatus'] == "REJECTED":
-                            if conf['reason'] == "MARKET_OFFLINE" or conf['reason'] == "MARKET_CLOSED_WITH_EDITS":
-                                print("Market offline.")
-                                return {
-                                    'statusCode': 400,
-                                    'body': json.dumps("Market offline.")}
-                            else:
-                                return {
-                                    'statusCode': 400,
-                                    'body': json.dumps(conf)}
-                    else:
-                        print("Position closure failure.")
-                        return {
-                            'statusCode': r.status_code,
-                            'body': json.dumps("Order placement failure.")}
-
-            if not position or closed:
-                # Open positon with linked sl and tp using best bid and offer
-
-                if side == "BUY":
-                    sl = idetails['snapshot']['bid'] - sl_pips + adjust
-                    tp = idetails['snapshot']['offer'] + tp_pips
-                elif side == "SELL":
-                    sl = idetails['snapshot']['offer'] + sl_pips - adjust
-                    tp = idetails['snapshot']['bid'] - tp_pips
-                else:
-                    print("Webhook signal side error")
-                    return {
-                        'statusCode': 400,
-                        'body': json.dumps("Webhook signal side error")}
-
-                # Prepare new position order.
-                order = {
-                    "epic": epic,
-                    "expiry": expiry,
-                    "direction": side,
-                    "size": position_size,
-                    "orderType": "MARKET",
-                    # "timeInForce": None,
-                    "level": None,
-                    "guaranteedStop": False,
-                    "stopLevel": sl,
-                    "stopDistance": None,
-                    # "trailingStop": True,
-                    # "trailingStopIncrement": sl_trail_step,
-                    "forceOpen": True,
-                    "limitLevel": tp,
-                    "limitDistance": None,
-                    "quoteId": None,
-                    "currencyCode": "GBP"
-                }
-
-                # Attempt to open a new position.
-                r = s.send(requests.Request('POST', IG_URL + "/positions/otc", headers=headers, json=order, params='').prepare())
-                ref = r.json()
-                if r.status_code == 200:
-
-                    # Check if new position was opened.
-                    c = s.send(requests.Request('GET', IG_URL + "/confirms/" + ref['dealReference'], headers=headers, params='').prepare())
-                    conf = c.json()
-
-                    # Handle error cases.
-                    if conf['dealStatus'] == "REJECTED":
-                        if conf['reason'] == "MARKET_OFFLINE" or conf['reason'] == "MARKET_CLOSED_WITH_EDITS":
-                            print("Market offline.")
-                            return {
-                                'statusCode': 400,
-                                'body': json.dumps("Market offline.")}
-                        else:
-                            return {
-                                'statusCode': 400,
-                                'body': json.dumps(conf)}
-
-                    # Return 200 on success.
-                    elif conf['dealStatus'] == "ACCEPTED":
-                        success_string = name + " " + side + " position opened successfully."
-                        print(success_string)
-                        return {
-                            'statusCode': 200,
-                            'body': json.dumps(success_string)}
-
-                    # Log other cases.
-                    else:
-                        print(conf)
-                        return {
-                            'statusCode': 400,
-                            'body': json.dumps(conf)}
-                else:
-                    print(json.dumps(order, indent=2))
-                    print("Order placement failure.")
-                    print(r.json())
-                    return {
-                        'statusCode': r.status_code,
-                        'body': json.dumps("Order placement failure.")}
-            else:
-                msg_string = name + " " + position['position']['direction'] + " position already open, or failed to close existing position."
-                print(msg_string)
-                return {
-                    'statusCode': 400,
-                    'body': json.dumps(msg_string)}
-        else:
-            print("Error: Instrument name not recognised.")
             return {
                 'statusCode': 400,
-                'body': json.dumps("Instrument name not recognised.")}
-
+                'body': json.dumps("Unable to enable trailing stops.")}
     else:
-        print("Webhook signal token error")
-        return {
-            'statusCode': 400,
-            'body': json.dumps("Webhook signal token error")}
\ No newline at end of file
+        print("Trailing stops already enabled.")
+
+    # 5
+    position, details, epic, expiry, psize, minsize, currencies, unit = None, None, None, None, None, None, None, None
+    name = rule.name
+
+    # Check for open positions. Only this instrument's are decoded.
+    existing_positions = s.send(ig_transport.Request('GET', IG_URL + "/positions", headers=headers))
+    find_instrument = True
+
+    # If open position exists matching ticker code, use that EPIC and expiry.
+    for pos in ig_parse.positions(existing_positions.content, name):
+        print("Open position exists for " + name + ".")
+
+        # Store open position data.
+        position = ig_models.Position.from_doc(pos)
+        epic, expiry = position.epic, position.expiry
+        find_instrument = False
+
+    # Otherwise identify appropriate instrument.
+    if find_instrument:
+        epic, expiry = resolve(s, IG_URL, headers, rule)
+
+    # Fetch remaining instrument info.
+    fetch = lambda: s.send(ig_transport.Request('GET', IG_URL + "/markets/" + epic, headers=headers)) if epic else None
+    response = fetch()
+    if find_instrument and response is not None and response.status_code != 200:
+        # The cached EPIC may have rolled or been delisted: search again, once.
+        print("Market details unavailable for %s, searching again." % epic)
+        epic, expiry = resolve(s, IG_URL, headers, rule, refresh=True)
+        response = fetch()
+    if response is None:
+        print("Error: no IG market found for " + name + ".")
+        return reply(400, "No IG market found for " + name + ".")
+    if response.status_code != 200:
+        print("Error: market details unavailable:", response.text)
+        return reply(response.status_code, "Market details unavailable.")
+    details = ig_models.MarketDetails.from_doc(response.json())
+    psize = details.lot_size
+    currencies = details.currencies
+    minsize = details.rules.min_deal_size
+    unit = details.rules.min_deal_size_unit
+    calendar = ig_hours.Calendar.from_details(details, time())
+    ig_cache.HOURS.set(name, calendar)
+    if calendar.closed(time()):
+        print("Market offline.")
+        ig_metrics.tag(market="closed")
+        return reply(400, "Market offline.")
+
+    # 6
+    # Decide what to do, then send the orders.
+    if position:
+        print(name, "has an existing", position.direction, "of size", position.size)
+        state = (position.direction, position.size)
+    else:
+        print("No position for " + name + ".")
+        state = None
+
+    plan = ig_decide.decide(rule, side, state, details.bid, details.offer, minsize)
+    trade = Trade(s, IG_URL, headers, epic, expiry, currencies)
+    return trade.execute(rule, plan, position)
+
+
+# Lambda runs module code in its init phase, before the first event and
+# billed separately, so connect to IG now. IG_PREWARM=on/off overrides.
+if os.environ.get('IG_PREWARM', "on" if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ else "off").lower() in ("on", "1", "true"):
+    prewarm()
@@ -0,0 +1,51 @@
+"""
+Caches kept for as long as the container is warm.
+
+    SESSIONS  CST/X-SECURITY-TOKEN pair per IG username, so a signal can skip
+              the login. IG keeps a session alive for 6 hours after its last
+              use; entries are dropped a little before that, and sooner if IG
+              rejects them.
+    EPICS     (epic, expiry) per instrument, from the /markets search.
+    HOURS     ig_hours.Calendar per instrument, from its market details.
+
+All are filled by signals and by the scheduled warm event.
+"""
+from time import monotonic
+import os
+
+
+class TTLCache:
+    """Dict whose entries expire ttl seconds after they were set."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if monotonic() - entry[1] >= self.ttl:
+            del self.entries[key]
+            return None
+        return entry[0]
+
+    def set(self, key, value):
+        self.entries[key] = (value, monotonic())
+
+    def clear(self, key=None):
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    def age(self, key):
+        """Seconds since key was set, or None."""
+
+        entry = self.entries.get(key)
+        return monotonic() - entry[1] if entry else None
+
+
+SESSIONS = TTLCache(float(os.environ.get('IG_SESSION_TTL', 5.5 * 3600)))
+EPICS = TTLCache(float(os.environ.get('IG_EPIC_TTL', 12 * 3600)))
+HOURS = TTLCache(float(os.environ.get('IG_HOURS_TTL', 24 * 3600)))
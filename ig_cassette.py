@@ -0,0 +1,320 @@
+"""
+Record and replay IG API interactions.
+
+Recording is opt-in: with IG_CASSETTE_DIR set, every request the handler
+sends through its session is captured along with the response and timing,
+and each invocation is written to one gzipped JSON-lines cassette file in
+that directory. API keys, passwords, usernames, session tokens, account ids
+and the webhook token are redacted before anything is written.
+
+A cassette can be served back in order by ReplaySession, at full speed or
+with the recorded response times, so a slow production trace can be rerun
+and profiled offline:
+
+    python ig_cassette.py show trace.jsonl.gz
+    python ig_cassette.py replay trace.jsonl.gz [--realtime] [--profile]
+    python ig_cassette.py check
+"""
+from datetime import datetime, timezone
+from time import perf_counter, sleep
+from ig_transport import Response
+import functools
+import binascii
+import base64
+import json
+import os
+
+
+REDACTED = "REDACTED"
+
+# Lower case header names and JSON keys that are never written.
+SECRET_HEADERS = frozenset(("x-ig-api-key", "cst", "x-security-token", "authorization", "cookie", "set-cookie"))
+SECRET_FIELDS = frozenset((
+    "password", "identifier", "token", "currentaccountid", "accountid", "clientid",
+    "lightstreamerendpoint", "encryptedpassword"))
+
+# Cassette being recorded by the current invocation, see recorded().
+active = None
+
+
+def redact_headers(headers):
+    return {k: REDACTED if k.lower() in SECRET_HEADERS else v for k, v in headers.items()}
+
+
+def redact_doc(doc):
+    if isinstance(doc, dict):
+        return {k: REDACTED if k.lower() in SECRET_FIELDS else redact_doc(v) for k, v in doc.items()}
+    if isinstance(doc, list):
+        return [redact_doc(v) for v in doc]
+    return doc
+
+
+def redact_body(body):
+    """
+    Redact a JSON request or response body given as bytes or str. A body
+    that isn't JSON can't be redacted field by field, so it isn't kept.
+    """
+
+    if not body:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    try:
+        return json.dumps(redact_doc(json.loads(body)), separators=(',', ':'))
+    except (ValueError, RecursionError):
+        return REDACTED
+
+
+class Cassette:
+    """One invocation's event and IG interactions."""
+
+    def __init__(self, event=None, interactions=None, meta=None):
+        self.meta = meta or {
+            "cassette": 1,
+            "recorded": datetime.now(timezone.utc).isoformat(),
+            "event": redact_event(event)}
+        self.interactions = interactions if interactions is not None else []
+        self.start = perf_counter()
+
+    def add(self, prepared, response, elapsed):
+        url = prepared.url
+        self.interactions.append({
+            "t": round(perf_counter() - self.start - elapsed, 6),
+            "method": prepared.method,
+            "path": url[url.find("/", url.find("//") + 2):] if "//" in url else url,
+            "request": {
+                "headers": redact_headers(prepared.headers),
+                "body": redact_body(prepared.body)},
+            "status": response.status_code,
+            "headers": redact_headers(response.headers),
+            "body": redact_body(response.content),
+            "elapsed": round(elapsed, 6)})
+
+    def save(self, directory):
+        import gzip
+
+        os.makedirs(directory, exist_ok=True)
+        signal = self.meta.get("signal") or {}
+        name = "%s-%s-%s.jsonl.gz" % (
+            datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f"),
+            signal.get("ticker", "unknown"), signal.get("side", "unknown"))
+        path = os.path.join(directory, name.replace("/", "_").replace(" ", "_"))
+        with gzip.open(path, "wt", compresslevel=9) as f:
+            f.write(json.dumps(self.meta, separators=(',', ':')) + "\n")
+            for i in self.interactions:
+                f.write(json.dumps(i, separators=(',', ':')) + "\n")
+        return path
+
+    @classmethod
+    def load(cls, path):
+        import gzip
+
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        return cls(interactions=lines[1:], meta=lines[0])
+
+
+def redact_event(event):
+    """Redacted copy of a Lambda event, with the parsed signal kept for naming."""
+
+    if not event:
+        return None
+    event = dict(event)
+    for k in ("headers", "multiValueHeaders"):
+        if isinstance(event.get(k), dict):
+            event[k] = redact_headers(event[k])
+    body = event.get("body")
+    if isinstance(body, str) and event.get("isBase64Encoded"):
+        # Stored decoded, as ig_validate reads it, so the token inside is redacted.
+        try:
+            body = base64.b64decode(body, validate=True)
+        except (binascii.Error, ValueError):
+            body = REDACTED
+        event["isBase64Encoded"] = False
+    if isinstance(body, (str, bytes)):
+        event["body"] = redact_body(body)
+    return event
+
+
+class Recorder:
+    """Session wrapper that records every send() into a Cassette."""
+
+    def __init__(self, session, cassette):
+        self.session = session
+        self.cassette = cassette
+
+    def send(self, prepared, **kwargs):
+        start = perf_counter()
+        response = self.session.send(prepared, **kwargs)
+        self.cassette.add(prepared, response, perf_counter() - start)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class CassetteMismatch(Exception):
+    pass
+
+
+class ReplaySession:
+    """
+    Serves a cassette's responses in order in place of a transport.
+
+    realtime sleeps for each response's recorded time. strict raises
+    CassetteMismatch if a request's method and path differ from the recording.
+    """
+
+    def __init__(self, cassette, realtime=False, strict=True):
+        self.cassette = cassette
+        self.realtime = realtime
+        self.strict = strict
+        self.position = 0
+
+    def send(self, prepared, **kwargs):
+        if self.position >= len(self.cassette.interactions):
+            raise CassetteMismatch("Cassette exhausted at %s %s" % (prepared.method, prepared.url))
+
+        i = self.cassette.interactions[self.position]
+        self.position += 1
+        if self.strict and (prepared.method != i["method"] or not prepared.url.endswith(i["path"])):
+            raise CassetteMismatch("Expected %s %s, got %s %s" % (i["method"], i["path"], prepared.method, prepared.url))
+
+        if self.realtime:
+            sleep(i["elapsed"])
+        return Response(i["status"], i["headers"], (i["body"] or "").encode(), prepared.url)
+
+
+def recorded(handler):
+    """Decorator for lambda_handler: records the invocation when IG_CASSETTE_DIR is set."""
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global active
+
+        directory = os.environ.get('IG_CASSETTE_DIR')
+        if not directory:
+            return handler(event, context)
+
+        active = Cassette(event)
+        try:
+            signal = json.loads(active.meta["event"]["body"])
+            active.meta["signal"] = {"ticker": signal.get("ticker"), "side": signal.get("side")}
+        except (ValueError, TypeError, KeyError, AttributeError):
+            pass
+
+        try:
+            result = handler(event, context)
+            active.meta["result"] = result
+            return result
+        finally:
+            try:
+                print("Cassette written to", active.save(directory))
+            except OSError as e:
+                print("Error: cassette not written:", e)
+            active = None
+
+    return wrapper
+
+
+def wrap(session):
+    """Return session, wrapped in a Recorder if this invocation is being recorded."""
+
+    return Recorder(session, active) if active else session
+
+
+def show(path):
+    cassette = Cassette.load(path)
+    print(json.dumps({k: v for k, v in cassette.meta.items() if k != "cassette"}, indent=2))
+    total = 0.0
+    for i in cassette.interactions:
+        total += i["elapsed"]
+        print("{:>9.1f} ms  {:<6} {:<45} {:>4} {:>9.1f} ms".format(
+            i["t"] * 1000, i["method"], i["path"][:45], i["status"], i["elapsed"] * 1000))
+    print("%d calls, %.1f ms waiting on IG" % (len(cassette.interactions), total * 1000))
+
+
+def replay(path, realtime=False, profile=False):
+    """Rerun the handler against a cassette and compare the result with the recording."""
+
+    cassette = Cassette.load(path)
+    for k in ('WEBHOOK_TOKEN', 'IG_API_KEY_DEMO', 'IG_USERNAME_DEMO', 'IG_PASSWORD_DEMO',
+              'IG_API_KEY_LIVE', 'IG_USERNAME_LIVE', 'IG_PASSWORD_LIVE'):
+        os.environ[k] = REDACTED
+    os.environ.pop('IG_CASSETTE_DIR', None)
+
+    import final_deployment_current as handler
+
+    session = ReplaySession(cassette, realtime=realtime)
+    handler.new_session = lambda: session
+    if not realtime:
+        handler.sleep = lambda s: None
+
+    start = perf_counter()
+    if profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        result = profiler.runcall(handler.lambda_handler, cassette.meta["event"], None)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    else:
+        result = handler.lambda_handler(cassette.meta["event"], None)
+    elapsed = perf_counter() - start
+
+    print("Replayed %d of %d calls in %.1f ms" % (session.position, len(cassette.interactions), elapsed * 1000))
+    print("Result:  ", result)
+    if "result" in cassette.meta and cassette.meta["result"] != result:
+        print("Recorded:", cassette.meta["result"])
+        return 1
+    return 0
+
+
+def check():
+    """Offline check that the webhook token never reaches a cassette, however the body is sent."""
+
+    import tempfile
+    import gzip
+
+    token = "s3cret-webhook-token"
+    body = json.dumps({"token": token, "ticker": "DAX", "side": "BUY"})
+    events = [
+        {"body": body},
+        {"body": base64.b64encode(body.encode()).decode(), "isBase64Encoded": True},
+        {"body": "token=" + token},
+        {"body": base64.b64encode(b"token=" + token.encode()).decode(), "isBase64Encoded": True},
+        {"body": "not base64 " + token, "isBase64Encoded": True}]
+    with tempfile.TemporaryDirectory() as directory:
+        for event in events:
+            path = Cassette(event).save(directory)
+            with gzip.open(path, "rb") as f:
+                raw = f.read()
+            assert token.encode() not in raw, raw
+            meta = Cassette.load(path).meta["event"]
+            assert not meta.get("isBase64Encoded"), meta
+            if event is events[0] or event is events[1]:
+                assert json.loads(meta["body"]) == {"token": REDACTED, "ticker": "DAX", "side": "BUY"}, meta
+            else:
+                assert meta["body"] == REDACTED, meta
+    print("ok")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or replay IG cassettes.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("show").add_argument("cassette")
+    sub.add_parser("check", help="offline check of the redaction")
+    p = sub.add_parser("replay")
+    p.add_argument("cassette")
+    p.add_argument("--realtime", action="store_true", help="wait the recorded time for each response")
+    p.add_argument("--profile", action="store_true", help="run under cProfile")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        show(args.cassette)
+    elif args.command == "check":
+        check()
+    else:
+        raise SystemExit(replay(args.cassette, args.realtime, args.profile))
@@ -0,0 +1,141 @@
+"""
+Coalescing of signal bursts on one instrument.
+
+When a strategy flips several times within seconds (buy, sell, buy during a
+volatile bar) every alert would otherwise be its own close/open cycle. With
+a window set, the first signal for an instrument opens a batch, signals for
+the same instrument arriving within the window join it, and when it closes
+the batch is reduced to its net signals before any IG call is made.
+
+net() does the reduction with the ig_decide kernel: it replays the batch from
+each possible starting position (flat, long, short) and picks the shortest
+sequence of its sides that ends in the same position from every one. So
+a merge never depends on a position we haven't fetched, and a batch that
+can't be shortened is run as it arrived.
+
+Each closed batch is printed as one JSON audit line and kept in
+Coalescer.audit: the signals merged, their arrival offsets, and what ran.
+"""
+from collections import deque
+from itertools import product
+from threading import Event, Lock
+from time import perf_counter, sleep, time
+import json
+
+import ig_decide
+
+
+# Longest net sequence tried. Every strategy's bursts reduce to at most this.
+MAX_NET = 2
+
+STARTS = (None, "BUY", "SELL")
+
+
+def replay(rule, sides, direction):
+    """Direction held after running sides from direction, None for flat."""
+
+    for side in sides:
+        plan = ig_decide.decide(rule, side, (direction, 1) if direction else None, 1.0, 1.0, 1)
+        if plan.action == ig_decide.CLOSE:
+            direction = None
+        elif plan.action != ig_decide.REJECT:
+            direction = plan.direction
+    return direction
+
+
+def net(rule, sides):
+    """Shortest list of sides with the same outcome as sides from any starting position."""
+
+    sides = list(sides)
+    target = [replay(rule, sides, d) for d in STARTS]
+
+    # Only sides the batch contains, so every net side runs as a signal that was sent.
+    # Latest first, so ties go to the most recent signal.
+    choices = list(dict.fromkeys(reversed(sides)))
+    for n in range(min(len(sides), MAX_NET + 1)):
+        for candidate in product(choices, repeat=n):
+            if [replay(rule, candidate, d) for d in STARTS] == target:
+                return list(candidate)
+    return sides
+
+
+class Batch:
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.opened = perf_counter()
+        self.signals = []  # (side, event, arrival)
+        self.results = {}
+        self.done = Event()
+
+
+class Coalescer:
+    """
+    Collects signals per instrument for window seconds, then calls
+    run(rule, side, event) for the net signals only. submit() blocks until its batch has
+    run and returns that signal's result: the handler's own for a signal
+    that ran, a merge notice for one that didn't.
+    """
+
+    def __init__(self, window, run, audit=100):
+        self.window = window
+        self.run = run
+        self.pending = {}
+        self.lock = Lock()
+        self.audit = deque(maxlen=audit)
+        self.received = 0
+        self.executed = 0
+
+    def submit(self, rule, side, event):
+        with self.lock:
+            self.received += 1
+            batch = self.pending.get(rule.name)
+            leader = batch is None
+            if leader:
+                batch = self.pending[rule.name] = Batch(rule)
+            index = len(batch.signals)
+            batch.signals.append((side, event, perf_counter()))
+
+        if leader:
+            sleep(self.window)
+            with self.lock:
+                del self.pending[rule.name]
+            self.flush(batch)
+        else:
+            batch.done.wait()
+        return batch.results[index]
+
+    def flush(self, batch):
+        rule = batch.rule
+        sides = [side for side, _, _ in batch.signals]
+        plan = net(rule, sides)
+
+        # Run each net side as the latest signal that asked for it; the rest are merged.
+        runs = [max(i for i, s in enumerate(sides) if s == side) for side in plan]
+        merged = "%s %%s signal merged into %s." % (rule.name, " then ".join(plan) or "no change")
+        try:
+            for index in runs:
+                side, event, _ = batch.signals[index]
+                batch.results[index] = self.run(rule, side, event)
+                self.executed += 1
+        except Exception as e:
+            print("Error: coalesced signal failed:", repr(e))
+            for index in runs:
+                batch.results.setdefault(index, {'statusCode': 500, 'body': json.dumps("Internal error.")})
+        finally:
+            for i, side in enumerate(sides):
+                if i not in batch.results:
+                    batch.results[i] = {'statusCode': 200, 'body': json.dumps(merged % side)}
+            batch.done.set()
+
+        record = {
+            'coalesced': rule.name,
+            'time': time(),
+            'window_s': self.window,
+            'signals': [{'side': side, 'at_ms': round((at - batch.opened) * 1000, 1)}
+                        for side, _, at in batch.signals],
+            'net': plan,
+            'saved': len(sides) - len(plan)}
+        self.audit.append(record)
+        if len(sides) > 1:
+            print(json.dumps(record, separators=(',', ':')))
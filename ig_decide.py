@@ -0,0 +1,226 @@
+"""
+Pure trade decision kernel.
+
+Given a webhook signal side, the current position, an instrument Rule (see
+ig_rules) and a quote, decide() returns a Plan describing what to send to IG:
+open, close, reverse (close then open) or reject. Nothing here does I/O, so
+the rules can be checked without a network.
+
+decide_batch() evaluates arrays of the same inputs with NumPy for checking
+large numbers of historical scenarios at once. NumPy is only imported when
+the batch API is used.
+"""
+from collections import namedtuple
+
+
+# Signal sides, actions and reject reasons, indexed by their batch codes.
+SIDES = ("BUY", "SELL", "CLOSE_BUY", "CLOSE_SELL")
+ACTIONS = ("OPEN", "CLOSE", "REVERSE", "REJECT")
+REASONS = (
+    None,
+    "Webhook signal side error",
+    "{name} {direction} position already open, or failed to close existing position.",
+    "{name} already positioned.",
+    "No existing position.")
+
+BUY, SELL, CLOSE_BUY, CLOSE_SELL = range(4)
+OPEN, CLOSE, REVERSE, REJECT = ACTIONS
+FLAT = INVALID = -1
+OK, SIDE_ERROR, ALREADY_OPEN, ALREADY_POSITIONED, NO_POSITION = range(5)
+
+
+# action: one of ACTIONS
+# direction, size, stop, limit: the new position for OPEN and REVERSE
+# close_direction, close_size: the closing order for CLOSE and REVERSE
+# reason: message for REJECT
+Plan = namedtuple('Plan', 'action direction size stop limit close_direction close_size reason')
+
+
+def rejection(code, rule, direction=None):
+    return Plan(REJECT, None, None, None, None, None, None,
+                REASONS[code].format(name=rule.name, direction=direction))
+
+
+def opposite(direction):
+    return "SELL" if direction == "BUY" else "BUY"
+
+
+def levels(rule, side, bid, offer):
+    """Return (stop, limit) for a new position opened at the given quote."""
+
+    if side == "BUY":
+        ref = bid if rule.stop_from == "exit" else offer
+        stop = ref - rule.stop + rule.adjust
+        limit = offer + rule.limit if rule.limit is not None else None
+    else:
+        ref = offer if rule.stop_from == "exit" else bid
+        stop = ref + rule.stop - rule.adjust
+        limit = bid - rule.limit if rule.limit is not None else None
+    return stop, limit
+
+
+def closing_size(rule, deal_size):
+    return rule.size_multi if rule.close_size == "multiplier" else deal_size
+
+
+def opening(rule, side, bid, offer, min_size, close_direction=None, close_size=None):
+    stop, limit = levels(rule, side, bid, offer)
+    size = rule.size_multi * (min_size if min_size >= 1 else 1)
+    action = OPEN if close_direction is None else REVERSE
+    return Plan(action, side, size, stop, limit, close_direction, close_size, None)
+
+
+class FlipStrategy:
+    """
+    "buy" or "sell" closes any opposite-direction position, then opens a new
+    position in the signal direction. Signals are assumed sequential.
+    """
+
+    name = "flip"
+    sides = frozenset(("BUY", "SELL"))
+
+    def decide(self, rule, side, direction, deal_size, bid, offer, min_size):
+        if side not in self.sides:
+            return rejection(SIDE_ERROR, rule)
+        if direction is None:
+            return opening(rule, side, bid, offer, min_size)
+        if direction == side:
+            return rejection(ALREADY_OPEN, rule, direction)
+        return opening(rule, side, bid, offer, min_size, opposite(direction), closing_size(rule, deal_size))
+
+    def decide_batch(self, np, rule, sides, directions, deal_sizes, bids, offers, min_sizes):
+        valid = (sides == BUY) | (sides == SELL)
+        flat = directions == FLAT
+
+        action = np.full(sides.shape, ACTIONS.index(REJECT), dtype=np.int8)
+        action[valid & flat] = ACTIONS.index(OPEN)
+        action[valid & ~flat & (directions != sides)] = ACTIONS.index(REVERSE)
+
+        reason = np.where(valid, ALREADY_OPEN, SIDE_ERROR).astype(np.int8)
+        reason[action != ACTIONS.index(REJECT)] = OK
+
+        reversing = action == ACTIONS.index(REVERSE)
+        close_direction = np.where(reversing, 1 - directions, FLAT).astype(np.int8)
+        return action, reason, close_direction, self.batch_close_size(np, rule, reversing, deal_sizes)
+
+    @staticmethod
+    def batch_close_size(np, rule, closing, deal_sizes):
+        size = rule.size_multi if rule.close_size == "multiplier" else deal_sizes
+        return np.where(closing, size, np.nan)
+
+
+class ExplicitCloseStrategy:
+    """
+    "buy" or "sell" opens a long or short if there's not an existing position.
+    "close_buy" or "close_sell" closes the long or short.
+    """
+
+    name = "explicit_close"
+    sides = frozenset(("BUY", "SELL", "CLOSE_BUY", "CLOSE_SELL"))
+
+    def decide(self, rule, side, direction, deal_size, bid, offer, min_size):
+        if side == "BUY" or side == "SELL":
+            if direction is not None:
+                return rejection(ALREADY_POSITIONED, rule)
+            return opening(rule, side, bid, offer, min_size)
+
+        if side == "CLOSE_BUY" or side == "CLOSE_SELL":
+            if direction is None:
+                return rejection(NO_POSITION, rule)
+            close_direction = "BUY" if side == "CLOSE_SELL" else "SELL"
+            return Plan(CLOSE, None, None, None, None, close_direction, closing_size(rule, deal_size), None)
+
+        return rejection(SIDE_ERROR, rule)
+
+    def decide_batch(self, np, rule, sides, directions, deal_sizes, bids, offers, min_sizes):
+        opens = (sides == BUY) | (sides == SELL)
+        closes = (sides == CLOSE_BUY) | (sides == CLOSE_SELL)
+        flat = directions == FLAT
+
+        action = np.full(sides.shape, ACTIONS.index(REJECT), dtype=np.int8)
+        action[opens & flat] = ACTIONS.index(OPEN)
+        action[closes & ~flat] = ACTIONS.index(CLOSE)
+
+        reason = np.select(
+            [opens, closes], [ALREADY_POSITIONED, NO_POSITION], SIDE_ERROR).astype(np.int8)
+        reason[action != ACTIONS.index(REJECT)] = OK
+
+        closing = action == ACTIONS.index(CLOSE)
+        close_direction = np.where(closing, np.where(sides == CLOSE_SELL, BUY, SELL), FLAT).astype(np.int8)
+        return action, reason, close_direction, FlipStrategy.batch_close_size(np, rule, closing, deal_sizes)
+
+
+# strategy name: strategy object
+STRATEGIES = {s.name: s for s in (FlipStrategy(), ExplicitCloseStrategy())}
+
+
+def decide(rule, side, position, bid, offer, min_size):
+    """
+    Decide what to do with a signal.
+
+    side: signal side, upper case
+    position: (direction, deal size) of the open position, or None
+    bid, offer: current quote
+    min_size: instrument minimum deal size
+    """
+
+    direction, deal_size = position if position else (None, None)
+    return rule.strategy.decide(rule, side, direction, deal_size, bid, offer, min_size)
+
+
+def encode_sides(sides):
+    """Map signal side strings to batch codes, INVALID for unknown sides."""
+
+    codes = {s: i for i, s in enumerate(SIDES)}
+    return [codes.get(s.upper(), INVALID) for s in sides]
+
+
+def decide_batch(rule, sides, directions, bids, offers, min_sizes=1, deal_sizes=None):
+    """
+    Vectorised decide() for many scenarios on one instrument.
+
+    sides: side codes (BUY, SELL, CLOSE_BUY, CLOSE_SELL or INVALID), see encode_sides
+    directions: open position direction codes (BUY, SELL or FLAT)
+    bids, offers, min_sizes, deal_sizes: arrays or scalars
+
+    Returns a dict of arrays: action (index into ACTIONS), reason (index into
+    REASONS), direction, size, stop, limit, close_direction and close_size.
+    Float fields are NaN and direction codes FLAT where they don't apply.
+    """
+
+    import numpy as np
+
+    sides = np.asarray(sides, dtype=np.int8)
+    directions = np.broadcast_to(np.asarray(directions, dtype=np.int8), sides.shape)
+    bids = np.broadcast_to(np.asarray(bids, dtype=np.float64), sides.shape)
+    offers = np.broadcast_to(np.asarray(offers, dtype=np.float64), sides.shape)
+    min_sizes = np.broadcast_to(np.asarray(min_sizes, dtype=np.float64), sides.shape)
+    deal_sizes = np.broadcast_to(np.asarray(
+        deal_sizes if deal_sizes is not None else np.nan, dtype=np.float64), sides.shape)
+
+    action, reason, close_direction, close_size = rule.strategy.decide_batch(
+        np, rule, sides, directions, deal_sizes, bids, offers, min_sizes)
+
+    # Levels for every row that opens a position.
+    opening = (action == ACTIONS.index(OPEN)) | (action == ACTIONS.index(REVERSE))
+    buy = sides == BUY
+    if rule.stop_from == "exit":
+        buy_ref, sell_ref = bids, offers
+    else:
+        buy_ref, sell_ref = offers, bids
+    stop = np.where(buy, buy_ref - rule.stop + rule.adjust, sell_ref + rule.stop - rule.adjust)
+    if rule.limit is not None:
+        limit = np.where(buy, offers + rule.limit, bids - rule.limit)
+    else:
+        limit = np.full(sides.shape, np.nan)
+    size = rule.size_multi * np.where(min_sizes >= 1, min_sizes, 1)
+
+    return {
+        'action': action,
+        'reason': reason,
+        'direction': np.where(opening, sides, FLAT).astype(np.int8),
+        'size': np.where(opening, size, np.nan),
+        'stop': np.where(opening, stop, np.nan),
+        'limit': np.where(opening, limit, np.nan),
+        'close_direction': close_direction,
+        'close_size': close_size}
@@ -0,0 +1,175 @@
+"""
+Deferred signals: held while their market is closed, run when it opens.
+
+Deferrals keeps at most one signal per instrument, on a heap ordered by due
+time, so adding one and finding the next due are O(log n) and the runner
+sleeps exactly until the earliest. A later signal for the same instrument,
+deferred or not, cancels the one waiting (supersede()); cancelled entries
+are dropped lazily when they reach the top of the heap.
+
+The due time is the instrument's next opening from its ig_hours Calendar,
+plus DELAY seconds. A signal still finds a closed market when it runs (a
+holiday, or no opening hours from IG) is deferred again, until MAX_AGE.
+It runs as a new signal, so the handler fetches fresh quotes then.
+
+Deferral needs something running at the open, so it's a server.py mode
+(--defer); Lambda keeps answering "Market offline.".
+
+The clock is injectable; python ig_defer.py checks the behaviour offline
+against a simulated one.
+"""
+from threading import Condition
+from time import time
+import heapq
+import os
+
+
+# Seconds after the scheduled opening to run, so the first quotes are in.
+DELAY = float(os.environ.get('IG_DEFER_DELAY_SECONDS', 30))
+
+# Seconds after which a signal still waiting is dropped.
+MAX_AGE = float(os.environ.get('IG_DEFER_MAX_HOURS', 72)) * 3600
+
+
+class Entry:
+
+    __slots__ = ('rule', 'side', 'event', 'due', 'received', 'seq', 'cancelled')
+
+    def __init__(self, rule, side, event, due, received, seq):
+        self.rule = rule
+        self.side = side
+        self.event = event
+        self.due = due
+        self.received = received
+        self.seq = seq
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.due, self.seq) < (other.due, other.seq)
+
+    def __repr__(self):
+        return "Entry(%s %s due %.0f)" % (self.rule.name, self.side, self.due)
+
+
+class Deferrals:
+
+    def __init__(self, clock=time, delay=DELAY, max_age=MAX_AGE):
+        self.clock = clock
+        self.delay = delay
+        self.max_age = max_age
+        self.heap = []
+        self.pending = {}
+        self.seq = 0
+        self.changed = Condition()
+
+    def defer(self, rule, side, event, calendar, received=None):
+        """
+        Hold a signal until calendar next opens. Returns the Entry, or None
+        if it's too old or no opening is known.
+        """
+
+        now = self.clock()
+        received = now if received is None else received
+        opens = calendar.next_open(now)
+        if opens is None or opens - received > self.max_age:
+            return None
+
+        with self.changed:
+            self.supersede(rule.name)
+            self.seq += 1
+            entry = Entry(rule, side, event, max(opens, now) + self.delay, received, self.seq)
+            self.pending[rule.name] = entry
+            heapq.heappush(self.heap, entry)
+            self.changed.notify_all()
+        return entry
+
+    def supersede(self, name):
+        """Cancel the signal waiting for an instrument. Returns it, or None."""
+
+        with self.changed:
+            entry = self.pending.pop(name, None)
+            if entry:
+                entry.cancelled = True
+            return entry
+
+    def next_due(self):
+        with self.changed:
+            while self.heap and self.heap[0].cancelled:
+                heapq.heappop(self.heap)
+            return self.heap[0].due if self.heap else None
+
+    def due(self, now=None):
+        """Remove and return the signals due by now, earliest first."""
+
+        now = self.clock() if now is None else now
+        out = []
+        with self.changed:
+            while self.heap and (self.heap[0].cancelled or self.heap[0].due <= now):
+                entry = heapq.heappop(self.heap)
+                if not entry.cancelled:
+                    del self.pending[entry.rule.name]
+                    out.append(entry)
+        return out
+
+    def wait(self, longest=60):
+        """Block until a signal is due, or for at most longest seconds. Returns due()."""
+
+        with self.changed:
+            due = self.next_due()
+            delay = longest if due is None else min(longest, due - self.clock())
+            if delay > 0:
+                self.changed.wait(delay)
+        return self.due()
+
+
+def check():
+    """Offline check of deferral, supersession and re-deferral against a simulated clock."""
+
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+    import ig_hours
+    import ig_rules
+
+    tz = ZoneInfo("Europe/London")
+    at = lambda *t: datetime(*t, tzinfo=tz).timestamp()
+    rules = ig_rules.RuleBook(os.path.join(os.path.dirname(os.path.abspath(__file__)), "instrument_rules.json"))
+    dax, oil = rules.get("DAX"), rules.get("UKOIL")
+    hours = {"marketTimes": [{"openTime": "07:00", "closeTime": "21:00"}]}
+    calendar = ig_hours.Calendar(ig_hours.windows(hours), "TRADEABLE", at(2026, 10, 23, 20, 0), tz)
+
+    now = [at(2026, 10, 23, 22, 0)]  # Friday night
+    d = Deferrals(clock=lambda: now[0], delay=30)
+
+    first = d.defer(dax, "BUY", {'body': "buy"}, calendar)
+    assert first.due == at(2026, 10, 26, 7, 0) + 30, first
+    d.defer(oil, "SELL", {'body': "oil"}, ig_hours.Calendar((), "CLOSED", now[0], tz))
+    assert d.next_due() == now[0] + ig_hours.RECHECK + 30
+
+    # A later signal for the same instrument replaces the first.
+    now[0] = at(2026, 10, 24, 9, 0)
+    second = d.defer(dax, "CLOSE_BUY", {'body': "close"}, calendar)
+    assert first.cancelled and d.pending['Germany 30'] is second
+
+    now[0] = at(2026, 10, 23, 22, 15, 30)
+    assert [e.side for e in d.due()] == ["SELL"]
+    assert d.due(at(2026, 10, 26, 7, 0)) == []
+    assert [e.side for e in d.due(at(2026, 10, 26, 7, 0, 30))] == ["CLOSE_BUY"]
+    assert d.next_due() is None and not d.pending
+
+    # Still closed at the open (a holiday): deferred again to the next one.
+    now[0] = at(2026, 10, 26, 7, 1)
+    calendar.observe("CLOSED", now[0])
+    again = d.defer(dax, "CLOSE_BUY", {'body': "close"}, calendar, received=second.received)
+    assert again.due == at(2026, 10, 27, 7, 0) + 30, again
+
+    # A signal not deferred still cancels the waiting one.
+    d.supersede(dax.name)
+    assert d.due(at(2026, 10, 28)) == []
+
+    # Too old to run.
+    assert d.defer(dax, "BUY", {}, calendar, received=now[0] - d.max_age) is None
+    print("ok")
+
+
+if __name__ == "__main__":
+    check()
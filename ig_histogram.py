@@ -0,0 +1,182 @@
+"""
+Fixed-memory, mergeable latency histograms.
+
+Histogram uses HDR-style log-linear buckets: values are kept in microseconds
+with 2**(bits - 1) linear sub-buckets per power of two, so every recorded
+value is within 1 / 2**(bits - 1) of its true value (about 1.6% with the
+default bits=7) from 1us up to HIGHEST. Memory is one fixed array of counts,
+independent of how many values are recorded, and histograms with the same
+bits can be merged by adding counts.
+
+REGISTRY holds the process-wide histograms: one per IG endpoint and one per
+instrument (total handler time), fed by ig_metrics after every invocation
+and kept for as long as the container is warm. Set
+IG_HISTOGRAM_EXPORT_SECONDS to print them as one JSON line at most that
+often, or call REGISTRY.export() on demand.
+
+The benchmark and load-test tools record into the same Histogram type, so
+lab and production percentiles come from identical bucketing.
+"""
+from array import array
+from time import monotonic
+import json
+import os
+
+
+# Largest value tracked exactly, in microseconds. Larger values are clamped.
+HIGHEST = 3600 * 1000 * 1000
+
+
+class Histogram:
+
+    __slots__ = ('bits', 'counts', 'n', 'total', 'min', 'max')
+
+    def __init__(self, bits=7):
+        self.bits = bits
+        self.counts = array('Q', bytes(8 * (self.index(HIGHEST) + 1)))
+        self.n = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def index(self, us):
+        """Bucket index for a value in microseconds."""
+
+        size = 1 << self.bits
+        if us < size:
+            return us
+        shift = us.bit_length() - self.bits
+        return size + (shift - 1) * (size >> 1) + ((us >> shift) - (size >> 1))
+
+    def value(self, i):
+        """Highest value, in microseconds, that falls in bucket i."""
+
+        size = 1 << self.bits
+        if i < size:
+            return i
+        shift = (i - size) // (size >> 1) + 1
+        sub = (i - size) % (size >> 1) + (size >> 1)
+        return ((sub + 1) << shift) - 1
+
+    def record(self, ms, count=1):
+        """Record a latency in milliseconds."""
+
+        us = int(ms * 1000)
+        if us < 0:
+            us = 0
+        elif us > HIGHEST:
+            us = HIGHEST
+        self.counts[self.index(us)] += count
+        self.n += count
+        self.total += us * count
+        if self.min is None or us < self.min:
+            self.min = us
+        if self.max is None or us > self.max:
+            self.max = us
+
+    def merge(self, other):
+        """Add other's counts into this histogram."""
+
+        if other.bits != self.bits:
+            raise ValueError("Cannot merge histograms with different precision")
+        counts = self.counts
+        for i, c in enumerate(other.counts):
+            if c:
+                counts[i] += c
+        self.n += other.n
+        self.total += other.total
+        if other.n:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        """Value at percentile p (0-100) in milliseconds, or None if empty."""
+
+        if not self.n:
+            return None
+        rank = max(1, -(-self.n * p // 100))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c:
+                seen += c
+                if seen >= rank:
+                    return min(self.value(i), self.max) / 1000
+        return self.max / 1000
+
+    def mean(self):
+        return self.total / self.n / 1000 if self.n else None
+
+    def summary(self):
+        return {
+            'n': self.n,
+            'mean_ms': self.mean(),
+            'min_ms': self.min / 1000 if self.n else None,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max / 1000 if self.n else None}
+
+    def to_dict(self):
+        """Sparse, JSON-serialisable form."""
+
+        return {
+            'bits': self.bits,
+            'n': self.n,
+            'total_us': self.total,
+            'min_us': self.min,
+            'max_us': self.max,
+            'counts': {str(i): c for i, c in enumerate(self.counts) if c}}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d['bits'])
+        for i, c in d['counts'].items():
+            h.counts[int(i)] = c
+        h.n, h.total, h.min, h.max = d['n'], d['total_us'], d['min_us'], d['max_us']
+        return h
+
+
+class Registry:
+    """Named histograms, e.g. "endpoint:order" or "instrument:Germany 30"."""
+
+    def __init__(self, bits=7):
+        self.bits = bits
+        self.histograms = {}
+        self.exported = monotonic()
+
+    def get(self, name):
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram(self.bits)
+        return h
+
+    def record(self, name, ms):
+        self.get(name).record(ms)
+
+    def merge(self, other):
+        for name, h in other.histograms.items():
+            self.get(name).merge(h)
+        return self
+
+    def export(self, reset=False):
+        """{name: sparse histogram} for everything recorded so far."""
+
+        out = {name: h.to_dict() for name, h in self.histograms.items()}
+        if reset:
+            self.histograms = {}
+        self.exported = monotonic()
+        return out
+
+    def summary(self):
+        return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+    def maybe_export(self):
+        """Print the histograms if IG_HISTOGRAM_EXPORT_SECONDS have passed since the last export."""
+
+        interval = os.environ.get('IG_HISTOGRAM_EXPORT_SECONDS')
+        if interval and monotonic() - self.exported >= float(interval):
+            print(json.dumps({'histograms': self.export()}, separators=(',', ':')))
+
+
+REGISTRY = Registry()
@@ -0,0 +1,138 @@
+"""
+Per-instrument trading-hours calendar.
+
+A Calendar is seeded from the market details the handler fetches anyway:
+IG's openingHours (daily open and close times, in the account's time zone,
+IG_HOURS_TZ, default Europe/London) and the snapshot's marketStatus. The
+handler keeps one per instrument in ig_cache.HOURS, refreshed by every
+details fetch and at least daily, and checks it before logging in, so a
+signal for a closed market costs no IG calls at all.
+
+closed() is True only when we know:
+
+    marketStatus (or a MARKET_OFFLINE rejection) said closed, and no
+    scheduled opening time has passed since; or
+
+    it's outside every openingHours window on a weekday, or it's Saturday.
+
+IG's opening hours don't say which days they apply to, so they're used
+Monday to Friday; Sunday evening re-opens are left to marketStatus. With no
+opening hours a closed status is trusted for RECHECK seconds.
+"""
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import os
+
+
+TRADEABLE = "TRADEABLE"
+
+# Seconds a closed marketStatus is trusted when there are no opening hours.
+RECHECK = 15 * 60
+
+SATURDAY, SUNDAY = 5, 6
+
+
+def zone():
+    try:
+        return ZoneInfo(os.environ.get('IG_HOURS_TZ', "Europe/London"))
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo("UTC")
+
+
+def minutes(hhmm):
+    h, m = hhmm.split(":")
+    return int(h) * 60 + int(m)
+
+
+def windows(opening_hours):
+    """[(open, close)] minutes of the day from IG's openingHours, split at midnight."""
+
+    out = []
+    for t in (opening_hours or {}).get('marketTimes') or ():
+        start, end = minutes(t['openTime']), minutes(t['closeTime'])
+        if end <= start:
+            # Runs past midnight, or "00:00" meaning the end of the day.
+            out.append((start, 24 * 60))
+            if end:
+                out.append((0, end))
+        else:
+            out.append((start, end))
+    return tuple(sorted(out))
+
+
+class Calendar:
+
+    __slots__ = ('windows', 'status', 'checked', 'tz')
+
+    def __init__(self, windows=(), status=None, checked=None, tz=None):
+        self.windows = windows
+        self.status = status
+        self.checked = checked
+        self.tz = tz or zone()
+
+    @classmethod
+    def from_details(cls, details, now):
+        """From an ig_models.MarketDetails fetched at now (epoch seconds)."""
+
+        return cls(windows(details.opening_hours), details.status, now)
+
+    def observe(self, status, now):
+        """Record a marketStatus seen at now, e.g. "CLOSED" after a MARKET_OFFLINE rejection."""
+
+        self.status = status
+        self.checked = now
+
+    def in_hours(self, now):
+        """True or False from the opening hours, None when they don't say."""
+
+        if not self.windows:
+            return None
+        local = datetime.fromtimestamp(now, self.tz)
+        if local.weekday() == SATURDAY:
+            return False
+        if local.weekday() == SUNDAY:
+            return None
+        minute = local.hour * 60 + local.minute
+        return any(start <= minute < end for start, end in self.windows)
+
+    def opens(self, after, days=8, sunday=True):
+        """
+        Possible opening times (epoch seconds) after a time, in order. Sunday's
+        are included unless sunday is False: a market that does open then
+        says so by its status.
+        """
+
+        start = datetime.fromtimestamp(after, self.tz).date()
+        for d in range(days):
+            day = start + timedelta(days=d)
+            if day.weekday() == SATURDAY or (day.weekday() == SUNDAY and not sunday):
+                continue
+            for begin, _ in self.windows:
+                t = datetime(day.year, day.month, day.day, begin // 60, begin % 60, tzinfo=self.tz).timestamp()
+                if t > after:
+                    yield t
+
+    def closed(self, now):
+        if self.status is not None and self.status != TRADEABLE and self.checked is not None:
+            reopen = next(self.opens(self.checked), None) if self.windows else self.checked + RECHECK
+            if reopen is None or now < reopen:
+                return True
+        return self.in_hours(now) is False
+
+    def next_open(self, now):
+        """
+        Epoch seconds of the next scheduled opening at or after now, now if
+        open, None if unknown. Sunday openings are never scheduled.
+        """
+
+        if not self.closed(now):
+            return now
+        if not self.windows:
+            return self.checked + RECHECK
+        for t in self.opens(now, sunday=False):
+            if not self.closed(t):
+                return t
+        return None
+
+    def __repr__(self):
+        return "Calendar(%s %s)" % (self.status, self.windows)
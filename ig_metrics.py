@@ -0,0 +1,229 @@
+"""
+Per-call timing spans for IG requests, emitted as one structured record per
+invocation.
+
+Every request sent through a session returned by wrap() is timed and labelled
+with its endpoint. When the handler returns, the spans are printed as a single
+CloudWatch Embedded Metric Format line, which CloudWatch turns into
+per-endpoint latency metrics (dimension: Instrument) without any log parsing.
+The individual spans are kept in the same record for Logs Insights queries.
+
+Spans are also added to the in-process histograms in ig_histogram.REGISTRY.
+
+Set IG_METRICS=off to disable, IG_METRICS_NAMESPACE to change the namespace.
+"""
+from ig_histogram import REGISTRY
+from time import perf_counter, time
+import functools
+import json
+import os
+
+
+NAMESPACE = "HTF-single-strat"
+
+# Endpoint labels.
+SESSION = "session"
+PREFERENCES = "preferences"
+POSITIONS = "positions"
+MARKETS_SEARCH = "markets_search"
+MARKET_DETAILS = "market_details"
+ORDER = "order"
+CLOSE = "close"
+CONFIRM = "confirm"
+PRICES = "prices"
+OTHER = "other"
+
+# Metrics of the invocation being measured, see measured().
+active = None
+
+# Metrics for the next invocation, see carry().
+carried = {}
+
+
+def endpoint(method, url, headers=None):
+    """Label for an IG request."""
+
+    path = url.split("?", 1)[0]
+    path = path[path.find("/gateway/deal") + len("/gateway/deal"):] if "/gateway/deal" in path else path
+
+    if path.endswith("/session"):
+        return SESSION
+    if path.endswith("/accounts/preferences"):
+        return PREFERENCES
+    if path.endswith("/positions/otc"):
+        return CLOSE if headers and headers.get('_method') == "DELETE" else ORDER
+    if path.endswith("/positions"):
+        return POSITIONS
+    if "/confirms/" in path:
+        return CONFIRM
+    if "/prices/" in path:
+        return PRICES
+    if "/markets/" in path:
+        return MARKET_DETAILS
+    if path.endswith("/markets"):
+        return MARKETS_SEARCH
+    return OTHER
+
+
+class Span:
+
+    __slots__ = ('endpoint', 'method', 'status', 'retries', 'bytes', 'duration')
+
+    def __init__(self, endpoint, method, status, retries, nbytes, duration):
+        self.endpoint = endpoint
+        self.method = method
+        self.status = status
+        self.retries = retries
+        self.bytes = nbytes
+        self.duration = duration
+
+    def record(self):
+        return {
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'status': self.status,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'ms': round(self.duration * 1000, 3)}
+
+
+class Metrics:
+    """Spans and tags for one invocation."""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.spans = []
+        self.tags = {}
+        self.values = {}
+
+    def add(self, span):
+        self.spans.append(span)
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def metric(self, **values):
+        self.values.update(values)
+
+    def record(self, namespace=NAMESPACE, status=None):
+        """The invocation as an Embedded Metric Format document."""
+
+        per_endpoint = {}
+        for s in self.spans:
+            per_endpoint.setdefault(s.endpoint + "_ms", []).append(round(s.duration * 1000, 3))
+
+        doc = {
+            'Instrument': self.tags.get('instrument', "none"),
+            'total_ms': round((perf_counter() - self.start) * 1000, 3),
+            'ig_calls': len(self.spans),
+            'ig_retries': sum(s.retries for s in self.spans),
+            'ig_bytes': sum(s.bytes for s in self.spans)}
+        doc.update(per_endpoint)
+        doc.update(self.values)
+
+        units = dict.fromkeys(per_endpoint, "Milliseconds")
+        units.update((k, "Milliseconds" if k.endswith("_ms") else "Count") for k in self.values)
+        units.update(total_ms="Milliseconds", ig_calls="Count", ig_retries="Count", ig_bytes="Bytes")
+
+        doc['_aws'] = {
+            'Timestamp': int(time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [["Instrument"]],
+                'Metrics': [{'Name': k, 'Unit': u} for k, u in units.items()]}]}
+        doc.update({k: v for k, v in self.tags.items() if k != 'instrument'})
+        doc['statusCode'] = status
+        doc['spans'] = [s.record() for s in self.spans]
+        return doc
+
+
+def retries(response):
+    """Retries the transport made for a response, 0 if unknown."""
+
+    if isinstance(getattr(response, 'retries', None), int):
+        return response.retries
+    history = getattr(getattr(getattr(response, 'raw', None), 'retries', None), 'history', None)
+    return len(history) if history else 0
+
+
+class Timed:
+    """Session wrapper that adds a Span to metrics for every send()."""
+
+    def __init__(self, session, metrics):
+        self.session = session
+        self.metrics = metrics
+
+    def send(self, prepared, **kwargs):
+        start = perf_counter()
+        response = self.session.send(prepared, **kwargs)
+        duration = perf_counter() - start
+
+        sent = len(prepared.body) if prepared.body else 0
+        received = len(response.content) if response.content else 0
+        self.metrics.add(Span(
+            endpoint(prepared.method, prepared.url, prepared.headers), prepared.method,
+            response.status_code, retries(response), sent + received, duration))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+def measured(handler):
+    """Decorator for lambda_handler: collects spans and prints the EMF record on return."""
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global active
+
+        if os.environ.get('IG_METRICS', "on").lower() in ("off", "0", "false"):
+            carried.clear()
+            return handler(event, context)
+
+        active = metrics = Metrics()
+        if carried:
+            metrics.metric(**carried)
+            carried.clear()
+        result = None
+        try:
+            result = handler(event, context)
+            return result
+        finally:
+            active = None
+            status = result.get('statusCode') if isinstance(result, dict) else None
+            record = metrics.record(os.environ.get('IG_METRICS_NAMESPACE', NAMESPACE), status)
+            print(json.dumps(record, separators=(',', ':')))
+
+            # Keep the warm container's histograms up to date.
+            for span in metrics.spans:
+                REGISTRY.record("endpoint:" + span.endpoint, span.duration * 1000)
+            REGISTRY.record("instrument:" + record['Instrument'], record['total_ms'])
+            REGISTRY.maybe_export()
+
+    return wrapper
+
+
+def wrap(session):
+    """Return session, timed if this invocation is being measured."""
+
+    return Timed(session, active) if active else session
+
+
+def tag(**tags):
+    """Add properties to the current invocation's record, e.g. tag(instrument="Germany 30")."""
+
+    if active:
+        active.tag(**tags)
+
+
+def metric(**values):
+    """Add metrics to the current invocation's record, e.g. metric(prewarm_ms=84.2)."""
+
+    if active:
+        active.metric(**values)
+
+
+def carry(**values):
+    """Add metrics to the next invocation's record, e.g. carry(queue_wait_ms=12.5) from the queue that runs it."""
+
+    carried.update(values)
@@ -0,0 +1,134 @@
+"""
+Slotted models of the IG documents the handler reads.
+
+Each is built once from a decoded response and keeps only the fields the
+handler and its tools use, as plain attributes: no per-instance dict, and no
+nested dict lookups with string keys on every access. That matters most in
+the long-running server, which keeps market data and position lists around
+between signals.
+
+    Position       one entry of GET /positions
+    MarketDetails  GET /markets/{epic}, with its DealingRules
+    DealConfirm    GET /confirms/{dealReference}
+"""
+
+
+class Position:
+
+    __slots__ = ('deal_id', 'direction', 'size', 'level', 'stop', 'limit', 'currency',
+                 'epic', 'expiry', 'instrument_name', 'bid', 'offer')
+
+    def __init__(self, deal_id, direction, size, level, stop, limit, currency,
+                 epic, expiry, instrument_name, bid, offer):
+        self.deal_id = deal_id
+        self.direction = direction
+        self.size = size
+        self.level = level
+        self.stop = stop
+        self.limit = limit
+        self.currency = currency
+        self.epic = epic
+        self.expiry = expiry
+        self.instrument_name = instrument_name
+        self.bid = bid
+        self.offer = offer
+
+    @classmethod
+    def from_doc(cls, doc):
+        p, m = doc['position'], doc['market']
+        return cls(
+            p['dealId'], p['direction'], p.get('dealSize', p.get('size')), p.get('level'),
+            p.get('stopLevel'), p.get('limitLevel'), p.get('currency'),
+            m['epic'], m['expiry'], m['instrumentName'], m.get('bid'), m.get('offer'))
+
+    def __repr__(self):
+        return "Position(%s %s %s %s)" % (self.instrument_name, self.direction, self.size, self.deal_id)
+
+
+class DealingRules:
+
+    __slots__ = ('min_deal_size', 'min_deal_size_unit', 'min_stop_distance', 'min_stop_distance_unit',
+                 'max_stop_distance', 'max_stop_distance_unit', 'min_step_distance')
+
+    def __init__(self, min_deal_size, min_deal_size_unit, min_stop_distance, min_stop_distance_unit,
+                 max_stop_distance, max_stop_distance_unit, min_step_distance):
+        self.min_deal_size = min_deal_size
+        self.min_deal_size_unit = min_deal_size_unit
+        self.min_stop_distance = min_stop_distance
+        self.min_stop_distance_unit = min_stop_distance_unit
+        self.max_stop_distance = max_stop_distance
+        self.max_stop_distance_unit = max_stop_distance_unit
+        self.min_step_distance = min_step_distance
+
+    @classmethod
+    def from_doc(cls, doc):
+        empty = {}
+        size = doc['minDealSize']
+        stop = doc.get('minNormalStopOrLimitDistance') or empty
+        most = doc.get('maxStopOrLimitDistance') or empty
+        return cls(
+            size['value'], size.get('unit'), stop.get('value'), stop.get('unit'),
+            most.get('value'), most.get('unit'), (doc.get('minStepDistance') or empty).get('value'))
+
+
+class MarketDetails:
+
+    __slots__ = ('epic', 'expiry', 'name', 'type', 'lot_size', 'currencies', 'opening_hours',
+                 'status', 'bid', 'offer', 'update_time', 'rules')
+
+    def __init__(self, epic, expiry, name, itype, lot_size, currencies, opening_hours,
+                 status, bid, offer, update_time, rules):
+        self.epic = epic
+        self.expiry = expiry
+        self.name = name
+        self.type = itype
+        self.lot_size = lot_size
+        self.currencies = currencies
+        self.opening_hours = opening_hours
+        self.status = status
+        self.bid = bid
+        self.offer = offer
+        self.update_time = update_time
+        self.rules = rules
+
+    @classmethod
+    def from_doc(cls, doc):
+        i, s = doc['instrument'], doc['snapshot']
+        return cls(
+            i['epic'], i['expiry'], i['name'], i.get('type'), i['lotSize'],
+            tuple(c['name'] for c in i['currencies']), i.get('openingHours'),
+            s.get('marketStatus'), s['bid'], s['offer'], s.get('updateTime'),
+            DealingRules.from_doc(doc['dealingRules']))
+
+    def __repr__(self):
+        return "MarketDetails(%s %s %s/%s)" % (self.epic, self.status, self.bid, self.offer)
+
+
+class DealConfirm:
+    """
+    The confirmation of an order or close. doc is the document as received,
+    which the handler returns as is when IG rejects a deal for a reason it
+    has no message for.
+    """
+
+    __slots__ = ('status', 'reason', 'deal_id', 'deal_reference', 'epic', 'direction', 'size', 'level', 'doc')
+
+    def __init__(self, status, reason, deal_id, deal_reference, epic, direction, size, level, doc=None):
+        self.status = status
+        self.reason = reason
+        self.deal_id = deal_id
+        self.deal_reference = deal_reference
+        self.epic = epic
+        self.direction = direction
+        self.size = size
+        self.level = level
+        self.doc = doc
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(
+            doc['dealStatus'], doc.get('reason'), doc.get('dealId'), doc.get('dealReference'),
+            doc.get('epic'), doc.get('direction'), doc.get('size'), doc.get('level'), doc)
+
+    def __repr__(self):
+        return "DealConfirm(%s %s %s)" % (self.status, self.reason, self.deal_reference)
@@ -0,0 +1,111 @@
+"""
+Precompiled IG order and close bodies.
+
+The static part of every /positions/otc body is serialised once when a
+template is built, so placing an order only has to encode the handful of
+fields that change per signal (epic, direction, size, dealId and levels).
+"""
+from json.encoder import encode_basestring_ascii
+import numbers
+import json
+import math
+
+
+# Header added to a POST /positions/otc request to make IG treat it as a close.
+CLOSE_METHOD = {'_method': "DELETE"}
+
+
+def encode_value(v):
+    """
+    Encode a single JSON scalar the same way json.dumps would. Numbers of any
+    type (NumPy scalars from ig_decide.decide_batch included) are written as
+    plain ints or floats; NaN and infinity raise ValueError, as IG can't take them.
+    """
+
+    if v is None:
+        return "null"
+    if v is True:
+        return "true"
+    if v is False:
+        return "false"
+    if v.__class__ is str:
+        return encode_basestring_ascii(v)
+    if v.__class__ is int:
+        return repr(v)
+    if isinstance(v, numbers.Integral):
+        return repr(int(v))
+    f = float(v)
+    if not math.isfinite(f):
+        raise ValueError("Can't send %r to IG" % (v,))
+    return repr(f)
+
+
+class OrderTemplate:
+    """
+    New position body for one instrument.
+
+    currency is fixed at build time when the instrument always trades in the
+    same currency, otherwise it must be given to render().
+    """
+
+    __slots__ = ('currency', '_currency', '_tail')
+
+    def __init__(self, currency=None, order_type="MARKET", guaranteed_stop=False, force_open=True):
+        self.currency = currency
+        self._currency = encode_value(currency) if currency else None
+
+        static = {
+            "orderType": order_type,
+            "level": None,
+            "guaranteedStop": guaranteed_stop,
+            "stopDistance": None,
+            "forceOpen": force_open,
+            "limitDistance": None,
+            "quoteId": None}
+
+        # '"orderType": "MARKET", ... }' - appended after the dynamic fields.
+        self._tail = ", " + json.dumps(static)[1:]
+
+    def render(self, epic, expiry, direction, size, stop, limit, currency=None):
+        """Return the encoded order body."""
+
+        return (
+            '{"epic": ' + encode_value(epic) +
+            ', "expiry": ' + encode_value(expiry) +
+            ', "direction": ' + encode_value(direction) +
+            ', "size": ' + encode_value(size) +
+            ', "stopLevel": ' + encode_value(stop) +
+            ', "limitLevel": ' + encode_value(limit) +
+            ', "currencyCode": ' + (self._currency or encode_value(currency)) +
+            self._tail).encode()
+
+    def fields(self, epic, expiry, direction, size, stop, limit, currency=None):
+        """Return the order as a dict, for logging and tests."""
+
+        return json.loads(self.render(epic, expiry, direction, size, stop, limit, currency))
+
+
+class CloseTemplate:
+    """Close position body, sent with CLOSE_METHOD added to the headers."""
+
+    __slots__ = ('_tail',)
+
+    def __init__(self, order_type="MARKET"):
+        static = {
+            "epic": None,
+            "level": None,
+            "orderType": order_type,
+            "timeInForce": None,
+            "quoteId": None}
+        self._tail = ", " + json.dumps(static)[1:]
+
+    def render(self, deal_id, expiry, direction, size):
+        """Return the encoded close body."""
+
+        return (
+            '{"dealId": ' + encode_value(deal_id) +
+            ', "expiry": ' + encode_value(expiry) +
+            ', "direction": ' + encode_value(direction) +
+            ', "size": ' + encode_value(size) +
+            self._tail).encode()
+
@@ -0,0 +1,73 @@
+"""
+Incremental parsing of the larger IG list responses.
+
+/markets searches and /positions return one top-level array of objects. The
+handler only wants the first matching market, and only the positions in the
+instrument it is trading, so instead of json.loads() on the whole document
+the array elements are decoded one at a time with the standard library's C
+scanner (JSONDecoder.raw_decode):
+
+    first()      stops at the first element that matches
+    positions()  skips decoding entirely when the instrument name does not
+                 appear in the response, the usual case with no position
+
+Documents that don't have the expected {"<key>": [...]} shape fall back to
+json.loads(). For a well-formed document the results are the same as a full
+parse. A truncated or malformed one isn't checked past what is read: first()
+can return a match from before the damage, and positions() returns [] when
+the name isn't in the text, where json.loads() would raise ValueError.
+"""
+import json
+import re
+
+
+decoder = json.JSONDecoder()
+whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def text(content):
+    return content.decode("utf-8") if isinstance(content, (bytes, bytearray)) else content
+
+
+def elements(content, key):
+    """Yield the objects of the top-level array content[key], decoding one at a time."""
+
+    doc = text(content)
+    start = re.match(r'\s*\{\s*"%s"\s*:\s*\[' % re.escape(key), doc)
+    if start is None:
+        yield from json.loads(doc).get(key) or ()
+        return
+
+    pos = whitespace.match(doc, start.end()).end()
+    if doc.startswith("]", pos):
+        return
+    while True:
+        element, pos = decoder.raw_decode(doc, pos)
+        yield element
+        pos = whitespace.match(doc, pos).end()
+        if doc.startswith(",", pos):
+            pos = whitespace.match(doc, pos + 1).end()
+        elif doc.startswith("]", pos):
+            return
+        else:
+            raise ValueError("Malformed JSON array at %d" % pos)
+
+
+def first(content, key, match):
+    """The first object in content[key] for which match() is true, or None."""
+
+    for element in elements(content, key):
+        if match(element):
+            return element
+    return None
+
+
+def positions(content, name):
+    """Open positions whose instrument name starts with name."""
+
+    if name.isascii():
+        needle = json.dumps(name)[1:-1]
+        if (needle.encode() if isinstance(content, (bytes, bytearray)) else needle) not in content:
+            return []
+    # Every element has to be checked, which one json.loads() does fastest.
+    return [p for p in json.loads(content)['positions'] if p['market']['instrumentName'][:len(name)] == name]
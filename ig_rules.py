@@ -0,0 +1,128 @@
+"""
+Declarative per-instrument trade rules.
+
+instrument_rules.json describes each instrument: the webhook ticker codes that
+map to it, how to find it on IG, sizing, stop/limit offsets and which strategy
+handles its signals. The file is compiled into a ticker -> Rule dispatch map,
+so adding an instrument only needs a new entry in the file.
+
+Rule fields:
+    tickers     webhook ticker codes for the instrument (case insensitive, each
+                claimed by one instrument only)
+    search      IG /markets search term
+    class       IG instrument type, e.g. "COMMODITIES" or "INDICES"
+    size_multi  multiple of the minimum deal size to trade
+    currency    order currency, or null for the first currency IG lists
+    strategy    "flip" or "explicit_close", see ig_decide.STRATEGIES
+    stop        stop offset in points
+    stop_from   "exit" measures the stop from the closing side of the quote
+                (bid for a long), "entry" from the opening side (offer)
+    adjust      spread adjustment pulled back into the stop
+    limit       limit offset from the entry price, or null for no limit
+    close_size  "multiplier" closes size_multi, "position" the open deal size
+"""
+from ig_decide import STRATEGIES
+from ig_orders import OrderTemplate, CloseTemplate
+import json
+import os
+
+
+class Rule:
+    """One compiled instrument entry."""
+
+    __slots__ = (
+        'name', 'tickers', 'search', 'iclass', 'size_multi', 'currency',
+        'strategy', 'stop', 'stop_from', 'adjust', 'limit', 'close_size',
+        'order_template', 'close_template')
+
+    def __init__(self, name, spec, close_template):
+        self.name = name
+        self.tickers = tuple(spec['tickers'])
+        self.search = spec['search']
+        self.iclass = spec['class']
+        self.size_multi = spec['size_multi']
+        self.currency = spec.get('currency')
+        self.stop = spec['stop']
+        self.stop_from = spec.get('stop_from', "exit")
+        self.adjust = spec.get('adjust', 0)
+        self.limit = spec.get('limit')
+        self.close_size = spec.get('close_size', "position")
+
+        if spec['strategy'] not in STRATEGIES:
+            raise ValueError(name + ": unknown strategy " + repr(spec['strategy']))
+        if self.stop_from not in ("exit", "entry"):
+            raise ValueError(name + ": stop_from must be 'exit' or 'entry'")
+        if self.close_size not in ("multiplier", "position"):
+            raise ValueError(name + ": close_size must be 'multiplier' or 'position'")
+
+        self.strategy = STRATEGIES[spec['strategy']]
+        self.order_template = OrderTemplate(currency=self.currency)
+        self.close_template = close_template
+
+
+def compile_rules(table):
+    """Compile a rule table into a {TICKER: Rule} dispatch map."""
+
+    if not isinstance(table, dict):
+        raise ValueError("instrument rules must be a JSON object of instruments")
+    close_template = CloseTemplate()
+    dispatch = {}
+    for name, spec in table.items():
+        if not isinstance(spec, dict):
+            raise ValueError(name + ": rule must be a JSON object")
+        rule = Rule(name, spec, close_template)
+        for ticker in rule.tickers:
+            if not isinstance(ticker, str):
+                raise ValueError(name + ": ticker codes must be strings")
+            if ticker.upper() in dispatch:
+                raise ValueError(name + ": ticker " + ticker + " already maps to " + dispatch[ticker.upper()].name)
+            dispatch[ticker.upper()] = rule
+    return dispatch
+
+
+class RuleBook:
+    """
+    Rule table loaded from a JSON file, reloaded when the file's mtime changes.
+
+    A file that fails to load or compile is reported and the previous rules
+    are kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.rules = {}
+        self.refresh()
+
+    def refresh(self):
+        """Reload the file if it changed since the last load. Returns True on reload."""
+
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            print("Error: instrument rules unavailable:", e)
+            return False
+
+        if mtime == self.mtime:
+            return False
+
+        try:
+            with open(self.path) as f:
+                rules = compile_rules(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # OSError: replaced or removed since the stat.
+            print("Error: instrument rules not loaded:", e)
+            return False
+
+        self.rules, self.mtime = rules, mtime
+        return True
+
+    def get(self, ticker):
+        """Return the Rule for a webhook ticker code, or None."""
+
+        return self.rules.get(ticker.upper())
+
+    def instruments(self):
+        """One Rule per instrument, however many tickers map to it."""
+
+        return list({rule.name: rule for rule in self.rules.values()}.values())
@@ -0,0 +1,263 @@
+"""
+Priority execution queue for signals in the long-running server.
+
+Queued signals run one at a time, risk-reducing first:
+
+    CLOSE    sides that can only close, e.g. close_buy / close_sell
+    REVERSE  sides that close an opposite position before opening, e.g. flip buy / sell
+    OPEN     sides that only ever open
+
+The class of a side comes from the ig_decide kernel, so it follows the
+instrument's strategy rather than a list of side names. Signals for one
+instrument always run in arrival order: each instrument has its own queue
+and only its oldest signal competes with other instruments' for the worker,
+so a buy followed by a close_buy is never run as close_buy, buy. Between
+instruments, closes go first, then arrival order, and every AGE seconds a
+signal has waited lifts it one class, so a steady stream of closes can't
+hold an open back forever.
+
+IG limits requests per account per minute, separately for trading requests
+(orders and closes) and everything else. Limited charges every request to
+its TokenBucket, waiting if it is empty, and the scheduler only starts a
+signal once both buckets hold what a signal of its class needs, so a signal
+is never left half done (closed but not reopened) waiting for a token.
+
+Queue depth and wait are reported with the signal's invocation record as
+queue_depth and queue_wait_ms, and wait is kept in ig_histogram as
+"queue:wait".
+
+python ig_scheduler.py checks the run order offline.
+"""
+from threading import Condition, Event, Lock, Thread
+from collections import deque
+from time import monotonic, perf_counter, sleep
+import heapq
+import os
+
+from ig_histogram import REGISTRY
+import ig_decide
+import ig_metrics
+
+
+CLOSE, REVERSE, OPEN = range(3)
+
+# Seconds of waiting that lift a signal one class.
+AGE = float(os.environ.get('IG_QUEUE_AGE_SECONDS', 10))
+
+# IG's per-account limits, requests per minute.
+TRADING_PER_MINUTE = float(os.environ.get('IG_TRADING_PER_MINUTE', 100))
+NON_TRADING_PER_MINUTE = float(os.environ.get('IG_NON_TRADING_PER_MINUTE', 30))
+
+# (trading, non-trading) requests a signal of each class makes with a cached
+# session: preferences, positions, market details, then a confirm per deal.
+COST = {CLOSE: (1, 4), REVERSE: (2, 5), OPEN: (1, 4)}
+
+
+def risk(rule, side):
+    """CLOSE, REVERSE or OPEN: the most risk-reducing plan side can produce for rule."""
+
+    actions = set()
+    for direction in (None, "BUY", "SELL"):
+        plan = ig_decide.decide(rule, side, (direction, 1) if direction else None, 1.0, 1.0, 1)
+        actions.add(plan.action)
+    if ig_decide.CLOSE in actions:
+        return CLOSE
+    if ig_decide.REVERSE in actions:
+        return REVERSE
+    return OPEN
+
+
+class TokenBucket:
+    """rate tokens per second up to capacity, starting full."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def fill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, n=1):
+        """Seconds until n tokens are available."""
+
+        with self.lock:
+            self.fill()
+            return max(0.0, (n - self.tokens) / self.rate)
+
+    def take(self, n=1):
+        """Take n tokens, sleeping until there are enough."""
+
+        while True:
+            with self.lock:
+                self.fill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                delay = (n - self.tokens) / self.rate
+            sleep(delay)
+
+
+def buckets():
+    """(trading, non-trading) buckets at IG's per-minute limits."""
+
+    return (TokenBucket(TRADING_PER_MINUTE / 60, TRADING_PER_MINUTE),
+            TokenBucket(NON_TRADING_PER_MINUTE / 60, NON_TRADING_PER_MINUTE))
+
+
+class Limited:
+    """Transport wrapper that takes a token for every request sent."""
+
+    def __init__(self, session, trading, non_trading):
+        self.session = session
+        self.trading = trading
+        self.non_trading = non_trading
+
+    def send(self, prepared, **kwargs):
+        label = ig_metrics.endpoint(prepared.method, prepared.url, prepared.headers)
+        (self.trading if label in (ig_metrics.ORDER, ig_metrics.CLOSE) else self.non_trading).take()
+        return self.session.send(prepared, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class Job:
+
+    __slots__ = ('key', 'seq', 'rank', 'name', 'event', 'queued', 'result', 'done')
+
+    def __init__(self, key, seq, rank, name, event):
+        self.key = key
+        self.seq = seq
+        self.rank = rank
+        self.name = name
+        self.event = event
+        self.queued = perf_counter()
+        self.result = None
+        self.done = Event()
+
+    def __lt__(self, other):
+        return (self.key, self.seq) < (other.key, other.seq)
+
+
+class Scheduler:
+    """
+    Runs run(event) for submitted signals on one worker thread, in priority
+    order across instruments and arrival order within each. submit() blocks
+    until the signal has run and returns its result.
+    """
+
+    def __init__(self, run, trading=None, non_trading=None, age=AGE):
+        self.run = run
+        self.trading = trading
+        self.non_trading = non_trading
+        self.age = age
+        self.heap = []  # the oldest queued job of each instrument
+        self.lanes = {}  # instrument name: deque of its queued jobs, oldest first
+        self.seq = 0
+        self.ready = Condition()
+        Thread(target=self.work, daemon=True).start()
+
+    def submit(self, rule, side, event):
+        rank = risk(rule, side)
+        with self.ready:
+            self.seq += 1
+            # Aging: rank - waited / age, ordered by a key that doesn't change while queued.
+            job = Job(rank * self.age + perf_counter(), self.seq, rank, rule.name, event)
+            lane = self.lanes.setdefault(rule.name, deque())
+            lane.append(job)
+            if len(lane) == 1:
+                heapq.heappush(self.heap, job)
+                self.ready.notify()
+        job.done.wait()
+        return job.result
+
+    def depth(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def throttle(self, rank):
+        """Wait until the rate-limit buckets can cover a signal of this class."""
+
+        if self.trading is None:
+            return
+        trading, non_trading = COST[rank]
+        while True:
+            delay = max(self.trading.wait(trading), self.non_trading.wait(non_trading))
+            if not delay:
+                return
+            sleep(delay)
+
+    def work(self):
+        while True:
+            with self.ready:
+                while not self.heap:
+                    self.ready.wait()
+                rank = self.heap[0].rank
+            self.throttle(rank)
+            with self.ready:
+                job = heapq.heappop(self.heap)
+                lane = self.lanes[job.name]
+                lane.popleft()
+                if lane:
+                    heapq.heappush(self.heap, lane[0])
+                else:
+                    del self.lanes[job.name]
+                depth = self.depth()
+            # A costlier signal may have arrived at the head while throttled.
+            if job.rank != rank:
+                self.throttle(job.rank)
+
+            waited = (perf_counter() - job.queued) * 1000
+            REGISTRY.record("queue:wait", waited)
+            ig_metrics.carry(queue_depth=depth, queue_wait_ms=round(waited, 3))
+            try:
+                job.result = self.run(job.event)
+            finally:
+                job.done.set()
+
+
+def check():
+    """Offline check of the run order, with the worker held busy while signals queue."""
+
+    import ig_rules
+    import os
+
+    rules = ig_rules.RuleBook(os.path.join(os.path.dirname(os.path.abspath(__file__)), "instrument_rules.json"))
+    ran, hold = [], Event()
+
+    def run(event):
+        if event == "hold":
+            hold.wait()
+        ran.append(event)
+        return event
+
+    def submit(ticker, side):
+        before = scheduler.seq
+        Thread(target=scheduler.submit, args=(rules.get(ticker), side, ticker + " " + side), daemon=True).start()
+        while scheduler.seq == before:
+            sleep(0.001)
+
+    scheduler = Scheduler(run)
+    Thread(target=scheduler.submit, args=(rules.get("WHEATUSD"), "BUY", "hold"), daemon=True).start()
+    while not scheduler.seq or scheduler.heap:
+        sleep(0.001)
+
+    # A buy then a close for the same instrument keep their order; a
+    # reversal for another instrument goes ahead of the open.
+    submit("DAX", "BUY")
+    submit("DAX", "CLOSE_BUY")
+    submit("UKOIL", "SELL")
+    hold.set()
+    while len(ran) < 4:
+        sleep(0.001)
+    assert ran == ["hold", "UKOIL SELL", "DAX BUY", "DAX CLOSE_BUY"], ran
+    assert not scheduler.heap and not scheduler.lanes
+    print("ok")
+
+
+if __name__ == "__main__":
+    check()
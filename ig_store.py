@@ -0,0 +1,247 @@
+"""
+Columnar price store: memory-mapped .npy files per instrument and field.
+
+    <root>/<instrument>/<resolution>/time.npy       int64 epoch seconds, ascending
+                                     bid_open.npy   float64, and so on for
+                                     ...            bid/ask open/high/low/close
+                                     volume.npy     float64, NaN when unknown
+                                     index_day.npy  int64 UTC day starts
+                                     index_row.npy  int64 first row of each day
+
+Every column is a plain 1-D .npy file, so np.load(mmap_mode='r') opens it
+without reading it, and a slice of it only pages in what it covers. A time
+range is found in two binary searches: the small day index narrows it to
+whole days, then the time column within them, so only a few pages of a
+years-long column are touched.
+
+Appends never rewrite a file. New rows are written at the end of each
+column, then the length in its header is updated in place (NumPy pads 1-D
+headers so that it can grow). Rows at or before the last stored time are
+dropped, so overlapping downloads can be appended as they are. Rows left
+past the header's length by an interrupted append are overwritten by the
+next one, and the day index is brought up to date from its last complete
+entry. One writer at a time.
+
+    python ig_store.py prices
+    python ig_store.py prices --import DAX=dax.csv
+"""
+from datetime import datetime, timezone
+from numpy.lib import format as npy
+import argparse
+import io
+import re
+import os
+
+import numpy as np
+
+
+PRICES = ('bid_open', 'bid_high', 'bid_low', 'bid_close', 'ask_open', 'ask_high', 'ask_low', 'ask_close')
+FIELDS = ('time',) + PRICES + ('volume',)
+INDEX = ('index_day', 'index_row')
+DAY = 86400
+
+
+def slug(name):
+    """Directory name for an instrument, e.g. "Oil - Brent Crude" -> "oil_brent_crude"."""
+
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def kind(field):
+    return np.dtype(np.int64 if field in ('time',) + INDEX else np.float64)
+
+
+def header(f):
+    """(version, length, dtype, data offset) of an open 1-D .npy file."""
+
+    version = npy.read_magic(f)
+    read = npy.read_array_header_1_0 if version == (1, 0) else npy.read_array_header_2_0
+    shape, _, dt = read(f)
+    return version, shape[0], dt, f.tell()
+
+
+def extend(path, values, rows):
+    """Write values after the first rows entries of a 1-D .npy file and set its length to match."""
+
+    with open(path, "r+b") as f:
+        version, _, dt, offset = header(f)
+        f.seek(offset + rows * dt.itemsize)
+        f.write(np.ascontiguousarray(values, dtype=dt).tobytes())
+        f.truncate()
+
+        h = io.BytesIO()
+        write = npy.write_array_header_1_0 if version == (1, 0) else npy.write_array_header_2_0
+        write(h, {'descr': npy.dtype_to_descr(dt), 'fortran_order': False, 'shape': (rows + len(values),)})
+        if h.tell() != offset:
+            raise ValueError(path + ": header would change size")
+        f.seek(0)
+        f.write(h.getvalue())
+
+
+class Series:
+    """One instrument at one resolution."""
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {}
+
+    def file(self, field):
+        return os.path.join(self.path, field + ".npy")
+
+    def length(self, field):
+        if not os.path.exists(self.file(field)):
+            return 0
+        with open(self.file(field), "rb") as f:
+            return header(f)[1]
+
+    def __len__(self):
+        """Rows every column has, so a column an interrupted append got further with doesn't count."""
+
+        return min(self.length(field) for field in FIELDS)
+
+    def column(self, field, rows=None):
+        """Memory-mapped column, its first rows entries (all rows by default)."""
+
+        if rows is None:
+            rows = self.length(field) if field in INDEX else len(self)
+        if not rows:
+            return np.empty(0, dtype=kind(field))
+        mapped = self.columns.get(field)
+        if mapped is None or len(mapped) < rows:
+            mapped = self.columns[field] = np.load(self.file(field), mmap_mode='r')
+        return mapped[:rows]
+
+    def first(self):
+        return int(self.column('time')[0]) if len(self) else None
+
+    def last(self):
+        n = len(self)
+        return int(self.column('time', n)[n - 1]) if n else None
+
+    def rows(self, start=None, end=None):
+        """(lo, hi): the rows with start <= time < end, either bound optional."""
+
+        n = len(self)
+        # The shorter of the two, in case an append stopped between them.
+        days = min(self.length(field) for field in INDEX)
+        days, first = self.column('index_day', days), self.column('index_row', days)
+        time = self.column('time', n)
+
+        def find(t):
+            if t is None:
+                return None
+            d = int(np.searchsorted(days, t - t % DAY, side='right')) - 1
+            lo = int(first[d]) if d >= 0 else 0
+            hi = int(first[d + 1]) if d + 1 < len(first) else n
+            return lo + int(np.searchsorted(time[lo:hi], t, side='left'))
+
+        lo, hi = find(start), find(end)
+        return (0 if lo is None else lo), (n if hi is None else hi)
+
+    def read(self, start=None, end=None):
+        """{field: memory-mapped slice} for start <= time < end."""
+
+        lo, hi = self.rows(start, end)
+        n = len(self)
+        return {field: self.column(field, n)[lo:hi] for field in FIELDS}
+
+    def append(self, columns):
+        """
+        Append {field: values}, time and the prices required, volume
+        optional. Rows not after the last stored time are dropped. Returns
+        the number of rows appended.
+        """
+
+        time = np.asarray(columns['time'], dtype=np.int64)
+        order = np.argsort(time, kind='stable')
+        time = time[order]
+        keep = np.ones(len(time), dtype=bool)
+        keep[1:] = time[1:] != time[:-1]
+        last = self.last()
+        if last is not None:
+            keep &= time > last
+        if not keep.any():
+            return 0
+        pick = order[keep]
+        time = time[keep]
+
+        if not os.path.exists(self.file('time')):
+            os.makedirs(self.path, exist_ok=True)
+            for field in FIELDS + INDEX:
+                np.save(self.file(field), np.empty(0, dtype=kind(field)))
+
+        n = len(self)
+        for field in FIELDS[1:]:
+            values = columns.get(field)
+            values = np.full(len(pick), np.nan) if values is None else np.asarray(values, dtype=np.float64)[pick]
+            extend(self.file(field), values, n)
+        # time last: a row only counts once every column has it.
+        extend(self.file('time'), time, n)
+
+        # Both index files are rewritten from the shorter one's last entry, so
+        # days an interrupted append left unindexed (or half indexed) get in.
+        days = min(self.length(field) for field in INDEX)
+        start = int(self.column('index_row', days)[days - 1]) if days else 0
+        indexed = np.concatenate((self.column('time', n)[start:], time))
+        day = indexed - indexed % DAY
+        new = np.flatnonzero(np.concatenate(([not days], day[1:] != day[:-1])))
+        extend(self.file('index_day'), day[new], days)
+        extend(self.file('index_row'), start + new, days)
+        self.columns.clear()
+        return len(time)
+
+
+class Store:
+
+    def __init__(self, root):
+        self.root = root
+
+    def series(self, name, resolution="MINUTE"):
+        return Series(os.path.join(self.root, slug(name), resolution))
+
+    def contents(self):
+        """[(instrument directory, resolution, Series)] on disk."""
+
+        out = []
+        for instrument in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else ():
+            for resolution in sorted(os.listdir(os.path.join(self.root, instrument))):
+                out.append((instrument, resolution, Series(os.path.join(self.root, instrument, resolution))))
+        return out
+
+
+def date(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%d %H:%M") if t is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root", help="store directory")
+    parser.add_argument("--import", dest="imports", action="append", metavar="TICKER=CSV",
+                        help="append a bars CSV (as backtest.py reads) to an instrument, repeatable")
+    parser.add_argument("--resolution", default="MINUTE")
+    parser.add_argument("--rules", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "instrument_rules.json"))
+    args = parser.parse_args()
+
+    store = Store(args.root)
+    if args.imports:
+        import backtest
+        import ig_rules
+        rules = ig_rules.RuleBook(args.rules)
+        for spec in args.imports:
+            ticker, path = spec.split("=", 1)
+            rule = rules.get(ticker)
+            if rule is None:
+                parser.error("unknown ticker " + ticker)
+            bars = backtest.load_bars(path)
+            added = store.series(rule.name, args.resolution).append({f: getattr(bars, f) for f in ('time',) + PRICES})
+            print("%s: %d of %d rows appended" % (rule.name, added, len(bars)))
+
+    print("{:<20} {:<10} {:>10} {:<17} {:<17} {:>9}".format("instrument", "resolution", "rows", "first", "last", "MB"))
+    for instrument, resolution, series in store.contents():
+        size = sum(os.path.getsize(os.path.join(series.path, f)) for f in os.listdir(series.path))
+        print("{:<20} {:<10} {:>10} {:<17} {:<17} {:>9.1f}".format(
+            instrument, resolution, len(series), date(series.first()), date(series.last()), size / 1e6))
+
+
+if __name__ == "__main__":
+    main()
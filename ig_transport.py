@@ -0,0 +1,283 @@
+"""
+HTTP transports for the IG REST API.
+
+The handler builds Request objects and sends them through a transport, which
+returns a Response with status_code, headers, content, text and json(), the
+parts of requests.Response the handler uses.
+
+    http      http.client on the standard library: one persistent connection
+              per host, gzip responses, and the retry policy below. Nothing
+              outside the standard library is imported.
+    requests  botocore.vendored.requests with a urllib3 Retry, the original
+              implementation, imported only when selected.
+
+Both retry connection errors and 502/503/504 responses up to RETRY_TOTAL
+times on every method, waiting 0, then BACKOFF_FACTOR * 2 ** (n - 1)
+seconds between attempts (or the Retry-After a 503 asks for), and raise once
+retries run out.
+
+Both can connect() ahead of the first request, so DNS, TCP and TLS set-up can
+be done before a signal arrives.
+
+Select with IG_TRANSPORT=http|requests, default http.
+"""
+from time import sleep
+from urllib.parse import urlsplit
+import json
+
+
+DEFAULT = "http"
+
+# Same policy as the urllib3 Retry the handler has always used.
+RETRY_TOTAL = 5
+BACKOFF_FACTOR = 0.25
+BACKOFF_MAX = 120
+STATUS_FORCELIST = frozenset((502, 503, 504))
+
+USER_AGENT = "HTF-single-strat"
+
+
+class TransportError(Exception):
+    pass
+
+
+class RetryError(TransportError):
+    pass
+
+
+class Headers(dict):
+    """Response headers with case-insensitive lookup."""
+
+    def __getitem__(self, key):
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            for k, v in self.items():
+                if k.lower() == key.lower():
+                    return v
+            raise
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class Request:
+    """A request ready to send. json is serialised here, data is sent as is."""
+
+    __slots__ = ('method', 'url', 'headers', 'body')
+
+    def __init__(self, method, url, headers=None, data=None, json=None):
+        if json is not None:
+            data = dumps(json)
+        if isinstance(data, str):
+            data = data.encode()
+        self.method = method
+        self.url = url
+        self.headers = dict(headers) if headers else {}
+        self.body = data
+
+    @property
+    def path_url(self):
+        i = self.url.find("/", self.url.find("//") + 2) if "//" in self.url else 0
+        return self.url[i:] if i >= 0 else "/"
+
+
+def dumps(doc):
+    return json.dumps(doc, separators=(',', ':')).encode()
+
+
+class Response:
+
+    __slots__ = ('status_code', 'headers', 'content', 'url', 'retries')
+
+    def __init__(self, status_code, headers, content, url=None, retries=0):
+        self.status_code = status_code
+        self.headers = headers if isinstance(headers, Headers) else Headers(headers)
+        self.content = content or b''
+        self.url = url
+        self.retries = retries
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def backoff(attempt):
+    """Seconds to wait before retry number attempt (1-based), as urllib3 computes it."""
+
+    return 0 if attempt <= 1 else min(BACKOFF_MAX, BACKOFF_FACTOR * 2 ** (attempt - 1))
+
+
+def decode(content, encoding):
+    if encoding == "gzip":
+        import gzip
+        return gzip.decompress(content)
+    if encoding == "deflate":
+        import zlib
+        return zlib.decompress(content)
+    return content
+
+
+def dropped(sock):
+    """True if the peer has closed an idle keep-alive socket (it reads as ready)."""
+
+    import select
+
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+class HTTPTransport:
+    """http.client transport keeping one connection open per scheme and host."""
+
+    def __init__(self, timeout=None):
+        # http.client brings in ssl and email, about as much import time as
+        # the rest of the handler, so it is loaded with the first transport.
+        import http.client
+
+        self.client = http.client
+        self.timeout = timeout
+        self.connections = {}
+        self.context = None
+
+    def connection(self, scheme, netloc):
+        c = self.connections.get((scheme, netloc))
+        if c is None:
+            if scheme == "https":
+                if self.context is None:
+                    import ssl
+                    self.context = ssl.create_default_context()
+                c = self.client.HTTPSConnection(netloc, timeout=self.timeout, context=self.context)
+            else:
+                c = self.client.HTTPConnection(netloc, timeout=self.timeout)
+            self.connections[(scheme, netloc)] = c
+        return c
+
+    def connect(self, url, timeout=5):
+        """
+        Open the connection for url's host ahead of the first request: DNS,
+        TCP and TLS. Returns False if an open connection was already there.
+        """
+
+        scheme, netloc = urlsplit(url)[:2]
+        c = self.connection(scheme, netloc)
+        if c.sock is not None and not dropped(c.sock):
+            return False
+
+        c.close()
+        c.timeout = timeout
+        try:
+            c.connect()
+        finally:
+            c.timeout = self.timeout
+        c.sock.settimeout(self.timeout)
+        return True
+
+    def send(self, request, **kwargs):
+        scheme, netloc, path, query, _ = urlsplit(request.url)
+        if query:
+            path += "?" + query
+
+        headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': "gzip, deflate"}
+        headers.update(request.headers)
+
+        attempt = 0
+        while True:
+            c = self.connection(scheme, netloc)
+            if c.sock is not None and dropped(c.sock):
+                # Closed by IG while idle, or while the container was frozen.
+                c.close()
+            try:
+                c.request(request.method, path or "/", request.body, headers)
+                r = c.getresponse()
+                content = r.read()
+            except (OSError, self.client.HTTPException) as e:
+                # Dropped keep-alive connections end up here too; the next
+                # attempt reconnects.
+                c.close()
+                attempt += 1
+                if attempt > RETRY_TOTAL:
+                    raise TransportError("%s %s failed after %d retries: %s" % (
+                        request.method, request.url, RETRY_TOTAL, e)) from e
+                sleep(backoff(attempt))
+                continue
+
+            if r.status in STATUS_FORCELIST:
+                attempt += 1
+                if attempt > RETRY_TOTAL:
+                    raise RetryError("%s %s returned %d after %d retries" % (
+                        request.method, request.url, r.status, RETRY_TOTAL))
+                after = r.getheader("Retry-After") if r.status == 503 else None
+                sleep(float(after) if after and after.isdigit() else backoff(attempt))
+                continue
+
+            return Response(r.status, Headers(r.getheaders()), decode(content, r.getheader("Content-Encoding")),
+                            request.url, attempt)
+
+    def close(self):
+        for c in self.connections.values():
+            c.close()
+        self.connections = {}
+
+
+class RequestsTransport:
+    """botocore.vendored.requests session with the same retry policy."""
+
+    def __init__(self):
+        import botocore.vendored.requests.packages.urllib3 as urllib3
+        from botocore.vendored import requests
+
+        retries = urllib3.util.retry.Retry(
+            total=RETRY_TOTAL,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=sorted(STATUS_FORCELIST),
+            method_whitelist=False)
+        adapter = requests.adapters.HTTPAdapter(max_retries=retries)
+        self.requests = requests
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def send(self, request, **kwargs):
+        prepared = self.requests.Request(
+            request.method, request.url, headers=request.headers, data=request.body).prepare()
+        return self.session.send(prepared, **kwargs)
+
+    def connect(self, url, timeout=5):
+        """Open a pooled connection for url's host. Returns False if one was already open."""
+
+        pool = self.session.get_adapter(url).get_connection(url)
+        conn = pool._get_conn()
+        try:
+            if conn.sock is not None:
+                return False
+            conn.timeout = timeout
+            conn.connect()
+            return True
+        finally:
+            pool._put_conn(conn)
+
+    def close(self):
+        self.session.close()
+
+
+TRANSPORTS = {
+    'http': HTTPTransport,
+    'requests': RequestsTransport}
+
+
+def new(name=None):
+    """Transport by name, see TRANSPORTS."""
+
+    transport = TRANSPORTS.get(name or DEFAULT)
+    if transport is None:
+        raise ValueError("Unknown IG transport %r, expected one of %s" % (name, ", ".join(TRANSPORTS)))
+    return transport()
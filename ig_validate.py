@@ -0,0 +1,85 @@
+"""
+Validation of webhook signals, before credentials or any IG call.
+
+A signal must be a JSON object no larger than MAX_BODY bytes with a string
+token matching WEBHOOK_TOKEN, a known ticker, and a side that instrument's
+strategy accepts (ig_decide). The token is compared in constant time and
+checked before the ticker, so a spoofed signal learns nothing about which
+tickers exist.
+
+Anything else raises Rejected with the 4xx status and message to return;
+nothing here exits the process or does any I/O.
+"""
+from ig_decide import REASONS, SIDE_ERROR
+import binascii
+import base64
+import hmac
+import json
+
+
+MAX_BODY = 4096
+
+MALFORMED = "Malformed signal."
+TOKEN_MISSING = "Tradingview webhook token missing"
+TOKEN_ERROR = "Webhook signal token error"
+UNKNOWN_TICKER = "Webhook ticker code not recognised."
+SIDE = REASONS[SIDE_ERROR]
+
+
+class Rejected(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Validator:
+    """Checks signals against a webhook token and a RuleBook."""
+
+    def __init__(self, token, rules):
+        self.token = token.encode() if token else None
+        self.rules = rules
+
+    def body(self, event):
+        body = event.get('body') if isinstance(event, dict) else None
+        if isinstance(body, str) and event.get('isBase64Encoded'):
+            try:
+                body = base64.b64decode(body, validate=True)
+            except (binascii.Error, ValueError):
+                raise Rejected(400, MALFORMED)
+        if not isinstance(body, (str, bytes)) or not body:
+            raise Rejected(400, MALFORMED)
+        if len(body) > MAX_BODY:
+            raise Rejected(413, MALFORMED)
+        return body
+
+    def check(self, event):
+        """Return (signal, rule, side) for a valid signal, otherwise raise Rejected."""
+
+        if not self.token:
+            raise Rejected(400, TOKEN_MISSING)
+
+        try:
+            signal = json.loads(self.body(event))
+        except (ValueError, RecursionError):
+            # RecursionError: deeply nested arrays or objects, e.g. "[[[[...".
+            raise Rejected(400, MALFORMED)
+        if not isinstance(signal, dict):
+            raise Rejected(400, MALFORMED)
+
+        token = signal.get('token')
+        if not isinstance(token, str) or not hmac.compare_digest(token.encode(), self.token):
+            raise Rejected(400, TOKEN_ERROR)
+
+        ticker = signal.get('ticker')
+        rule = self.rules.get(ticker) if isinstance(ticker, str) else None
+        if rule is None:
+            raise Rejected(400, UNKNOWN_TICKER)
+
+        side = signal.get('side')
+        side = side.upper() if isinstance(side, str) else None
+        if side not in rule.strategy.sides:
+            raise Rejected(400, SIDE)
+
+        return signal, rule, side
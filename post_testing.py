@@ -1,20 +1,340 @@
-from requests import Request, Session
+"""
+Webhook load generator.
+
+Replays templated TradingView signals at a fixed rate and concurrency and
+reports throughput, latency percentiles, outcome/error classes and duplicate
+orders. Targets:
+
+    lambda  a deployed function URL (--url)
+    server  server.py; --url for a running one, otherwise one is started
+            against a local fake IG gateway, with IG's per-minute request
+            limits (ig_scheduler) lifted unless --ig-limits is given, so
+            the server is measured rather than the rate limiter
+    local   lambda_handler in this process against a fake IG gateway, one
+            independent handler copy ("container") per concurrent worker
+
+Latency is measured from each signal's scheduled send time, so a backlog
+shows up in the percentiles instead of silently lowering the send rate.
+
+A duplicate order is an open accepted while the instrument already had a
+position. It is counted from the responses for every target, and from the
+gateway's own book when the fake gateway is used.
+
+    python post_testing.py --target local --rate 5 --count 100 --concurrency 4
+    python post_testing.py --target server --rate 20 --duration 30 --concurrency 8
+    python post_testing.py --target lambda --url https://<id>.lambda-url.<region>.on.aws/ --rate 0.5 --count 10
+"""
+from contextlib import redirect_stdout
+from threading import Lock, Thread, local
+from time import perf_counter, sleep
+from urllib.parse import urlsplit
+import importlib.util
+import http.client
+import subprocess
+import argparse
+import random
+import socket
 import json
+import sys
 import os
 
+from ig_histogram import Histogram
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+HANDLER = os.path.join(ROOT, "final_deployment_current.py")
+
+# (ticker, side) signal templates.
+TEMPLATES = (
+    ("UKOIL", "buy"), ("UKOIL", "sell"),
+    ("DAX", "buy"), ("DAX", "sell"), ("DAX", "close_buy"), ("DAX", "close_sell"),
+    ("WHEATUSD", "buy"), ("WHEATUSD", "sell"))
+
+HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+    'X-Requested-With': 'XMLHttpRequest'}
+
+FAKE_CREDENTIALS = {'IG_API_KEY_DEMO': "load", 'IG_USERNAME_DEMO': "load", 'IG_PASSWORD_DEMO': "load"}
+
+# ig_scheduler limits for a server started against the fake gateway: at IG's
+# 30 non-trading requests a minute it manages about 7 signals a minute.
+UNLIMITED = {'IG_TRADING_PER_MINUTE': "1000000", 'IG_NON_TRADING_PER_MINUTE': "1000000"}
+
+
+def signals(count, token, tickers=None, seed=1):
+    rng = random.Random(seed)
+    templates = [t for t in TEMPLATES if not tickers or t[0] in tickers]
+    return [json.dumps({"ticker": ticker, "side": side, "token": token})
+            for ticker, side in (rng.choice(templates) for _ in range(count))]
+
+
+class HTTPTarget:
+    """POSTs to a URL over one keep-alive connection per worker thread."""
+
+    def __init__(self, url, timeout=30):
+        parts = urlsplit(url)
+        self.scheme, self.netloc = parts.scheme, parts.netloc
+        self.path = parts.path or "/"
+        self.timeout = timeout
+        self.local = local()
+
+    def connection(self):
+        c = getattr(self.local, 'connection', None)
+        if c is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            c = self.local.connection = cls(self.netloc, timeout=self.timeout)
+        return c
+
+    def post(self, worker, body):
+        c = self.connection()
+        try:
+            c.request("POST", self.path, body.encode(), HEADERS)
+            r = c.getresponse()
+            return r.status, r.read().decode("utf-8", "replace")
+        except (OSError, http.client.HTTPException):
+            c.close()
+            self.local.connection = None
+            raise
+
+
+class LocalTarget:
+    """
+    Calls lambda_handler in process. Each worker gets its own copy of the
+    handler and its caches, as each concurrent Lambda invocation gets its
+    own container.
+    """
+
+    def __init__(self, workers, no_sleep):
+        self.handlers = [self.container(i, no_sleep) for i in range(workers)]
+
+    @staticmethod
+    def load(name, path):
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def container(self, i, no_sleep):
+        handler = self.load("container_%d" % i, HANDLER)
+        handler.ig_cache = self.load("container_%d_cache" % i, os.path.join(ROOT, "ig_cache.py"))
+        if no_sleep:
+            handler.sleep = lambda s: None
+        return handler
+
+    def post(self, worker, body):
+        r = self.handlers[worker].lambda_handler({'body': body}, None)
+        return r['statusCode'], r['body']
+
+
+def fake_gateway(latency):
+    """Start a fake IG gateway. Returns (server, duplicate counter)."""
+
+    import fake_ig
+
+    fake = fake_ig.FakeIG(latency=latency)
+    duplicates = [0]
+    original = fake.open
+
+    # Count accepted opens into an instrument that already has a position.
+    def open_watched(data):
+        held = any(p['market']['epic'] == data.get('epic') for p in fake.positions.values())
+        before = len(fake.positions)
+        result = original(data)
+        if held and len(fake.positions) > before:
+            duplicates[0] += 1
+        return result
+
+    fake.open = open_watched
+    return fake_ig.serve(fake), duplicates
+
+
+def start_server(env, coalesce=0):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--host", "127.0.0.1", "--port", str(port),
+         "--coalesce", str(coalesce)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            sleep(0.05)
+    return process, "http://127.0.0.1:%d/" % port
+
+
+def run(target, bodies, rate, concurrency):
+    """Send bodies on schedule. Returns [(index, scheduled, sent, done, status, text, error)] and elapsed seconds."""
+
+    results, lock = [], Lock()
+    pending = iter(range(len(bodies)))
+    start = perf_counter() + 0.05
+
+    def worker(w):
+        while True:
+            with lock:
+                i = next(pending, None)
+            if i is None:
+                return
+            scheduled = start + i / rate if rate else perf_counter()
+            delay = scheduled - perf_counter()
+            if delay > 0:
+                sleep(delay)
+
+            sent = perf_counter()
+            status, text, error = None, None, None
+            try:
+                status, text = target.post(w, bodies[i])
+            except Exception as e:
+                error = type(e).__name__
+            done = perf_counter()
+            with lock:
+                results.append((i, scheduled, sent, done, status, text, error))
+
+    threads = [Thread(target=worker, args=(w,), daemon=True) for w in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, perf_counter() - start
+
+
+def message(text):
+    """The handler's reply message; for a rejected deal, IG's reason."""
+
+    try:
+        body = json.loads(text)
+    except (TypeError, ValueError):
+        return (text or "")[:80]
+    if isinstance(body, dict):
+        return "rejected: %s" % (body.get('reason') or body.get('errorCode'))
+    return str(body)
+
+
+def classify(status, text, error):
+    if error:
+        return "error " + error
+    if 200 <= status < 300:
+        return "%d %s" % (status, "merged" if " signal merged into " in message(text) else "ok")
+    return "%d %s" % (status, message(text))
+
+
+def duplicate_opens(results):
+    """
+    Opens reported, in completion order, in the direction an earlier response
+    already showed held. An open the other way is a reversal, not a duplicate.
+    """
+
+    held, duplicates = {}, 0
+    for _, _, _, _, status, text, _ in sorted(results, key=lambda r: r[3]):
+        if status != 200:
+            continue
+        text = message(text)
+        if text.endswith(" position closed successfully."):
+            held.pop(text[:-len(" position closed successfully.")], None)
+        elif text.endswith(" position opened successfully."):
+            name, direction = text[:-len(" position opened successfully.")].rsplit(" ", 1)
+            if held.get(name) == direction:
+                duplicates += 1
+            held[name] = direction
+    return duplicates
+
+
+def report(results, elapsed, gateway_duplicates):
+    scheduled, service = Histogram(), Histogram()
+    classes = {}
+    for i, sched, sent, done, status, text, error in results:
+        scheduled.record((done - sched) * 1000)
+        service.record((done - sent) * 1000)
+        key = classify(status, text, error)
+        classes[key] = classes.get(key, 0) + 1
+
+    ok = sum(n for k, n in classes.items() if k.startswith("2"))
+    out = {
+        'signals': len(results),
+        'elapsed_s': elapsed,
+        'throughput_per_s': len(results) / elapsed if elapsed else None,
+        'ok': ok,
+        'latency': scheduled.summary(),
+        'service_time': service.summary(),
+        'outcomes': dict(sorted(classes.items(), key=lambda kv: -kv[1])),
+        'duplicate_opens_seen': duplicate_opens(results),
+        'duplicate_orders_at_gateway': gateway_duplicates}
+
+    print("%d signals in %.1f s: %.2f/s, %d succeeded" % (len(results), elapsed, out['throughput_per_s'] or 0, ok))
+    for label, h in (("latency", scheduled), ("service time", service)):
+        if h.n:
+            print("{:<13} p50 {:8.1f} ms  p90 {:8.1f} ms  p99 {:8.1f} ms  max {:8.1f} ms".format(
+                label, h.percentile(50), h.percentile(90), h.percentile(99), h.max / 1000))
+    print("outcomes")
+    for k, n in out['outcomes'].items():
+        print("  {:>6}  {}".format(n, k))
+    print("duplicate opens seen in responses:", out['duplicate_opens_seen'])
+    if gateway_duplicates is not None:
+        print("duplicate orders accepted by the gateway:", gateway_duplicates)
+    return out
+
 
-URL = ""
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--target", choices=("lambda", "server", "local"), default="local")
+    parser.add_argument("--url", help="function URL, or a running server.py")
+    parser.add_argument("--rate", type=float, default=2, help="signals per second, 0 for as fast as possible")
+    parser.add_argument("--count", type=int, default=None, help="signals to send")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to send for, instead of --count")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--ticker", action="append", help="only these tickers, repeatable")
+    parser.add_argument("--token", default=os.environ.get('WEBHOOK_TOKEN') or "load-test")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", choices=("realistic", "zero"), default="realistic", help="fake gateway latency")
+    parser.add_argument("--no-sleep", action="store_true", help="skip the handler's 1 s login sleep (local)")
+    parser.add_argument("--coalesce", type=float, default=0, help="coalescing window of the server started")
+    parser.add_argument("--ig-limits", action="store_true",
+                        help="keep IG's request rate limits in the server started against the fake gateway")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
 
+    if args.target == "lambda" and not args.url:
+        parser.error("--target lambda needs --url")
+    if args.target == "local" and args.url:
+        parser.error("--target local runs the handler in this process against a fake gateway; --url is for lambda or server")
+    count = args.count or int((args.duration or 10) * (args.rate or 10))
+    bodies = signals(count, args.token, args.ticker, args.seed)
 
-payload = {}
+    gateway, duplicates, process = None, None, None
+    if args.target != "lambda" and not args.url:
+        from bench_latency import LATENCY
+        gateway, duplicates = fake_gateway(LATENCY[args.latency])
+        os.environ.update(FAKE_CREDENTIALS, WEBHOOK_TOKEN=args.token, IG_URL=gateway.url, IG_METRICS="off")
 
-request = Request(
-    'POST', URL, json=payload, params='').prepare()
+    try:
+        if args.target == "local":
+            with open(os.devnull, "w") as null, redirect_stdout(null):
+                target = LocalTarget(args.concurrency, args.no_sleep)
+                results, elapsed = run(target, bodies, args.rate, args.concurrency)
+        else:
+            url = args.url
+            if not url:
+                env = dict(os.environ)
+                if not args.ig_limits:
+                    env.update(UNLIMITED)
+                process, url = start_server(env, args.coalesce)
+            results, elapsed = run(HTTPTarget(url), bodies, args.rate, args.concurrency)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if gateway:
+            gateway.shutdown()
 
-request.headers['Content-Type'] = 'application/json'
-request.headers['Accept'] = 'application/json'
-request.headers['X-Requested-With'] = 'XMLHttpRequest'
+    out = report(results, elapsed, duplicates[0] if duplicates else None)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(out, f, indent=2)
 
-response = Session().send(request)
 
-print(response.json())
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Differential replay of webhook signals across the handler variants.
+
+Feeds one corpus of webhook events, each with the IG account and market state
+it was received in, through every deployment variant in parallel worker
+processes. IG is served in-process by fake_ig, seeded from the corpus entry,
+so every variant sees the same responses for the same event.
+
+For each variant it reports CPU time and IG calls, and for each event any
+difference in decisions: the orders and closes sent to /positions/otc and the
+response status code.
+
+Corpus format, one JSON object per line:
+
+    {"event": {"ticker": "UKOIL", "side": "buy"},
+     "positions": [{"epic": "CC.D.LCO.UNC.IP", "direction": "SELL", "size": 1}],
+     "quotes": {"CC.D.LCO.UNC.IP": [6512.3, 6515.1]},
+     "status": {"IX.D.DAX.IFMM.IP": "CLOSED"},
+     "reject": "INSUFFICIENT_FUNDS"}
+
+Only "event" is required; the token is filled in unless "token" is given.
+
+Usage:
+    python replay_variants.py --generate 500 --save-corpus corpus.jsonl
+    python replay_variants.py --corpus corpus.jsonl --json replay.json
+"""
+from multiprocessing import Pool
+from time import process_time
+import argparse
+import random
+import json
+import gzip
+import ast
+import sys
+import os
+
+import fake_ig
+import ig_transport
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "replay-token"
+
+# variant name: handler source, relative to the repo root
+VARIANTS = {
+    'v1_main': "v1/main.py",
+    'v1_final': "v1/final_deployment_v1.py",
+    'v1_uk_sizing': "v1/lambda_uk_sizing_v1.py",
+    'v2_final': "v2/final_deployment_v2.py",
+    'current': "final_deployment_current.py"}
+
+# Credentials for every environment variable name the variants read.
+ENVIRONMENT = {
+    'WEBHOOK_TOKEN': TOKEN,
+    'IG_API_KEY_DEMO': "replay", 'IG_USERNAME_DEMO': "replay", 'IG_PASSWORD_DEMO': "replay",
+    'IG_API_KEY_DEMO_UK': "replay", 'IG_USERNAME_DEMO_UK': "replay", 'IG_PASSWORD_DEMO_UK': "replay",
+    'IG_API_KEY_LIVE': "replay", 'IG_USERNAME_LIVE': "replay", 'IG_PASSWORD_LIVE': "replay"}
+
+# ticker: CFD epic in the fake_ig default catalogue
+EPICS = {
+    "UKOIL": "CC.D.LCO.UNC.IP",
+    "DAX": "IX.D.DAX.IFMM.IP",
+    "DE30EUR": "IX.D.DAX.IFMM.IP",
+    "WHEATUSD": "CC.D.W.UNC.IP",
+    "WHTUSD": "CC.D.W.UNC.IP"}
+
+
+def load_corpus(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def generate_corpus(n, seed=1):
+    """Random events over the known tickers, sides and position states, plus some malformed ones."""
+
+    rng = random.Random(seed)
+    quotes = {m['epic']: (m['bid'], m['offer']) for m in fake_ig.default_markets()}
+    corpus = []
+
+    for _ in range(n):
+        ticker = rng.choice(list(EPICS) + ["UNKNOWN"])
+        side = rng.choice(("buy", "sell", "buy", "sell", "close_buy", "close_sell", "hold"))
+        entry = {'event': {"ticker": ticker, "side": side}}
+        epic = EPICS.get(ticker)
+
+        if epic:
+            bid, offer = quotes[epic]
+            move = rng.uniform(-0.02, 0.02) * bid
+            spread = offer - bid
+            entry['quotes'] = {epic: [round(bid + move, 1), round(bid + move + spread * rng.uniform(0.5, 2), 1)]}
+
+            held = rng.choice((None, "BUY", "SELL"))
+            if held:
+                size = 15 if ticker.startswith("WH") else rng.choice((0.5, 1, 2))
+                entry['positions'] = [{"epic": epic, "direction": held, "size": size}]
+            if rng.random() < 0.1:
+                entry['status'] = {epic: rng.choice(("CLOSED", "EDITS_ONLY"))}
+            elif rng.random() < 0.03:
+                entry['reject'] = "INSUFFICIENT_FUNDS"
+
+        if rng.random() < 0.03:
+            entry['token'] = "spoofed"
+        corpus.append(entry)
+
+    return corpus
+
+
+def gateway(entry):
+    """FakeIG seeded with a corpus entry's state."""
+
+    fake = fake_ig.FakeIG(gzip=False)
+    for epic, (bid, offer) in entry.get('quotes', {}).items():
+        fake.set_quote(epic, bid, offer)
+    for epic, status in entry.get('status', {}).items():
+        fake.set_status(epic, status)
+    for p in entry.get('positions', ()):
+        fake.add_position(p['epic'], p['direction'], p['size'])
+    if entry.get('reject'):
+        fake.reject_next(entry['reject'])
+    fake.reset_calls()
+    return fake
+
+
+def load_variant(name, path):
+    """
+    Import a handler from source as module replay_<name>.
+
+    Only imports, definitions and assignments are kept from the module body;
+    v1/main.py calls lambda_handler against IG when imported.
+    """
+
+    import types
+
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    keep = (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef, ast.Assign)
+    tree.body = [node for node in tree.body if isinstance(node, keep)]
+
+    module = types.ModuleType("replay_" + name)
+    module.__file__ = path
+    sys.modules[module.__name__] = module
+    exec(compile(tree, path, "exec"), module.__dict__)
+    return module
+
+
+def compatible_requests():
+    """
+    Make the legacy imports resolvable with current requests/urllib3.
+
+    botocore.vendored.requests was a copy of requests and has been removed
+    from botocore, and urllib3 2 renamed Retry(method_whitelist=) to
+    allowed_methods. Neither matters here as no real connections are made.
+    """
+
+    import requests
+    import urllib3
+    from urllib3.util import retry
+
+    try:
+        import botocore.vendored.requests  # noqa: F401
+    except ImportError:
+        import types
+        vendored = types.ModuleType("botocore.vendored")
+        vendored.requests = requests
+        sys.modules.setdefault("botocore", types.ModuleType("botocore")).vendored = vendored
+        sys.modules['botocore.vendored'] = vendored
+        sys.modules['botocore.vendored.requests'] = requests
+        sys.modules['botocore.vendored.requests.packages'] = requests.packages
+        sys.modules['botocore.vendored.requests.packages.urllib3'] = urllib3
+
+    if 'method_whitelist' not in retry.Retry.__init__.__code__.co_varnames:
+        class Retry(retry.Retry):
+            def __init__(self, *args, method_whitelist=None, **kwargs):
+                if method_whitelist is not None:
+                    kwargs['allowed_methods'] = method_whitelist
+                super().__init__(*args, **kwargs)
+        retry.Retry = urllib3.util.retry.Retry = Retry
+
+    return requests
+
+
+class Router:
+    """
+    Routes requests.Session.send and ig_transport sends to the current FakeIG
+    and records trading calls.
+    """
+
+    def __init__(self, requests):
+        self.requests = requests
+        self.fake = None
+        self.trades = []
+        self.gateway_cpu = 0.0
+
+    def route(self, prepared):
+        body = prepared.body or b''
+        if isinstance(body, str):
+            body = body.encode()
+
+        start = process_time()
+        status, headers, payload = self.fake.handle(prepared.method, prepared.path_url, dict(prepared.headers), body)
+        self.gateway_cpu += process_time() - start
+
+        if prepared.path_url.endswith("/positions/otc"):
+            order = json.loads(body)
+            kind = "close" if prepared.headers.get('_method') == "DELETE" else "open"
+            self.trades.append([
+                kind, order.get('direction'), order.get('size'),
+                rounded(order.get('stopLevel')), rounded(order.get('limitLevel'))])
+        return status, headers, payload
+
+    def send(self, session, prepared, **kwargs):
+        status, headers, payload = self.route(prepared)
+        r = self.requests.Response()
+        r.status_code = status
+        r.headers = self.requests.structures.CaseInsensitiveDict(headers)
+        r._content = payload
+        r.encoding = "utf-8"
+        r.url = prepared.url
+        r.request = prepared
+        return r
+
+    def transport_send(self, transport, request, **kwargs):
+        status, headers, payload = self.route(request)
+        return ig_transport.Response(status, headers, payload, request.url)
+
+
+def rounded(v):
+    return round(v, 6) if isinstance(v, float) else v
+
+
+def replay(args):
+    """Worker: run the whole corpus through one variant."""
+
+    name, path, corpus = args
+    os.environ.update(ENVIRONMENT)
+    os.environ.pop('IG_URL', None)
+    sys.path.insert(0, ROOT)
+
+    requests = compatible_requests()
+    router = Router(requests)
+    requests.Session.send = lambda session, prepared, **kwargs: router.send(session, prepared, **kwargs)
+    ig_transport.HTTPTransport.send = lambda t, request, **kwargs: router.transport_send(t, request, **kwargs)
+
+    with open(os.devnull, "w") as null:
+        stdout, sys.stdout = sys.stdout, null
+        try:
+            module = load_variant(name, os.path.join(ROOT, path))
+            module.sleep = lambda s: None
+
+            # Each entry brings its own market state, so a market seen closed
+            # in one must not carry into the next.
+            hours = getattr(getattr(module, 'ig_cache', None), 'HOURS', None)
+
+            decisions, cpu, calls = [], [], []
+            for entry in corpus:
+                if hours:
+                    hours.clear()
+                router.fake, router.trades, router.gateway_cpu = gateway(entry), [], 0.0
+                body = dict(entry['event'], token=entry.get('token', TOKEN))
+
+                start = process_time()
+                try:
+                    r = module.lambda_handler({'body': json.dumps(body)}, None)
+                    status = r['statusCode'] if r else None
+                except SystemExit:
+                    status = "exit"
+                except Exception as e:
+                    status = type(e).__name__
+                cpu.append(process_time() - start - router.gateway_cpu)
+
+                decisions.append([status, router.trades])
+                calls.append(len(router.fake.calls))
+        finally:
+            sys.stdout = stdout
+
+    return name, decisions, cpu, calls
+
+
+def differences(results, corpus):
+    """[(index, event, {variant: decision})] for events where the variants disagree."""
+
+    names = list(results)
+    out = []
+    for i, entry in enumerate(corpus):
+        decided = {n: results[n]['decisions'][i] for n in names}
+        if len({json.dumps(d) for d in decided.values()}) > 1:
+            out.append((i, entry, decided))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="JSONL corpus, optionally gzipped")
+    parser.add_argument("--generate", type=int, default=200, help="events to generate when no corpus is given")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-corpus", help="write the corpus used to this file")
+    parser.add_argument("--variant", action="append", choices=sorted(VARIANTS), help="repeatable, default all")
+    parser.add_argument("--reference", default="current", help="variant the others are compared against")
+    parser.add_argument("--show", type=int, default=10, help="differing events to print")
+    parser.add_argument("--json", help="write full results to this file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else generate_corpus(args.generate, args.seed)
+    if args.save_corpus:
+        with open(args.save_corpus, "w") as f:
+            f.writelines(json.dumps(e) + "\n" for e in corpus)
+
+    names = args.variant or list(VARIANTS)
+    with Pool(len(names)) as pool:
+        raw = pool.map(replay, [(n, VARIANTS[n], corpus) for n in names])
+
+    results = {
+        name: {'decisions': decisions, 'cpu': cpu, 'calls': calls}
+        for name, decisions, cpu, calls in raw}
+    reference = results.get(args.reference)
+
+    print("{:<14} {:>7} {:>12} {:>12} {:>10} {:>10}".format(
+        "variant", "events", "cpu ms", "cpu ms/evt", "IG calls", "differ"))
+    for name, r in results.items():
+        differ = sum(a != b for a, b in zip(r['decisions'], reference['decisions'])) if reference else 0
+        print("{:<14} {:>7} {:>12.1f} {:>12.3f} {:>10} {:>10}".format(
+            name, len(corpus), sum(r['cpu']) * 1000, sum(r['cpu']) / len(corpus) * 1000, sum(r['calls']), differ))
+
+    diffs = differences(results, corpus)
+    print("\n%d of %d events decided differently across variants." % (len(diffs), len(corpus)))
+    for i, entry, decided in diffs[:args.show]:
+        print("\n#%d %s" % (i, json.dumps(entry)))
+        for name, decision in decided.items():
+            print("   {:<14} {}".format(name, json.dumps(decision)))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                'corpus': len(corpus),
+                'variants': {
+                    n: {'cpu_s': sum(r['cpu']), 'calls': sum(r['calls'])} for n, r in results.items()},
+                'differences': [
+                    {'index': i, 'entry': entry, 'decisions': decided} for i, entry, decided in diffs]},
+                f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
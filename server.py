@@ -0,0 +1,202 @@
+"""
+Long-running webhook server.
+
+Runs lambda_handler behind a plain HTTP endpoint, for hosting the strategy on
+a VM or container instead of Lambda. TradingView posts its alert body to any
+path; the handler's statusCode and body are returned as the response.
+
+The IG connection is opened at start-up and checked every --keepalive
+seconds: if IG has closed it while idle it is reopened then, rather than by
+the next signal. Set-up time saved this way is reported as prewarm_ms in the
+next invocation's metrics record.
+
+Signals run one at a time through a priority queue, closes before
+reversals before opens, within IG's per-account rate limits, see
+ig_scheduler.
+
+With --coalesce, valid signals for the same instrument arriving within that
+many seconds of each other are merged into their net signals before any IG
+call, see ig_coalesce. Each merged request is answered when its batch has run.
+
+With --defer, a signal for a market that's closed is answered 202 and held
+until it next opens, then run; a later signal for the same instrument
+replaces it, see ig_defer.
+
+    python server.py --port 8080 --keepalive 30 --coalesce 2 --defer
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timezone
+from threading import Event, Lock, Thread
+from time import time
+import argparse
+import json
+import os
+
+import final_deployment_current as handler
+import ig_coalesce
+import ig_defer
+import ig_scheduler
+import ig_validate
+
+
+# One signal at a time, and never while the keep-alive is reconnecting.
+lock = Lock()
+
+# Set by main(). coalescer and deferrals only when those modes are on.
+scheduler = None
+coalescer = None
+deferrals = None
+
+OFFLINE = json.dumps("Market offline.")
+
+
+def run(event):
+    with lock:
+        try:
+            return handler.lambda_handler(event, None)
+        except Exception as e:
+            print("Error: handler failed:", repr(e))
+            return {'statusCode': 500, 'body': json.dumps("Internal error.")}
+
+
+def queue(rule, side, event):
+    if scheduler:
+        return scheduler.submit(rule, side, event)
+    return run(event)
+
+
+def offline(result):
+    return result.get('statusCode') == 400 and result.get('body') == OFFLINE
+
+
+def defer(rule, side, event, received=None):
+    """Hold a signal if its market is known to be closed. Returns the 202 reply, or None."""
+
+    calendar = handler.ig_cache.HOURS.get(rule.name)
+    if not calendar or not calendar.closed(time()):
+        return None
+    entry = deferrals.defer(rule, side, event, calendar, received)
+    if entry is None:
+        return None
+    due = datetime.fromtimestamp(entry.due, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+    message = "%s %s signal deferred to %s." % (rule.name, side, due)
+    print(message)
+    return {'statusCode': 202, 'body': json.dumps(message)}
+
+
+def release(stop):
+    """Run deferred signals as they fall due."""
+
+    while not stop.is_set():
+        for entry in deferrals.wait():
+            Thread(target=redo, args=(entry,), daemon=True).start()
+
+
+def redo(entry):
+    print("Running deferred %s %s signal." % (entry.rule.name, entry.side))
+    result = queue(entry.rule, entry.side, entry.event)
+    if offline(result) and entry.rule.name not in deferrals.pending:
+        if not defer(entry.rule, entry.side, entry.event, entry.received):
+            print("Dropped deferred %s %s signal." % (entry.rule.name, entry.side))
+
+
+def dispatch(event):
+    """
+    Run a valid signal through the coalescer, if it's on, and the queue.
+    Invalid ones are answered straight away.
+    """
+
+    try:
+        _, rule, side = handler.validator().check(event)
+    except ig_validate.Rejected:
+        return run(event)
+
+    if deferrals:
+        # A newer signal replaces any still waiting for the market to open.
+        deferrals.supersede(rule.name)
+        deferred = defer(rule, side, event)
+        if deferred:
+            return deferred
+
+    result = coalescer.submit(rule, side, event) if coalescer else queue(rule, side, event)
+    if deferrals and offline(result):
+        # IG said closed; the handler has recorded it, so this now defers.
+        return defer(rule, side, event) or result
+    return result
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode("utf-8", "replace")
+        result = dispatch({'body': body})
+
+        payload = (result.get('body') or "").encode()
+        self.send_response(result.get('statusCode') or 500)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        # Health check.
+        self.send_response(204)
+        self.send_header('Content-Length', "0")
+        self.end_headers()
+
+
+def keepalive(interval, stop):
+    while not stop.wait(interval):
+        with lock:
+            ms = handler.prewarm()
+        if ms is not None:
+            print("Reconnected to IG in %.1f ms" % ms)
+
+
+def main():
+    global coalescer, deferrals, scheduler
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--keepalive", type=float, default=30, help="seconds between connection checks, 0 to disable")
+    parser.add_argument("--coalesce", type=float, default=float(os.environ.get('IG_COALESCE_SECONDS') or 0),
+                        help="seconds to collect signals per instrument before running their net, 0 to disable")
+    parser.add_argument("--defer", action="store_true", default=os.environ.get('IG_DEFER', "off").lower() in ("on", "1", "true"),
+                        help="hold signals for closed markets until they open")
+    args = parser.parse_args()
+
+    # Every IG request takes a token; the queue waits for enough for a whole signal.
+    trading, non_trading = ig_scheduler.buckets()
+    handler.transport = ig_scheduler.Limited(handler.new_session(), trading, non_trading)
+    scheduler = ig_scheduler.Scheduler(run, trading, non_trading)
+    if args.coalesce > 0:
+        coalescer = ig_coalesce.Coalescer(args.coalesce, queue)
+
+    ms = handler.prewarm()
+    if ms is not None:
+        print("Connected to IG in %.1f ms" % ms)
+
+    stop = Event()
+    if args.keepalive > 0:
+        Thread(target=keepalive, args=(args.keepalive, stop), daemon=True).start()
+    if args.defer:
+        deferrals = ig_defer.Deferrals()
+        Thread(target=release, args=(stop,), daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), WebhookHandler)
+    print("Listening on http://%s:%d/" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Parallel sweep of stop, limit and adjust over historical signals.
+
+Every combination of the given values is backtested with backtest.run(),
+which already evaluates many parameter sets in one pass, so the grid is cut
+into chunks of --chunk sets and the chunks are spread over a process pool.
+The bars and their per-segment running extremes (backtest.Segments) are
+written once to .npy files and memory-mapped by every worker, so all of
+them read the same pages instead of each holding a copy.
+
+stop, limit and adjust are the rule's fields in instrument_rules.json: the
+v1 scripts' sl_pips / sl_both / sl_short, tp_pips / tp_both and adjust.
+Values are a comma list or start:stop:step, both ends included:
+
+    python sweep.py --generate 365 --instrument DAX --stop 50:400:5 --limit 10:200:5 --adjust 0:8:1
+    python sweep.py --signals alerts.csv --store prices --instrument UKOIL --stop 50:300:10 --limit 5:100:5
+
+Prints the best sets by --rank and writes a heatmap of the first two swept
+parameters, the best value over the rest, as CSV and, with matplotlib
+installed, PNG.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import tempfile
+import shutil
+import time
+import csv
+import os
+
+import numpy as np
+
+import backtest
+import ig_store
+
+
+PARAMS = ("stop", "limit", "adjust")
+EXTREMES = ("bid_low", "bid_high", "ask_low", "ask_high")
+
+# Minimum trades for a set to be ranked, so a lucky handful doesn't top the table.
+MIN_TRADES = 10
+
+RANKS = {
+    'pnl': lambda t: t['pnl'],
+    'pnl_dd': lambda t: t['pnl'] / np.maximum(t['max_drawdown'], 1e-9),
+    'profit_factor': lambda t: t['gross_profit'] / np.maximum(t['gross_loss'], 1e-9),
+    'win_rate': lambda t: t['wins'] / np.maximum(t['trades'], 1)}
+
+
+def values(spec):
+    """Array of values from "a,b,c" or "start:stop:step" (inclusive)."""
+
+    if ":" in spec:
+        start, stop, step = (float(v) for v in spec.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 10)
+    return np.array([float(v) for v in spec.split(",")])
+
+
+def share(directory, bars, segments):
+    """Write bars and segments to directory as .npy files for attach()."""
+
+    for field in backtest.Bars.__slots__:
+        np.save(os.path.join(directory, field + ".npy"), getattr(bars, field))
+    for field in EXTREMES + ("bounds",):
+        np.save(os.path.join(directory, "segment_" + field + ".npy"), getattr(segments, field))
+
+
+def attach(directory):
+    """(Bars, Segments) memory-mapped from a share() directory."""
+
+    load = lambda name: np.load(os.path.join(directory, name + ".npy"), mmap_mode='r')
+    bars = backtest.Bars(*(load(field) for field in backtest.Bars.__slots__))
+    segments = backtest.Segments.from_arrays(bars, np.asarray(load("segment_bounds")),
+                                             *(load("segment_" + field) for field in EXTREMES))
+    return bars, segments
+
+
+# Per-process state, set by init() in each worker.
+worker = {}
+
+
+def init(directory, rule, signals, min_size):
+    worker['bars'], worker['segments'] = attach(directory)
+    worker['args'] = rule, signals, min_size
+
+
+def evaluate(chunk):
+    """backtest.run() result arrays for one chunk of {param: array}."""
+
+    rule, signals, min_size = worker['args']
+    return backtest.run(rule, worker['bars'], signals, min_size=min_size, segments=worker['segments'], **chunk)
+
+
+def sweep(rule, bars, signals, grid, workers=None, chunk=4096, min_size=1, scratch=None):
+    """
+    Backtest every combination of grid {param: values} for one instrument.
+    Returns {column: array}: the parameters, then backtest.run()'s results.
+    """
+
+    axes = [p for p in PARAMS if p in grid]
+    mesh = np.meshgrid(*(grid[p] for p in axes), indexing='ij')
+    combos = {p: m.ravel() for p, m in zip(axes, mesh)}
+    k = mesh[0].size if mesh else 1
+    chunks = [{p: v[i:i + chunk] for p, v in combos.items()} for i in range(0, k, chunk)] or [{}]
+
+    at = np.searchsorted(bars.time, [t for t, _ in signals], side='left')
+    segments = backtest.Segments(bars, at[at < len(bars)])
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers == 1:
+        results = [backtest.run(rule, bars, signals, min_size=min_size, segments=segments, **c) for c in chunks]
+    else:
+        directory = tempfile.mkdtemp(prefix="sweep-", dir=scratch)
+        try:
+            share(directory, bars, segments)
+            with ProcessPoolExecutor(workers, initializer=init, initargs=(directory, rule, signals, min_size)) as pool:
+                results = list(pool.map(evaluate, chunks))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    table = {}
+    for p in PARAMS:
+        fixed = getattr(rule, p)
+        table[p] = combos[p] if p in combos else np.full(k, np.nan if fixed is None else float(fixed))
+    for column in results[0]:
+        table[column] = np.concatenate([r[column] for r in results])
+    return table
+
+
+def ranked(table, rank, min_trades=MIN_TRADES):
+    """Row indexes of table best first by rank, sets with fewer trades left out."""
+
+    score = RANKS[rank](table)
+    rows = np.flatnonzero(table['trades'] >= min_trades)
+    return rows[np.argsort(-score[rows], kind='stable')], score
+
+
+def pivot(table, x, y, score):
+    """(x values, y values, best score over the other parameters) for a heatmap."""
+
+    xs, xi = np.unique(table[x], return_inverse=True)
+    ys, yi = np.unique(table[y], return_inverse=True)
+    grid = np.full((len(xs), len(ys)), -np.inf)
+    np.maximum.at(grid, (xi, yi), score)
+    return xs, ys, grid
+
+
+def heatmap(path, name, x, y, rank, xs, ys, grid):
+    """Write the heatmap as CSV, and as PNG when matplotlib is installed."""
+
+    with open(path + ".csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["%s \\ %s" % (x, y)] + ["%g" % v for v in ys])
+        for v, row in zip(xs, grid):
+            w.writerow(["%g" % v] + ["%.4f" % s for s in row])
+    written = [path + ".csv"]
+
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib import pyplot
+    except ImportError:
+        return written
+    fig, ax = pyplot.subplots(figsize=(8, 6))
+    image = ax.imshow(grid.T, origin='lower', aspect='auto', cmap='RdYlGn',
+                      extent=(xs[0], xs[-1], ys[0], ys[-1]) if len(xs) > 1 and len(ys) > 1 else None)
+    fig.colorbar(image, label=rank)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    ax.set_title(name)
+    fig.savefig(path + ".png", dpi=100, bbox_inches='tight')
+    pyplot.close(fig)
+    return written + [path + ".png"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    backtest.arguments(parser)
+    parser.add_argument("--instrument", action="append", metavar="TICKER", help="sweep only these, repeatable")
+    for p in PARAMS:
+        parser.add_argument("--" + p, metavar="VALUES", help="%s values, a,b,c or start:stop:step" % p)
+    parser.add_argument("--rank", choices=sorted(RANKS), default="pnl")
+    parser.add_argument("--min-trades", type=int, default=MIN_TRADES)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--workers", type=int, help="processes, default one per core")
+    parser.add_argument("--chunk", type=int, default=4096, help="parameter sets per task")
+    parser.add_argument("--scratch", help="directory for the shared price files, default the system temp")
+    parser.add_argument("--out", default=".", help="directory for heatmaps and --csv")
+    parser.add_argument("--csv", action="store_true", help="also write every set's results")
+    args = parser.parse_args()
+
+    grid = {p: values(getattr(args, p)) for p in PARAMS if getattr(args, p)}
+    if not grid:
+        parser.error("give at least one of --stop, --limit, --adjust")
+    rules, bars, signals = backtest.inputs(parser, args)
+    wanted = {rules.get(t).name for t in args.instrument} if args.instrument else None
+
+    for name, instrument_signals in sorted(backtest.by_instrument(rules, signals).items()):
+        if wanted is not None and name not in wanted:
+            continue
+        if name not in bars:
+            print("No bars for %s, skipped" % name)
+            continue
+        rule = next(r for r in rules.instruments() if r.name == name)
+        started = time.perf_counter()
+        table = sweep(rule, bars[name], instrument_signals, grid, args.workers, args.chunk, args.min_size, args.scratch)
+        took = time.perf_counter() - started
+        k = len(table['pnl'])
+        print("%s: %d sets x %d signals x %d bars in %.1f s (%.0f sets/s)" % (
+            name, k, len(instrument_signals), len(bars[name]), took, k / took))
+
+        rows, score = ranked(table, args.rank, args.min_trades)
+        print("{:>4} {:>8} {:>8} {:>7} {:>11} {:>11} {:>7} {:>7} {:>7}".format(
+            "#", "stop", "limit", "adjust", "pnl", "max dd", "trades", "win %", "PF"))
+        for n, i in enumerate(rows[:args.top], 1):
+            s = backtest.summary(table, i)
+            print("{:>4} {:>8g} {:>8g} {:>7g} {:>11.1f} {:>11.1f} {:>7} {:>7} {:>7}".format(
+                n, table['stop'][i], table['limit'][i], table['adjust'][i], s['pnl'], s['max_drawdown'],
+                s['trades'], "%.1f" % (100 * s['win_rate']) if s['win_rate'] is not None else "-",
+                "%.2f" % s['profit_factor'] if s['profit_factor'] else "-"))
+        if not len(rows):
+            print("No set with %d trades or more" % args.min_trades)
+
+        slug = ig_store.slug(name)
+        axes = [p for p in PARAMS if p in grid and len(grid[p]) > 1]
+        if len(axes) >= 2:
+            path = os.path.join(args.out, "sweep_%s_%s_%s" % (slug, axes[0], axes[1]))
+            written = heatmap(path, name, axes[0], axes[1], args.rank, *pivot(table, axes[0], axes[1], score))
+            print("Heatmap:", ", ".join(written))
+        if args.csv:
+            path = os.path.join(args.out, "sweep_%s.csv" % slug)
+            columns = list(table)
+            with open(path, "w", newline="") as f:
+                w = csv.writer(f)
+                w.writerow(columns + [args.rank])
+                for i in range(k):
+                    w.writerow([table[c][i] for c in columns] + [score[i]])
+            print("Results:", path)
+
+
+if __name__ == "__main__":
+    main()